@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of filtering one OptiTrack position at a time with LowPassFilter
+against the previous way in log_flight.py, a scipy.signal.sosfilt call per axis on
+a one-element list with the filter state passed in and out. Run it from the
+repository root:
+
+    python -m benchmarks.lowpass_filter --design butter --order 4 --cutoff 0.1
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+import scipy.signal
+
+from flight.LowPassFilter import DESIGNS, LowPassFilter, design
+
+
+class LegacyFilter:
+    """The previous filter, one sosfilt call per axis and sample. Its state
+    starts at the steady state of an input of 1, as it did, so its output rises
+    or falls from 1 to the first position."""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.filtered = np.zeros(3)
+        self.zi = [
+            scipy.signal.sosfilt_zi(sos),
+            scipy.signal.sosfilt_zi(sos),
+            scipy.signal.sosfilt_zi(sos),
+        ]
+
+    def update(self, position):
+        for axis in range(3):
+            (y, self.zi[axis]) = scipy.signal.sosfilt(
+                self.sos, [position[axis]], zi=self.zi[axis]
+            )
+            # the previous code assigned y itself, which NumPy 2 refuses
+            self.filtered[axis] = y[0]
+        return self.filtered
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--design", choices=DESIGNS[:-1], default="butter")
+    parser.add_argument("--order", type=int, default=4)
+    parser.add_argument("--cutoff", type=float, default=0.1)
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sos = design(args.design, args.order, args.cutoff)
+    rng = np.random.default_rng(0)
+    positions = np.cumsum(rng.normal(scale=1e-3, size=(args.samples, 3)), axis=0)
+    # rows of the rigid body array handed over by NatNetClient are NumPy arrays
+    samples = list(positions)
+
+    filters = {
+        "legacy": lambda: LegacyFilter(sos),
+        "current": lambda: LowPassFilter(sos),
+    }
+
+    # Both have to agree before their timings mean anything. LowPassFilter
+    # starts at the first sample instead, so for the comparison it starts from
+    # the legacy filter's state.
+    legacy = LegacyFilter(sos)
+    current = LowPassFilter(sos)
+    current.reset([1.0, 1.0, 1.0])
+    outputs = {}
+    for name, f in (("legacy", legacy), ("current", current)):
+        outputs[name] = np.array([list(f.update(sample)) for sample in samples])
+    assert np.allclose(outputs["legacy"], outputs["current"], atol=1e-9)
+
+    print(
+        "{} order {} at {} Nyquist, {} samples of 3 axes".format(
+            args.design, args.order, args.cutoff, args.samples
+        )
+    )
+    timings = {}
+    for name, make in filters.items():
+        f = make()
+        runs = timeit.repeat(
+            lambda: [f.update(sample) for sample in samples],
+            number=1,
+            repeat=args.repeat,
+        )
+        timings[name] = min(runs) / len(samples)
+        print(
+            "{:>10}: {:8.2f} us/sample, {:5.1f}x".format(
+                name, timings[name] * 1e6, timings["legacy"] / timings[name]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
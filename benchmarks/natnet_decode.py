@@ -0,0 +1,257 @@
+"""
+Micro-benchmark of the NatNet frame decoder in NatNetClient against the previous,
+slice-per-field decoder, both with everything decoded and subscribed to a subset
+of the rigid bodies only.
+
+Frames are synthesised by NatNetServerSimulator with a configurable number of
+rigid bodies, markers and marker sets, so the comparison can be run without a
+Motive server. Run it from the repository root:
+
+    python -m benchmarks.natnet_decode --bodies 4 --markers 6 --marker-sets 4
+
+Frames can also be taken from a recording made with --optitrack_record (see
+NatNetRecorder):
+
+    python -m benchmarks.natnet_decode --recording data/flight.natnet --subscribe 1
+"""
+
+import argparse
+import struct
+import timeit
+
+from flight.NatNetClient import NatNetClient
+from flight.NatNetRecorder import NatNetReplayer
+from flight.NatNetServerSimulator import NatNetServerSimulator, circle
+
+Vector3 = struct.Struct("<fff")
+Quaternion = struct.Struct("<ffff")
+FloatValue = struct.Struct("<f")
+DoubleValue = struct.Struct("<d")
+
+
+class LegacyDecoder:
+    """The previous decoder, which re-slices the buffer at every field and copies
+    the remainder of the packet for every marker set name"""
+
+    def __init__(self, version=(3, 0, 0, 0)):
+        self.version = version
+        self.rigidBodyListener = None
+
+    def unpackRigidBody(self, data):
+        offset = 0
+        id = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+        pos = Vector3.unpack(data[offset : offset + 12])
+        offset += 12
+        rot = Quaternion.unpack(data[offset : offset + 16])
+        offset += 16
+        markerCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+        markerCountRange = range(0, markerCount)
+
+        if self.rigidBodyListener is not None:
+            self.rigidBodyListener(id, pos, rot)
+
+        for i in markerCountRange:
+            pos = Vector3.unpack(data[offset : offset + 12])
+            offset += 12
+
+        if self.version[0] >= 2:
+            for i in markerCountRange:
+                id = int.from_bytes(data[offset : offset + 4], byteorder="little")
+                offset += 4
+            for i in markerCountRange:
+                size = FloatValue.unpack(data[offset : offset + 4])
+                offset += 4
+            (markerError,) = FloatValue.unpack(data[offset : offset + 4])
+            offset += 4
+
+        if (
+            (self.version[0] == 2 and self.version[1] >= 6)
+            or self.version[0] > 2
+            or self.version[0] == 0
+        ):
+            (param,) = struct.unpack("h", data[offset : offset + 2])
+            trackingValid = (param & 0x01) != 0
+            offset += 2
+
+        return offset
+
+    def unpackMocapData(self, data):
+        data = memoryview(data)
+        offset = 0
+
+        frameNumber = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+        markerSetCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+
+        for i in range(0, markerSetCount):
+            modelName, separator, remainder = bytes(data[offset:]).partition(b"\0")
+            offset += len(modelName) + 1
+            markerCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+            offset += 4
+            for j in range(0, markerCount):
+                pos = Vector3.unpack(data[offset : offset + 12])
+                offset += 12
+
+        unlabeledMarkersCount = int.from_bytes(
+            data[offset : offset + 4], byteorder="little"
+        )
+        offset += 4
+        for i in range(0, unlabeledMarkersCount):
+            pos = Vector3.unpack(data[offset : offset + 12])
+            offset += 12
+
+        rigidBodyCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+        for i in range(0, rigidBodyCount):
+            offset += self.unpackRigidBody(data[offset:])
+
+        if self.version[0] > 2:
+            skeletonCount = int.from_bytes(
+                data[offset : offset + 4], byteorder="little"
+            )
+            offset += 4
+            for i in range(0, skeletonCount):
+                id = int.from_bytes(data[offset : offset + 4], byteorder="little")
+                offset += 4
+                count = int.from_bytes(data[offset : offset + 4], byteorder="little")
+                offset += 4
+                for j in range(0, count):
+                    offset += self.unpackRigidBody(data[offset:])
+
+            labeledMarkerCount = int.from_bytes(
+                data[offset : offset + 4], byteorder="little"
+            )
+            offset += 4
+            for i in range(0, labeledMarkerCount):
+                id = int.from_bytes(data[offset : offset + 4], byteorder="little")
+                offset += 4
+                pos = Vector3.unpack(data[offset : offset + 12])
+                offset += 12
+                size = FloatValue.unpack(data[offset : offset + 4])
+                offset += 4
+                (param,) = struct.unpack("h", data[offset : offset + 2])
+                offset += 2
+
+            forcePlateCount = int.from_bytes(
+                data[offset : offset + 4], byteorder="little"
+            )
+            offset += 4
+            for i in range(0, forcePlateCount):
+                offset += 4
+                channelCount = int.from_bytes(
+                    data[offset : offset + 4], byteorder="little"
+                )
+                offset += 4
+                for j in range(0, channelCount):
+                    frameCount = int.from_bytes(
+                        data[offset : offset + 4], byteorder="little"
+                    )
+                    offset += 4
+                    for k in range(0, frameCount):
+                        val = int.from_bytes(
+                            data[offset : offset + 4], byteorder="little"
+                        )
+                        offset += 4
+
+        (latency,) = FloatValue.unpack(data[offset : offset + 4])
+        offset += 4
+        timecode = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+        timecodeSub = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        offset += 4
+        (timestamp,) = DoubleValue.unpack(data[offset : offset + 8])
+        offset += 8
+        (param,) = struct.unpack("h", data[offset : offset + 2])
+        offset += 2
+
+    def processMessage(self, data):
+        messageID = int.from_bytes(data[0:2], byteorder="little")
+        if messageID == NatNetClient.NAT_FRAMEOFDATA:
+            self.unpackMocapData(data[4:])
+
+
+def collect_bodies(decoder, process, frames):
+    """Run one decoder over all frames and return the rigid bodies it reported"""
+    bodies = []
+    decoder.rigidBodyListener = lambda id, pos, rot: bodies.append((id, pos, rot))
+    for frame in frames:
+        process(frame)
+    decoder.rigidBodyListener = None
+    return bodies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recording", type=str, default=None)
+    parser.add_argument("--frames", type=int, default=360)
+    parser.add_argument("--bodies", type=int, default=4)
+    parser.add_argument("--markers", type=int, default=6)
+    parser.add_argument("--marker-sets", type=int, default=4)
+    parser.add_argument("--unlabeled", type=int, default=10)
+    parser.add_argument("--labeled", type=int, default=20)
+    parser.add_argument(
+        "--subscribe",
+        nargs="+",
+        type=int,
+        default=[1],
+        help="rigid body IDs for the subscribed decoder",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.recording is not None:
+        frames = [
+            packet
+            for _, packet in NatNetReplayer(args.recording).packets()
+            if struct.unpack_from("<H", packet)[0] == NatNetClient.NAT_FRAMEOFDATA
+        ]
+    else:
+        simulator = NatNetServerSimulator(
+            bodies=args.bodies,
+            markers=args.markers,
+            markerSets=args.marker_sets,
+            unlabeledMarkers=args.unlabeled,
+            labeledMarkers=args.labeled,
+            motion=circle,
+        )
+        frames = [simulator.packFrame(i, i / 360.0) for i in range(args.frames)]
+
+    legacy = LegacyDecoder()
+    client = NatNetClient()
+    subscribed = NatNetClient()
+    subscribed.subscribe(
+        rigidBodyIds=args.subscribe, kinds=NatNetClient.DATA_RIGID_BODIES
+    )
+    decoders = {
+        "legacy": (legacy, legacy.processMessage),
+        "current": (client, client.processMessage),
+        "subscribed": (subscribed, subscribed.processMessage),
+    }
+
+    # All decoders have to agree before their timings mean anything
+    reference = collect_bodies(legacy, legacy.processMessage, frames)
+    for name, (decoder, process) in decoders.items():
+        expected = reference
+        if name == "subscribed":
+            expected = [body for body in reference if body[0] in args.subscribe]
+        assert collect_bodies(decoder, process, frames) == expected, name
+
+    print("{} frames of {} bytes".format(len(frames), len(frames[0])))
+    timings = {}
+    for name, (decoder, process) in decoders.items():
+        runs = timeit.repeat(
+            lambda: [process(frame) for frame in frames], number=1, repeat=args.repeat
+        )
+        timings[name] = min(runs) / len(frames)
+        print(
+            "{:>10}: {:8.2f} us/frame, {:5.1f}x".format(
+                name, timings[name] * 1e6, timings["legacy"] / timings[name]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Load test of NatNetClient against NatNetServerSimulator. For every combination of
+frame rate and rigid body count, the simulator runs in its own process and the
+client receives for a while, doing the same per-frame work as LogFlight. The
+receive counters then show at which load frames start getting lost. Run it from
+the repository root:
+
+    python -m benchmarks.natnet_load --rates 120 360 1000 --bodies 1 10 50
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import flight.utils as util
+from flight.NatNetClient import NatNetClient
+from flight.PoseMailbox import PoseMailbox
+
+SIMULATOR = os.path.join(
+    os.path.dirname(__file__), "..", "flight", "NatNetServerSimulator.py"
+)
+
+
+def run(rate, bodies, markers, duration):
+    """Receive one simulated stream and return the client's receive counters"""
+    mailboxes = [PoseMailbox() for _ in range(bodies)]
+
+    def receive(frame):
+        # What LogFlight does with every frame
+        positions = util.ot2control(frame.bodies["pos"])
+        for row, mailbox in enumerate(mailboxes[: frame.count]):
+            rotation = frame.bodies["rot"][row]
+            mailbox.write(
+                positions[row],
+                util.quat2euler(rotation),
+                util.ot2control_quat(rotation),
+                frame_number=frame.frameNumber,
+            )
+
+    client = NatNetClient()
+    client.serverIPAddress = "127.0.0.1"
+    client.receiveBufferSize = 1 << 20
+    client.subscribe(kinds=NatNetClient.DATA_RIGID_BODIES)
+    client.rigidBodyFrameListener = receive
+    client.run()
+
+    simulator = subprocess.Popen(
+        [
+            sys.executable,
+            SIMULATOR,
+            "--rate={}".format(rate),
+            "--bodies={}".format(bodies),
+            "--markers={}".format(markers),
+            "--duration={}".format(duration),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    simulator.wait()
+    time.sleep(0.2)
+    client.stop()
+    return client.receiveStats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", nargs="+", type=float, default=[120, 360, 1000])
+    parser.add_argument("--bodies", nargs="+", type=int, default=[1, 10, 50])
+    parser.add_argument("--markers", type=int, default=6)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(
+        "{:>6} {:>6} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+            "rate", "bodies", "frames", "missed", "kernel", "backlogged", "loss"
+        )
+    )
+    for rate in args.rates:
+        for bodies in args.bodies:
+            stats = run(rate, bodies, args.markers, args.duration)
+            expected = max(int(rate * args.duration), 1)
+            print(
+                "{:>6.0f} {:>6} {:>8} {:>8} {:>8} {:>10} {:>7.1f}%".format(
+                    rate,
+                    bodies,
+                    stats.frames,
+                    stats.missedFrames,
+                    stats.kernelDrops,
+                    stats.backlogged,
+                    100 * np.clip(1 - stats.frames / expected, 0, 1),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
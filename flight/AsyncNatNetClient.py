@@ -0,0 +1,163 @@
+"""
+Contains the AsyncNatNetClient class, which runs the NatNet client on an asyncio
+event loop instead of in receive threads.
+"""
+
+import asyncio
+import collections
+import struct
+import time
+
+from flight.NatNetClient import NatNetClient
+
+
+class _NatNetProtocol(asyncio.DatagramProtocol):
+    """Hands every datagram of one socket to the client, with the stats the
+    socket's packets are counted in"""
+
+    def __init__(self, client, stats):
+        self._client = client
+        self._stats = stats
+
+    def datagram_received(self, data, addr):
+        self._client._datagramReceived(data, self._stats)
+
+
+class AsyncNatNetClient(NatNetClient):
+    """
+    NatNet client driven by an asyncio event loop. Packets are decoded on the loop
+    as they arrive, so the mocap feed and e.g. a flight loop can share one thread:
+
+        client = AsyncNatNetClient()
+        await client.start()
+        version = await client.negotiateVersion()
+        descriptions = await client.requestModelDefinitions()
+        async for frame in client.frames():
+            ...
+        await client.stop()
+
+    The listeners of NatNetClient work as before, except for rigidBodyFrameListener,
+    which is used to feed frames(). Frames are buffered up to frameQueueSize, after
+    which the oldest frame is dropped and counted in droppedFrames.
+    """
+
+    # Replies the server sends to each command
+    RESPONSES = {
+        NatNetClient.NAT_PING: NatNetClient.NAT_PINGRESPONSE,
+        NatNetClient.NAT_REQUEST: NatNetClient.NAT_RESPONSE,
+        NatNetClient.NAT_REQUEST_MODELDEF: NatNetClient.NAT_MODELDEF,
+    }
+
+    def __init__(self, frameQueueSize=4):
+        super().__init__()
+        self.frameQueueSize = frameQueueSize
+        self.droppedFrames = 0
+        self.rigidBodyFrameListener = self.__queueFrame
+
+        self.__dataTransport = None
+        self.__commandTransport = None
+        self.__frameQueue = None
+        # Futures waiting for a reply, per reply message ID, oldest first
+        self.__pending = collections.defaultdict(collections.deque)
+
+    async def start(self):
+        """Open the data and command sockets and start receiving"""
+        loop = asyncio.get_running_loop()
+        self.__frameQueue = asyncio.Queue(maxsize=self.frameQueueSize)
+
+        dataSocket = self.createDataSocket(self.dataPort)
+        dataSocket.setblocking(False)
+        self.__dataTransport, _ = await loop.create_datagram_endpoint(
+            lambda: _NatNetProtocol(self, self.receiveStats), sock=dataSocket
+        )
+
+        commandSocket = self.createCommandSocket()
+        commandSocket.setblocking(False)
+        self.__commandTransport, _ = await loop.create_datagram_endpoint(
+            lambda: _NatNetProtocol(self, self.commandStats), sock=commandSocket
+        )
+
+    async def stop(self):
+        """Close the sockets, fail pending commands and end frames()"""
+        for transport in (self.__dataTransport, self.__commandTransport):
+            if transport is not None:
+                transport.close()
+        self.__dataTransport = None
+        self.__commandTransport = None
+
+        for futures in self.__pending.values():
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+        self.__pending.clear()
+
+        if self.__frameQueue is not None:
+            self.__putFrame(None)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def frames(self):
+        """Iterate over snapshots of the rigid bodies in each frame, see
+        RigidBodyFrame, until the client is stopped"""
+        while True:
+            frame = await self.__frameQueue.get()
+            if frame is None:
+                return
+            yield frame
+
+    async def command(self, command, commandStr="", timeout=1.0):
+        """Send a command to the server and wait for its reply, which is returned
+        as decoded by processMessage"""
+        future = asyncio.get_running_loop().create_future()
+        responses = self.__pending[self.RESPONSES[command]]
+        responses.append(future)
+        self.__commandTransport.sendto(
+            self.packCommand(command, commandStr),
+            (self.serverIPAddress, self.commandPort),
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if future in responses:
+                responses.remove(future)
+
+    async def negotiateVersion(self, timeout=1.0):
+        """Ping the server. The NatNet version it replies with is used for
+        decoding from then on, and returned."""
+        return await self.command(self.NAT_PING, timeout=timeout)
+
+    async def requestModelDefinitions(self, timeout=1.0):
+        """Return the descriptions of all marker sets, rigid bodies and skeletons"""
+        return await self.command(self.NAT_REQUEST_MODELDEF, timeout=timeout)
+
+    def _datagramReceived(self, data, stats):
+        arrival = time.perf_counter()
+        stats.packet(arrival)
+        if self.packetListener is not None:
+            self.packetListener(data, len(data))
+        try:
+            messageID, result = self.processMessage(data, arrival)
+        except (struct.error, ValueError, IndexError):
+            stats.malformed += 1
+            return
+        futures = self.__pending.get(messageID)
+        while futures:
+            future = futures.popleft()
+            if not future.done():
+                future.set_result(result)
+                break
+
+    def __queueFrame(self, frame):
+        self.__putFrame(frame.copy())
+
+    def __putFrame(self, frame):
+        # Drop the oldest frame rather than block the event loop
+        if self.__frameQueue.full():
+            self.__frameQueue.get_nowait()
+            self.droppedFrames += 1
+        self.__frameQueue.put_nowait(frame)
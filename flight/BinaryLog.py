@@ -0,0 +1,173 @@
+"""
+Contains the binary log format written by FileLogger with binary=True, and functions
+to read it back and convert it to the CSV layout FileLogger writes otherwise.
+
+A binary log starts with a header (magic, format version and the length of a JSON
+description), followed by the JSON description of the columns and padding to a
+multiple of 8 bytes. After that come fixed-size records, one per row, laid out as
+described by the record dtype in the description: the time tick as uint32, then
+every variable of the enabled configs under its header name.
+
+Binary logs can be converted to CSV from the command line:
+
+    python flight/BinaryLog.py flight.bin
+"""
+
+import argparse
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"CFLOGBIN"
+FORMAT_VERSION = 1
+
+# Magic, format version and length of the JSON description
+Header = struct.Struct("<8sII")
+
+# Type of the time tick column and default types of the variables, by config type.
+# Crazyflie log variables are logged as floats, external data as Python floats.
+TIME_TICK_TYPE = "<u4"
+DEFAULT_TYPES = {"CF": "<f4", "EXT": "<f8"}
+
+# Types of Crazyflie log variables by the type they are fetched as (see
+# flight.LogPacker), so integers are stored exactly. cflib unpacks FP16 to a float.
+FETCH_TYPES = {
+    "uint8_t": "<u1",
+    "int8_t": "<i1",
+    "uint16_t": "<u2",
+    "int16_t": "<i2",
+    "FP16": "<f4",
+    "uint32_t": "<u4",
+    "int32_t": "<i4",
+    "float": "<f4",
+}
+
+
+def columns_from_configs(cfg_defs, enabled_configs, types=None):
+    """Return the description of the columns of the enabled configs, in logging
+    order. The NumPy types of a config's variables are taken from types, a dict by
+    config name, or from "types" in the config, and default to DEFAULT_TYPES by
+    config type."""
+    columns = [
+        {"name": "timeTick", "config": None, "variable": None, "type": TIME_TICK_TYPE}
+    ]
+    for cfg_name in enabled_configs:
+        cfg = cfg_defs[cfg_name]
+        cfg_types = (types or {}).get(cfg_name) or cfg.get(
+            "types", [DEFAULT_TYPES.get(cfg["type"], "<f8")] * len(cfg["variables"])
+        )
+        for var, header, type in zip(cfg["variables"], cfg["headers"], cfg_types):
+            columns.append(
+                {"name": header, "config": cfg_name, "variable": var, "type": type}
+            )
+    return columns
+
+
+def record_dtype(columns):
+    """Return the packed structured NumPy dtype of one record"""
+    return np.dtype([(column["name"], column["type"]) for column in columns])
+
+
+class BinaryLogWriter:
+    """Encodes the header and rows of a binary log"""
+
+    def __init__(self, columns, metadata=None):
+        self.columns = columns
+        self.dtype = record_dtype(columns)
+        self.metadata = metadata or {}
+        # All fields are scalars without padding, so a struct packs a record
+        self._record = struct.Struct(
+            "<" + "".join(self.dtype[name].char for name in self.dtype.names)
+        )
+        # integer variables, which come in rows of floats
+        self._integers = [
+            i
+            for i, column in enumerate(columns)
+            if column["variable"] is not None and self.dtype[i].kind in "iu"
+        ]
+
+    def header(self):
+        """Return the header and column description, padded to 8 bytes"""
+        description = json.dumps(
+            {
+                "columns": self.columns,
+                "record_size": self.dtype.itemsize,
+                "metadata": self.metadata,
+            }
+        ).encode("utf-8")
+        description += b" " * (-(Header.size + len(description)) % 8)
+        return Header.pack(MAGIC, FORMAT_VERSION, len(description)) + description
+
+    def encode(self, row):
+        """Return one row (time tick followed by the values) as a record"""
+        if self._integers:
+            row = list(row)
+            for i in self._integers:
+                row[i] = int(row[i])
+        return self._record.pack(*row)
+
+    def encode_rows(self, rows):
+        """Return a batch of rows as consecutive records"""
+        return b"".join(map(self.encode, rows))
+
+
+def read_header(fileName):
+    """Return the description of a binary log and the offset of its first record"""
+    with open(fileName, "rb") as f:
+        head = f.read(Header.size)
+        if len(head) < Header.size:
+            raise ValueError("{} is not a binary log".format(fileName))
+        magic, version, length = Header.unpack(head)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("{} is not a binary log".format(fileName))
+        description = json.loads(f.read(length).decode("utf-8"))
+    return description, Header.size + length
+
+
+def load(fileName):
+    """Memory-map the records of a binary log as a structured array, without
+    reading or copying them. Fields are named after the logcfg headers.
+
+    A record that was still being written when logging stopped is left out.
+    """
+    description, offset = read_header(fileName)
+    dtype = record_dtype(description["columns"])
+    with open(fileName, "rb") as f:
+        f.seek(0, 2)
+        count = (f.tell() - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fileName, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def to_csv(fileName, csvName, chunkSize=65536):
+    """Write the records of a binary log to a CSV file in FileLogger's layout"""
+    return write_csv(load(fileName), csvName, chunkSize)
+
+
+def write_csv(records, csvName, chunkSize=65536):
+    """Write a structured array to a CSV file in FileLogger's layout"""
+    with open(csvName, "w") as csv:
+        csv.write(", ".join(records.dtype.names) + "\n")
+        for start in range(0, len(records), chunkSize):
+            # tolist() turns the records into tuples of Python numbers, which
+            # print like the values FileLogger writes to CSV logs
+            rows = records[start : start + chunkSize].tolist()
+            csv.write("".join(", ".join(map(str, row)) + "\n" for row in rows))
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", type=str)
+    parser.add_argument(
+        "csv", type=str, nargs="?", default=None, help="defaults to the log's name"
+    )
+    args = parser.parse_args()
+
+    csvName = args.csv
+    if csvName is None:
+        csvName = (args.log[:-4] if args.log.endswith(".bin") else args.log) + ".csv"
+    count = to_csv(args.log, csvName)
+    print("Wrote {} rows to {}".format(count, csvName))
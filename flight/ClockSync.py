@@ -0,0 +1,131 @@
+"""
+Contains the ClockSync class, which maps the Crazyflie's time tick to the host's
+time.monotonic() clock, fitted online from the arrival times of log packets.
+
+A log packet carries the tick at which the Crazyflie sampled it and arrives some
+transport delay later. Delays are never negative and usually close to their
+minimum, so the packets with the least delay lie on a line: host time = offset +
+rate * tick. The fit takes the least delayed packet of each of a few time slices of
+a recent window and fits a line through them, which follows the drift between the
+two clocks and ignores packets held up by the radio or the USB stack.
+
+Host times mapped from ticks are therefore the times at which samples would have
+arrived with the minimum delay. The delay of every packet above that minimum is
+kept in a histogram, which shows the transport latency jitter.
+"""
+
+import numpy as np
+
+from flight.Histogram import Histogram
+
+# Crazyflie ticks are milliseconds, in an uint32 that wraps after about 49 days
+TICK_SECONDS = 1e-3
+TICK_WRAP = 1 << 32
+
+
+def fit(ticks, hostTimes, slices=8):
+    """Fit host time = offset + rate * tick seconds through the least delayed
+    sample of each of a number of time slices. Returns (offset, rate)."""
+    ticks = np.asarray(ticks, dtype=np.float64) * TICK_SECONDS
+    hostTimes = np.asarray(hostTimes, dtype=np.float64)
+    delays = hostTimes - ticks
+    x, y = [], []
+    for part in np.array_split(np.arange(len(ticks)), slices):
+        if part.size:
+            i = part[np.argmin(delays[part])]
+            x.append(ticks[i])
+            y.append(hostTimes[i])
+    if len(x) < 2 or x[-1] == x[0]:
+        # no drift to be seen yet, only the offset
+        return float(min(delays)), 1.0
+    rate, offset = np.polyfit(x, y, 1)
+    # the line through the minima may still pass above a sample in between
+    offset += min(0.0, float((hostTimes - offset - rate * ticks).min()))
+    return float(offset), float(rate)
+
+
+class ClockSync:
+    """
+    Online fit of the host's time.monotonic() against the Crazyflie's time tick.
+
+    Call update() with the tick of every log packet and the time it arrived. The
+    fit is redone every refitEvery samples over the latest window samples, so an
+    update is usually just storing two numbers. Until minSamples arrived, the
+    clocks are assumed to run at the same rate.
+    """
+
+    def __init__(self, window=1024, refitEvery=64, minSamples=16, slices=8):
+        self.window = window
+        self.refitEvery = refitEvery
+        self.minSamples = minSamples
+        self.slices = slices
+
+        self._ticks = np.zeros(window)
+        self._hostTimes = np.zeros(window)
+        self._count = 0
+        self._lastTick = None
+        self._wraps = 0
+
+        # host time of tick 0, and host seconds per tick second
+        self.offset = None
+        self.rate = 1.0
+        self.delay = Histogram(0.01, 1000, unit=" ms")
+
+    @property
+    def synchronised(self):
+        """Whether the clocks have been fitted on enough samples"""
+        return self._count >= self.minSamples
+
+    @property
+    def drift(self):
+        """Drift of the Crazyflie's clock against the host's, in parts per million"""
+        return (self.rate - 1.0) * 1e6
+
+    def update(self, tick, hostTime):
+        """Account for a log packet of time tick that arrived at time.monotonic()
+        hostTime"""
+        if self._lastTick is not None and tick < self._lastTick - TICK_WRAP // 2:
+            self._wraps += 1
+        self._lastTick = tick
+        tick += self._wraps * TICK_WRAP
+
+        index = self._count % self.window
+        self._ticks[index] = tick
+        self._hostTimes[index] = hostTime
+        self._count += 1
+
+        if self.offset is None:
+            self.offset = hostTime - tick * TICK_SECONDS
+        elif self._count >= self.minSamples and (
+            self._count == self.minSamples or self._count % self.refitEvery == 0
+        ):
+            count = min(self._count, self.window)
+            # oldest sample first, so the slices are in time order
+            order = np.roll(np.arange(count), -(self._count % count))
+            self.offset, self.rate = fit(
+                self._ticks[order], self._hostTimes[order], self.slices
+            )
+
+        delay = hostTime - self.offset - self.rate * tick * TICK_SECONDS
+        # the fit lags the clocks a little, so a delay can come out just below 0
+        self.delay.record(max(delay, 0.0) * 1e3)
+
+    def to_host(self, tick):
+        """Return the host time.monotonic() of a Crazyflie tick, nan before the
+        first update"""
+        if self.offset is None:
+            return float("nan")
+        # a tick from just after a wrap not seen yet, or from just before the last
+        if tick < self._lastTick - TICK_WRAP // 2:
+            tick += TICK_WRAP
+        elif tick > self._lastTick + TICK_WRAP // 2:
+            tick -= TICK_WRAP
+        tick += self._wraps * TICK_WRAP
+        return self.offset + self.rate * tick * TICK_SECONDS
+
+    def summary(self):
+        if self.offset is None:
+            return "no samples"
+        return "drift {:.1f} ppm, delay above minimum: {}".format(
+            self.drift, self.delay
+        )
@@ -0,0 +1,66 @@
+"""
+Contains the ExtposForwarder class, which sends OptiTrack positions to the Crazyflie
+as soon as their frame is decoded, on the NatNet thread, instead of whenever the
+flight loop next wakes up.
+"""
+
+import time
+
+from flight.Histogram import Histogram
+
+
+class ExtposForwarder:
+    """
+    Forwards every decimation-th frame to send(x, y, z), e.g. cf.extpos.send_extpos,
+    but no more than maxRate per second, to leave room on the radio for the log
+    and the setpoints. Frames in between are dropped, the Crazyflie only ever
+    needs the latest position.
+
+    latency is the distribution of the time from the arrival of a frame's packet
+    to its position being handed to the radio, in milliseconds. decimated and
+    rateLimited count the frames dropped either way.
+    """
+
+    def __init__(self, send, decimation=1, maxRate=None):
+        self.send = send
+        self.decimation = decimation
+        self.minInterval = 1.0 / maxRate if maxRate else 0.0
+        self.enabled = True
+
+        self.frames = 0
+        self.sent = 0
+        self.decimated = 0
+        self.rateLimited = 0
+        self.lastLatency = 0.0
+        self.latency = Histogram(0.01, 1000, unit=" ms")
+        self.__lastSend = None
+
+    def forward(self, position, arrival):
+        """Send position, of a frame whose packet arrived at time.perf_counter()
+        arrival, unless the frame is decimated or the rate is capped. Returns
+        whether it was sent."""
+        if not self.enabled:
+            return False
+        self.frames += 1
+        if self.frames % self.decimation:
+            self.decimated += 1
+            return False
+        now = time.perf_counter()
+        if self.__lastSend is not None and now - self.__lastSend < self.minInterval:
+            self.rateLimited += 1
+            return False
+
+        self.send(*position)
+        self.__lastSend = done = time.perf_counter()
+        self.sent += 1
+        self.lastLatency = (done - arrival) * 1e3
+        self.latency.record(self.lastLatency)
+        return True
+
+    def summary(self):
+        return (
+            "{} of {} frames sent ({} decimated, {} over the rate cap), "
+            "frame to radio: {}".format(
+                self.sent, self.frames, self.decimated, self.rateLimited, self.latency
+            )
+        )
@@ -5,9 +5,38 @@ Author: Sven Pfeiffer, MAVLab
 
 import time
 import json
+import queue
+import threading
+from functools import partial
 
+import numpy as np
 from cflib.crazyflie.log import LogConfig
 
+from flight.BinaryLog import FETCH_TYPES, BinaryLogWriter, columns_from_configs
+from flight.ClockSync import ClockSync
+from flight.LogOutput import RotatingFile
+from flight.LogPacker import RowAssembler, fetch_types, plan_blocks
+from flight.ParquetLog import ParquetLogWriter
+from flight.StreamLog import HOST_TIME_TYPE, stream_columns, stream_file_name
+from flight.TelemetryTap import TelemetryTap, remove_tap, tap_exists
+
+
+class _Sink:
+    """An open logfile and how to encode rows for it"""
+
+    def __init__(self, file, encode_rows):
+        self.file = file
+        self.encode_rows = encode_rows
+
+    def write(self, rows):
+        self.file.write(self.encode_rows(rows))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
 
 class FileLogger:
     """
@@ -17,8 +46,71 @@ class FileLogger:
     external config.
     """
 
-    def __init__(self, crazyflie, configName, fileName):
-        """ Initialize and run the example with the specified link_uri """
+    def __init__(
+        self,
+        crazyflie,
+        configName,
+        fileName,
+        background=False,
+        queueSize=1024,
+        binary=False,
+        streams=False,
+        compression=None,
+        rotateBytes=None,
+        rotateSeconds=None,
+        maxSegments=None,
+        parquet=False,
+        metadata=None,
+        syncClock=False,
+        tap=None,
+        tapRows=4096,
+        tapReplace=False,
+    ):
+        """ Initialize and run the example with the specified link_uri
+
+        With binary=True, the log is written in the fixed-record format of
+        flight.BinaryLog instead of as CSV. With parquet=True, it is written to a
+        Parquet file with a typed column per variable, a row group at a time (see
+        flight.ParquetLog). metadata, e.g. the options of the run, is stored in
+        the header of binary and Parquet logs.
+
+        With streams=True, every config is logged at its own rate to a binary
+        file of its own (see flight.StreamLog), with the host time of each
+        sample and, for CF configs, the Crazyflie time tick. Otherwise a row
+        of all configs is written whenever the first CF config arrives.
+
+        With background=True, rows are not written on cflib's callback thread but
+        pushed into a queue of at most queueSize rows, which a writer thread
+        formats and writes in batches. Call end() to write out the remaining
+        rows and close the files. If writing fails, later rows are dropped and
+        counted in dropped_rows, and end() raises the error.
+
+        With a compression ("gzip", "zstd", "lz4" or "auto") or a rotation limit,
+        logfiles are written as compressed segments of at most rotateBytes
+        (uncompressed) or rotateSeconds, of which the latest maxSegments are kept
+        (see flight.LogOutput). The background writer is used then, so the
+        callbacks never wait for the compressor or for files to be rotated.
+        Parquet logs are not rotated, they use the compression as their codec
+        and are always written in the background too.
+
+        The Crazyflie's clock is fitted to the host's time.monotonic() from the
+        arrival of log packets (see flight.ClockSync, available as clock). With
+        syncClock=True, rows have a syncTime column after timeTick with the host
+        time of the tick, and every EXT config a column hostTime_<config> with
+        the host time its data was registered. Stream logs have host times of
+        their own already.
+
+        With a tap name, every row is also published to a ring buffer of the
+        latest tapRows rows in the shared memory block of that name, which other
+        processes can read live with flight.TelemetryTap.TelemetryTapReader.
+        Publishing never waits for readers. A block of that name that is already
+        there raises FileExistsError, unless tapReplace removes it.
+        """
+        # what __del__ closes, set first so it can run after __init__ failed
+        self._logfile = None
+        self._sinks = {}
+        self.tap = None
+
         self._cf = crazyflie
         self.is_connected = False
 
@@ -28,19 +120,121 @@ class FileLogger:
 
         # list of enabled configurations
         self._enabled_configs = []
-        # dictionary to hold data from callbacks
-        self._data_dict = {}
+
+        # column layout, fixed at start(): the latest value of every variable
+        # of the enabled configs in one row, the slice of the row each config
+        # occupies and the slot of each of its variables
+        self._values = None
+        self._config_slices = {}
+        self._config_slots = {}
+        # slots and row assembler of the running log blocks, by name
+        self._blocks = {}
+        # slot of the host time of every EXT config, with syncClock
+        self._sync_clock = syncClock and not streams
+        self._host_time_slots = {}
+        self.clock = ClockSync()
 
         # running LogConfigs
         self._lg_conf = (
             []
         )  # can we scrap this? or do we need to be able to access these?
 
-        # open logfile to write to
-        self._logfile = open(fileName, "w")
+        # open logfile to write to, or in stream mode one per config at start()
+        self._binary = binary
+        self._streams = streams
+        self._parquet = parquet
+        self._metadata = metadata
+        self._file_name = fileName
+        self._rotation = None
+        if parquet:
+            if streams or rotateBytes or rotateSeconds:
+                raise ValueError("Parquet logs can't be split into streams or rotated")
+            self._compression = compression
+            background = True
+        elif compression is not None or rotateBytes or rotateSeconds:
+            self._rotation = dict(
+                compression=compression,
+                max_bytes=rotateBytes,
+                max_seconds=rotateSeconds,
+                max_segments=maxSegments,
+            )
+            background = True
+        self._logfile = None if streams or parquet else self._open_output(fileName)
+        # shared memory tap of the rows, created at start()
+        if tap is not None and streams:
+            raise ValueError("Stream logs can't be tapped")
+        if tap is not None:
+            # fail now rather than in cflib's connected callback at start()
+            if tapReplace:
+                if remove_tap(tap):
+                    print('Removed stale shared memory "{}"'.format(tap))
+            elif tap_exists(tap):
+                raise FileExistsError(
+                    'Shared memory "{}" is in use, pick another tap name or '
+                    "replace it".format(tap)
+                )
+        self._tap_name = tap
+        self._tap_rows = tapRows
+        # open logfiles by stream, None for the single logfile, in self._sinks
+        self._ended = False
+
+        # background writer: rows waiting to be written, and counters to see
+        # whether the writer keeps up
+        self._background = background
+        self._queue = queue.Queue(maxsize=queueSize) if background else None
+        self._writer = None
+        self.rows_written = 0
+        self.max_queue_depth = 0
+        self.backpressure_count = 0
+        # the error that stopped the writer, and the rows lost since, counted
+        # apart by the producers and by the writer
+        self.write_error = None
+        self._rows_refused = 0
+        self._rows_discarded = 0
 
     def __del__(self):
-        self._logfile.close()
+        # write out the rows of a background writer that end() didn't stop, if
+        # __init__ got as far as the queue and start() created the writer
+        writer = getattr(self, "_writer", None)
+        if writer is not None and writer.is_alive() and not self._ended:
+            self._ended = True
+            self._put_until_stopped(None)
+            writer.join()
+        if self._logfile is not None and not self._logfile.closed:
+            self._logfile.close()
+        for sink in self._sinks.values():
+            sink.close()
+        if self.tap is not None:
+            self.tap.close()
+
+    @property
+    def queue_depth(self):
+        """Number of rows waiting for the background writer"""
+        return self._queue.qsize() if self._background else 0
+
+    @property
+    def dropped_rows(self):
+        """Number of rows lost after the background writer failed"""
+        return self._rows_refused + self._rows_discarded
+
+    def end(self):
+        """Write out all rows, including those still queued for the background
+        writer, and close the logfile. Logging stops here. Raises the error that
+        stopped the background writer, if any."""
+        if self._ended:
+            return
+        self._ended = True
+        if self._writer is not None:
+            self._put_until_stopped(None)
+            self._writer.join()
+        if self._logfile is not None:
+            self._logfile.close()
+        for sink in self._sinks.values():
+            sink.close()
+        if self.tap is not None:
+            self.tap.close()
+        if self.write_error is not None:
+            raise self.write_error
 
     def start(self):
         """ Commits the logging configurations and adds them to the 
@@ -49,16 +243,30 @@ class FileLogger:
             print("Could not start logging, crazyflie not connected")
         else:
             self.is_connected = True
+            if self._values is None:
+                self._build_layout()
             self._open_log_file()
-            # add log configs to cf
-            counter = 0
+            if self._background and self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._writer_thread, name="FileLogger writer", daemon=True
+                )
+                self._writer.start()
+            # add log configs to cf, packed into as few log blocks as possible
+            cf_configs = []
             for cfg_name in self._enabled_configs:
                 cfg = self._cfg_defs[cfg_name]
                 if cfg["type"] == "CF":
-                    self._add_cf_log_config(cfg_name, counter)
-                    counter = counter + 1
+                    cf_configs.append(cfg_name)
                 else:
                     print('Log config "{}" added'.format(cfg_name))
+            if cf_configs:
+                self._add_cf_log_blocks(cf_configs)
+
+    @property
+    def incomplete_rows(self):
+        """Number of rows written before all their log blocks arrived"""
+        assemblers = set(assembler for _, assembler in self._blocks.values())
+        return sum(a.incomplete for a in assemblers if a is not None)
 
     def enableAllConfigs(self):
         """ Enable all configs in the current logcfg file"""
@@ -67,10 +275,14 @@ class FileLogger:
 
     def enableConfig(self, cfg_name):
         """ Enable a config defined in logcfg.json"""
-        if cfg_name in self._cfg_defs:
+        if self._values is not None:
+            print(
+                'Could not enable config "{}". Logging already started.'.format(
+                    cfg_name
+                )
+            )
+        elif cfg_name in self._cfg_defs:
             self._enabled_configs.append(cfg_name)
-            for var in self._cfg_defs[cfg_name]["variables"]:
-                self._data_dict[var] = 0
         else:
             print('Could not enable config "{}". Config not found.'.format(cfg_name))
 
@@ -82,48 +294,164 @@ class FileLogger:
         config["period"]: for CF callbacks, frequency of data acquisition in ms
         config["variables"]: names of the variables to log
         config["headers"]: headers under which the variables appear in the logfile
+        config["fetch_as"]: for CF configs, compact types to fetch variables as, e.g.
+        "FP16" or "int16_t", or null for the type in the TOC (optional)
         """
         self._cfg_defs[config["name"]] = config
-        self._enabled_configs.append(config["name"])
+        self.enableConfig(config["name"])
         # self._external_configs.append(name)
 
-    def registerData(self, config, data_dict):
+    def registerData(self, config, data_dict, hostTime=None):
         """Register data for an external logconfig. Data dict must contain the fields that
-        correspond to variables of config
+        correspond to variables of config. hostTime is the time.monotonic() the data
+        was received, the time of the call if None.
         """
-        if config in self._enabled_configs:
+        if self._values is None:
+            # no columns before start(), and no rows either
+            return
+        slots = self._config_slots.get(config)
+        if slots is not None:
+            if hostTime is None:
+                hostTime = time.monotonic()
+            values = self._values
             for key, value in data_dict.items():
-                if key in self._cfg_defs[config]["variables"]:
-                    self._data_dict[key] = value
+                slot = slots.get(key)
+                if slot is not None:
+                    values[slot] = value
                 else:
                     print(
-                        'Could not register data for variable "{}" in config "{}": Variable does not exist',
-                        key,
-                        config,
+                        'Could not register data for variable "{}" in config "{}": '
+                        "Variable does not exist".format(key, config)
                     )
+            if config in self._host_time_slots:
+                values[self._host_time_slots[config]] = hostTime
+            if self._streams and self.is_connected and not self._ended:
+                self._emit(
+                    config, [hostTime] + values[self._config_slices[config]].tolist()
+                )
         else:
-            print('Could not register data for config "{}": Config not active', config)
+            print(
+                'Could not register data for config "{}": Config not active'.format(
+                    config
+                )
+            )
+
+    def _build_layout(self):
+        slot = 0
+        for cfg_name in self._enabled_configs:
+            variables = self._cfg_defs[cfg_name]["variables"]
+            self._config_slices[cfg_name] = slice(slot, slot + len(variables))
+            self._config_slots[cfg_name] = {
+                var: slot + i for i, var in enumerate(variables)
+            }
+            slot += len(variables)
+        if self._sync_clock:
+            for cfg_name in self._enabled_configs:
+                if self._cfg_defs[cfg_name]["type"] != "CF":
+                    self._host_time_slots[cfg_name] = slot
+                    slot += 1
+        self._values = np.zeros(slot)
 
-    def _add_cf_log_config(self, cfg_name, cfg_id):
-        config = self._cfg_defs[cfg_name]
-        self._lg_conf.append(
-            LogConfig(name=config["name"], period_in_ms=config["period"])
+    def _columns(self):
+        """Return the description of the columns of a row"""
+        columns = columns_from_configs(
+            self._cfg_defs, self._enabled_configs, self._fetched_types()
         )
+        if self._sync_clock:
+            columns.insert(
+                1,
+                {
+                    "name": "syncTime",
+                    "config": None,
+                    "variable": None,
+                    "type": HOST_TIME_TYPE,
+                },
+            )
+            for cfg_name in self._host_time_slots:
+                columns.append(
+                    {
+                        "name": "hostTime_" + cfg_name,
+                        "config": cfg_name,
+                        "variable": None,
+                        "type": HOST_TIME_TYPE,
+                    }
+                )
+        return columns
 
-        for var in config["variables"]:
-            self._lg_conf[cfg_id].add_variable(var, "float")
+    def _fetched_types(self):
+        """Return the NumPy types of the variables of the enabled CF configs, by
+        config, as they are fetched from the Crazyflie"""
+        types = {}
+        for cfg_name in self._enabled_configs:
+            cfg = self._cfg_defs[cfg_name]
+            if cfg["type"] == "CF" and "types" not in cfg:
+                try:
+                    fetched = fetch_types(cfg, self._cf.log.toc)
+                except (KeyError, ValueError):
+                    # the config fails to start, its columns keep the default type
+                    continue
+                types[cfg_name] = [FETCH_TYPES[fetch_as] for fetch_as in fetched]
+        return types
 
+    def _add_cf_log_blocks(self, cfg_names):
+        # variables are fetched as the type in the TOC or a declared compact type,
+        # and packed into blocks by period, or by config for separate streams
         try:
-            self._cf.log.add_config(self._lg_conf[cfg_id])
-            self._lg_conf[cfg_id].data_received_cb.add_callback(self._log_cb)
-            # add the write file callback to the first log config registered
-            if cfg_id == 0:
-                self._lg_conf[cfg_id].data_received_cb.add_callback(
-                    self._log_cb_write_file
+            blocks = plan_blocks(
+                self._cfg_defs,
+                cfg_names,
+                self._cf.log.toc,
+                self._config_slots,
+                per_config=self._streams,
+            )
+        except KeyError as e:
+            print(
+                "Could not start log configuration,"
+                "{} not found in TOC".format(str(e))
+            )
+            return
+        except ValueError as e:
+            print("Could not start log configuration, {}".format(e))
+            return
+
+        # rows are rebuilt from the blocks of one sampling cycle: a stream row
+        # when all blocks of its config arrived, a row of everything when all
+        # blocks with the period of the first config arrived
+        assemblers = {}
+        if self._streams:
+            for cfg_name in cfg_names:
+                assemblers[cfg_name] = RowAssembler(
+                    [block.name for block in blocks if cfg_name in block.configs],
+                    partial(self._write_stream_row, cfg_name),
+                    tolerance=self._cfg_defs[cfg_name]["period"],
                 )
-            self._lg_conf[cfg_id].error_cb.add_callback(self._log_error)
-            self._lg_conf[cfg_id].start()
-            print('Log config "{}" added'.format(cfg_name))
+        else:
+            period = self._cfg_defs[cfg_names[0]]["period"]
+            names = [block.name for block in blocks if block.period == period]
+            assembler = RowAssembler(names, self._write_out_log_data, tolerance=period)
+            for name in names:
+                assemblers[name] = assembler
+
+        for block in blocks:
+            key = block.configs[0] if self._streams else block.name
+            self._blocks[block.name] = (block.slots, assemblers.get(key))
+            self._add_cf_log_block(block)
+
+    def _add_cf_log_block(self, block):
+        lg_conf = LogConfig(name=block.name, period_in_ms=block.period)
+        self._lg_conf.append(lg_conf)
+
+        for var, fetch_as in zip(block.variables, block.fetch_as):
+            lg_conf.add_variable(var, fetch_as)
+
+        try:
+            self._cf.log.add_config(lg_conf)
+            lg_conf.data_received_cb.add_callback(self._log_cb)
+            lg_conf.error_cb.add_callback(self._log_error)
+            lg_conf.start()
+            print(
+                'Log block "{}" added ({})'.format(block.name, ", ".join(block.configs))
+            )
         except KeyError as e:
             print(
                 "Could not start log configuration,"
@@ -133,33 +461,174 @@ class FileLogger:
             print("Could not add Distance log config, bad configuration.")
 
     def _log_cb(self, timestamp, data, logconf):
-        for key, value in data.items():
-            self._data_dict[key] = value
+        self.clock.update(timestamp, time.monotonic())
+        slots, assembler = self._blocks[logconf.name]
+        if assembler is not None:
+            assembler.block_started(timestamp, logconf.name)
+        # cflib hands over the values in the order the variables were added,
+        # which is the order of the block's slots
+        self._values[slots] = list(data.values())
+        if assembler is not None:
+            assembler.block_done()
+
+    def _write_stream_row(self, cfg_name, timetick):
+        if self.is_connected and not self._ended:
+            self._emit(
+                cfg_name,
+                [time.monotonic(), timetick]
+                + self._values[self._config_slices[cfg_name]].tolist(),
+            )
 
     def _log_error(self, logconf, msg):
         print("Error when logging %s: %s" % (logconf.name, msg))
 
-    def _log_cb_write_file(self, timestamp, data, logconf):
-        self._write_out_log_data(timestamp)
-
     def _open_log_file(self):
-        self._logfile.write("timeTick")
+        if self._streams:
+            for index, cfg_name in enumerate(self._enabled_configs):
+                writer = BinaryLogWriter(
+                    stream_columns(self._cfg_defs, cfg_name, self._fetched_types()),
+                    metadata={"stream": cfg_name, "index": index},
+                )
+                logfile = self._open_output(stream_file_name(self._file_name, cfg_name))
+                self._write_header(logfile, writer.header())
+                self._sinks[cfg_name] = _Sink(logfile, writer.encode_rows)
+            return
+
+        self._open_tap()
+        if self._parquet:
+            self._sinks[None] = ParquetLogWriter(
+                self._file_name,
+                self._columns(),
+                metadata=self._metadata,
+                compression=self._compression,
+            )
+            return
 
-        for cfg in self._enabled_configs:
-            if cfg in self._cfg_defs:
-                for header in self._cfg_defs[cfg]["headers"]:
-                    self._logfile.write(", ")
-                    self._logfile.write(header)
+        if self._binary:
+            # the record layout follows from the configs enabled by now
+            writer = BinaryLogWriter(self._columns(), metadata=self._metadata)
+            self._write_header(self._logfile, writer.header())
+            self._sinks[None] = _Sink(self._logfile, writer.encode_rows)
+            return
 
-        self._logfile.write("\n")
+        self._sinks[None] = _Sink(self._logfile, self._encode_csv_rows)
+        header = ", ".join(column["name"] for column in self._columns())
+        self._write_header(self._logfile, header + "\n")
+
+    def _open_tap(self):
+        if self._tap_name is not None and self.tap is None:
+            self.tap = TelemetryTap(
+                self._tap_name,
+                self._columns(),
+                capacity=self._tap_rows,
+                metadata=self._metadata,
+            )
+
+    def _open_output(self, fileName):
+        if self._rotation is not None:
+            return RotatingFile(fileName, **self._rotation)
+        binary = self._binary or self._streams
+        return open(fileName, "wb" if binary else "w")
+
+    @staticmethod
+    def _write_header(logfile, header):
+        # rotating logfiles repeat the header at the start of every segment
+        if isinstance(logfile, RotatingFile):
+            logfile.set_header(header)
+        else:
+            logfile.write(header)
 
     # Function to write the log data to file
     def _write_out_log_data(self, timetick):
-        if self.is_connected:
-            self._logfile.write("{}".format(timetick))
+        if self.is_connected and not self._ended:
+            # take a snapshot of the current values, the callbacks keep updating them
+            if self._sync_clock:
+                row = [timetick, self.clock.to_host(timetick)]
+            else:
+                row = [timetick]
+            row += self._values.tolist()
+            if self.tap is not None:
+                self.tap.publish(row)
+            self._emit(None, row)
+
+    @staticmethod
+    def _encode_csv_rows(rows):
+        return "".join(", ".join(map(str, row)) + "\n" for row in rows)
+
+    def _emit(self, stream, row):
+        """Write a row to the logfile of a stream, or hand it to the writer"""
+        if self._background:
+            self._enqueue_row((stream, row))
+        else:
+            self._sinks[stream].write((row,))
+            self.rows_written += 1
+
+    def _enqueue_row(self, row):
+        if self.write_error is not None:
+            self._rows_refused += 1
+            return
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # the writer fell behind, wait for it rather than lose the row
+            self.backpressure_count += 1
+            if not self._put_until_stopped(row):
+                self._rows_refused += 1
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _put_until_stopped(self, item):
+        """Queue an item, waiting for room as long as the writer is alive. Returns
+        whether the item was queued."""
+        while self._writer.is_alive():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _writer_thread(self):
+        """Write queued rows in batches until end() queues None. If writing fails,
+        the error is kept in write_error, and the rows queued since are dropped."""
+        while True:
+            # block for the first row, then take whatever else is waiting
+            items = [self._queue.get()]
+            try:
+                while items[-1] is not None:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            done = items[-1] is None
+            if done:
+                items.pop()
 
-            for cfg in self._enabled_configs:
-                for var in self._cfg_defs[cfg]["variables"]:
-                    self._logfile.write(", {}".format(self._data_dict[var]))
+            # one batch per logfile, in the order the rows arrived
+            batches = {}
+            for stream, row in items:
+                batches.setdefault(stream, []).append(row)
+            try:
+                for stream, rows in batches.items():
+                    sink = self._sinks[stream]
+                    sink.write(rows)
+                    sink.flush()
+            except Exception as e:
+                print("Could not write log, dropping further rows: {}".format(e))
+                self.write_error = e
+                self._rows_discarded += len(items)
+                self._drain_queue(done)
+                return
+            self.rows_written += len(items)
+            if done:
+                return
 
-            self._logfile.write("\n")
+    def _drain_queue(self, done):
+        # keep taking rows off the queue, so producers that wait for room don't
+        # wait forever, until end() queues None
+        while not done:
+            item = self._queue.get()
+            if item is None:
+                done = True
+            else:
+                self._rows_discarded += 1
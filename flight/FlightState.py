@@ -0,0 +1,89 @@
+"""
+Contains the FlightState class, the state machine of a flight in log_flight.py. The
+Crazyflie and OptiTrack callbacks signal events (connected, TOC ready, mocap fix,
+...), and the flight waits for them instead of polling, so it moves on as soon as
+an event happens and uses no CPU while it waits.
+"""
+
+import enum
+import threading
+import time
+
+
+class FlightEvent(enum.Enum):
+    # Radio link to the Crazyflie is up
+    CONNECTED = "connected"
+    # TOCs and parameters are downloaded, logging has started
+    TOC_READY = "toc ready"
+    # OptiTrack sees the drone
+    MOCAP_FIX = "mocap fix"
+    # The position estimate settled after the estimator was reset
+    ESTIMATOR_CONVERGED = "estimator converged"
+    # The safety pilot handed control to the trajectory
+    AUTO_MODE = "auto mode"
+    # Flight has to end: the link was lost or the flight was stopped
+    LANDING = "landing"
+
+
+class FlightPhase(enum.Enum):
+    CONNECTING = 1
+    WAITING_FOR_FIX = 2
+    RESETTING_ESTIMATOR = 3
+    READY = 4
+    MANUAL = 5
+    AUTO = 6
+    IDLE = 7
+    LANDING = 8
+    DONE = 9
+
+
+class FlightState:
+    """
+    Events that happened and the current phase of a flight.
+
+    Any thread can set() or clear() events; wait() blocks until one of the given
+    events is set. Phase transitions are printed with the time since the flight
+    state was created.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = set()
+        self._start = time.monotonic()
+        self.phase = None
+
+    def set(self, event):
+        with self._condition:
+            if event not in self._events:
+                self._events.add(event)
+                self._condition.notify_all()
+
+    def clear(self, event):
+        with self._condition:
+            self._events.discard(event)
+
+    def is_set(self, event):
+        return event in self._events
+
+    def wait(self, *events, timeout=None):
+        """Wait until any of the events is set, at most timeout seconds. Returns
+        the first of the events that is set, or None after a timeout."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: any(event in self._events for event in events), timeout
+            )
+            for event in events:
+                if event in self._events:
+                    return event
+        return None
+
+    def transition(self, phase):
+        """Move to a new phase"""
+        print(
+            "[{:7.3f} s] {} -> {}".format(
+                time.monotonic() - self._start,
+                "start" if self.phase is None else self.phase.name,
+                phase.name,
+            )
+        )
+        self.phase = phase
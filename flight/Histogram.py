@@ -0,0 +1,106 @@
+"""
+Contains the Histogram class, a fixed-size histogram with logarithmic bins for timing
+measurements in hot paths.
+"""
+
+import math
+
+
+class Histogram:
+    """
+    Distribution of positive values between low and high, e.g. durations.
+
+    Bins are spaced logarithmically, binsPerOctave of them per factor of two, so the
+    relative resolution is the same everywhere in the range. Values below low or
+    above high go to the first or last bin; count, mean, standard deviation,
+    minimum and maximum are exact regardless. Recording a value is a few float
+    operations and a list increment, and never allocates.
+    """
+
+    def __init__(self, low, high, binsPerOctave=4, unit=""):
+        self.low = low
+        self.high = high
+        self.binsPerOctave = binsPerOctave
+        self.unit = unit
+        self.__scale = binsPerOctave / math.log(2)
+        self.__logLow = math.log(low)
+        self.__bins = [0] * (int(math.ceil(math.log2(high / low) * binsPerOctave)) + 1)
+        self.__last = len(self.__bins) - 1
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded values"""
+        for i in range(len(self.__bins)):
+            self.__bins[i] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sumOfSquares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value):
+        """Add one value"""
+        self.count += 1
+        self.sum += value
+        self.sumOfSquares += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        if value <= self.low:
+            index = 0
+        else:
+            index = int((math.log(value) - self.__logLow) * self.__scale) + 1
+            if index > self.__last:
+                index = self.__last
+        self.__bins[index] += 1
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        if not self.count:
+            return math.nan
+        mean = self.sum / self.count
+        return math.sqrt(max(self.sumOfSquares / self.count - mean * mean, 0.0))
+
+    def upperEdge(self, index):
+        """Upper edge of a bin"""
+        return self.low * 2 ** (index / self.binsPerOctave)
+
+    def bins(self):
+        """Return a list of (upper edge, count) of all bins"""
+        return [(self.upperEdge(i), n) for i, n in enumerate(self.__bins)]
+
+    def percentile(self, q):
+        """Return an upper bound of the q-th percentile (0 to 100), accurate to
+        one bin, or nan if nothing was recorded"""
+        if not self.count:
+            return math.nan
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.__bins):
+            seen += n
+            if seen >= rank and n:
+                return min(self.upperEdge(i), self.max)
+        return self.max
+
+    def __str__(self):
+        if not self.count:
+            return "no samples"
+        return (
+            "mean {:.3g}{unit}, std {:.3g}{unit}, p50 {:.3g}{unit}, "
+            "p90 {:.3g}{unit}, p99 {:.3g}{unit}, max {:.3g}{unit} ({} samples)".format(
+                self.mean,
+                self.std,
+                self.percentile(50),
+                self.percentile(90),
+                self.percentile(99),
+                self.max,
+                self.count,
+                unit=self.unit,
+            )
+        )
@@ -0,0 +1,264 @@
+"""
+Contains an offline planner for the Crazyflie radio link: it packs a logcfg into log
+blocks like FileLogger does, adds the extpos and setpoint packets a flight sends,
+and projects packets and bytes per second and the utilisation of the link. If that
+exceeds a target, it suggests longer periods for the log configs.
+
+    python flight/LinkPlanner.py --logconfig configs/logcfg/example_logcfg.json \\
+        --toc ~/.config/cfclient/toc/ --optitrack state --target 0.5
+
+Variable types come from a TOC cache as written by cflib (a JSON file, or a directory
+of them); without one, variables without a declared "fetch_as" count as floats.
+"""
+
+import argparse
+import glob
+import json
+import os
+
+from flight.LogPacker import TYPE_SIZES, plan_blocks
+
+# Radio packets per second the link sustains in each direction. Every packet from
+# the host is acknowledged, and log data rides back on the acknowledgements, so both
+# directions share this many transactions.
+LINK_CAPACITY = 1000
+
+# Bytes of a log packet besides the data: CRTP header, block id and time tick
+LOG_PACKET_OVERHEAD = 5
+# Bytes of the packets the host sends, including the CRTP header
+EXTPOS_PACKET_SIZE = 13
+POSITION_SETPOINT_PACKET_SIZE = 18
+SETPOINT_PACKET_SIZE = 15
+
+# Log periods are multiples of 10 ms on the Crazyflie
+PERIOD_STEP = 10
+
+
+class _TocElement:
+    def __init__(self, ctype):
+        self.ctype = ctype
+
+
+class TocCache:
+    """Log TOC read from cflib's TOC cache, with the lookup FileLogger uses on a
+    connected Crazyflie's TOC"""
+
+    def __init__(self, path):
+        self.elements = {}
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "*.json")))
+        for fileName in files:
+            with open(fileName) as f:
+                toc = json.load(f)
+            for group, elements in toc.items():
+                for name, element in elements.items():
+                    if element.get("__class__", "LogTocElement") == "LogTocElement":
+                        self.elements["{}.{}".format(group, name)] = _TocElement(
+                            element["ctype"]
+                        )
+
+    def get_element_by_complete_name(self, name):
+        return self.elements.get(name)
+
+
+class FloatToc:
+    """Stand-in for a TOC in which every variable is a float"""
+
+    def get_element_by_complete_name(self, name):
+        return _TocElement("float")
+
+
+def effective_period(period):
+    """Return the period in ms the Crazyflie actually logs at"""
+    return max(PERIOD_STEP, period // PERIOD_STEP * PERIOD_STEP)
+
+
+class LinkPlan:
+    """Projected traffic of a flight: the log blocks and the packets the host
+    sends, each as (name, packets per second, bytes per packet)"""
+
+    def __init__(self, blocks, commands, capacity=LINK_CAPACITY):
+        self.blocks = blocks
+        self.commands = commands
+        self.capacity = capacity
+
+    @property
+    def uplink_packets(self):
+        """Packets per second from the Crazyflie"""
+        return sum(rate for _, rate, _ in self.blocks)
+
+    @property
+    def uplink_bytes(self):
+        return sum(rate * size for _, rate, size in self.blocks)
+
+    @property
+    def downlink_packets(self):
+        """Packets per second to the Crazyflie"""
+        return sum(rate for _, rate, _ in self.commands)
+
+    @property
+    def downlink_bytes(self):
+        return sum(rate * size for _, rate, size in self.commands)
+
+    @property
+    def utilisation(self):
+        """Fraction of the link's transactions in use by the busier direction"""
+        return max(self.uplink_packets, self.downlink_packets) / self.capacity
+
+    def __str__(self):
+        lines = [
+            "{:<24} {:>10} {:>8} {:>10}".format("", "packets/s", "bytes", "bytes/s")
+        ]
+        for title, items in (("Log blocks", self.blocks), ("Host", self.commands)):
+            lines.append(title)
+            for name, rate, size in items:
+                lines.append(
+                    "  {:<22} {:>10.1f} {:>8} {:>10.0f}".format(
+                        name, rate, size, rate * size
+                    )
+                )
+        lines.append(
+            "From Crazyflie: {:.0f} packets/s, {:.0f} bytes/s".format(
+                self.uplink_packets, self.uplink_bytes
+            )
+        )
+        lines.append(
+            "To Crazyflie:   {:.0f} packets/s, {:.0f} bytes/s".format(
+                self.downlink_packets, self.downlink_bytes
+            )
+        )
+        lines.append(
+            "Link utilisation: {:.0%} of {} packets/s".format(
+                self.utilisation, self.capacity
+            )
+        )
+        return "\n".join(lines)
+
+
+def plan_link(
+    cfg_defs,
+    toc,
+    extpos_rate=0.0,
+    setpoint_rate=0.0,
+    extpos_size=EXTPOS_PACKET_SIZE,
+    setpoint_size=POSITION_SETPOINT_PACKET_SIZE,
+    capacity=LINK_CAPACITY,
+    per_config=False,
+):
+    """Return the LinkPlan of logging all CF configs in cfg_defs, packed as
+    FileLogger packs them, while sending extpos and setpoints at the given rates"""
+    cf_configs = [name for name, cfg in cfg_defs.items() if cfg["type"] == "CF"]
+    slots = {
+        name: {var: i for i, var in enumerate(cfg_defs[name]["variables"])}
+        for name in cf_configs
+    }
+    blocks = []
+    for block in plan_blocks(cfg_defs, cf_configs, toc, slots, per_config):
+        size = LOG_PACKET_OVERHEAD + sum(TYPE_SIZES[t] for t in block.fetch_as)
+        blocks.append((block.name, 1000.0 / effective_period(block.period), size))
+
+    commands = []
+    if extpos_rate:
+        commands.append(("extpos", extpos_rate, extpos_size))
+    if setpoint_rate:
+        commands.append(("setpoints", setpoint_rate, setpoint_size))
+    return LinkPlan(blocks, commands, capacity)
+
+
+def suggest_periods(cfg_defs, toc, target, max_period=1000, **options):
+    """Return longer periods for the CF configs, by name, that bring the link
+    utilisation of plan_link(cfg_defs, toc, **options) down to target, and the
+    resulting LinkPlan.
+
+    The config with the shortest period has it lengthened by one step at a time,
+    so fast configs are slowed down first. The host's packets are left alone; if
+    they alone exceed the target, their rates have to come down.
+    """
+    cfg_defs = {name: dict(cfg) for name, cfg in cfg_defs.items()}
+    periods = {}
+    plan = plan_link(cfg_defs, toc, **options)
+    while plan.uplink_packets / plan.capacity > target:
+        # the configs with the shortest period cost the most packets
+        candidates = [
+            (effective_period(cfg["period"]), name)
+            for name, cfg in cfg_defs.items()
+            if cfg["type"] == "CF" and effective_period(cfg["period"]) < max_period
+        ]
+        if not candidates:
+            break
+        period, name = min(candidates)
+        cfg_defs[name]["period"] = period + PERIOD_STEP
+        periods[name] = cfg_defs[name]["period"]
+        plan = plan_link(cfg_defs, toc, **options)
+    return periods, plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logconfig", type=str, required=True)
+    parser.add_argument(
+        "--toc", type=str, default=None, help="TOC cache file or directory"
+    )
+    parser.add_argument(
+        "--optitrack",
+        choices=["none", "logging", "state"],
+        type=str.lower,
+        default="none",
+    )
+    parser.add_argument("--trajectory", nargs="+", type=str.lower, default=None)
+    parser.add_argument("--extpos_rate", type=float, default=None)
+    parser.add_argument("--setpoint_rate", type=float, default=None)
+    parser.add_argument("--streams", action="store_true", help="as --log_streams")
+    parser.add_argument("--capacity", type=int, default=LINK_CAPACITY)
+    parser.add_argument("--target", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with open(args.logconfig) as f:
+        cfg_defs = json.load(f)
+    if args.toc is not None:
+        toc = TocCache(os.path.expanduser(args.toc))
+    else:
+        print("No TOC cache given, counting variables without fetch_as as floats")
+        toc = FloatToc()
+
+    # Rates of the flight loops in log_flight.py: 100 Hz in manual flight, where
+    # setpoints come from the controller, 20 Hz when following setpoints
+    manual = args.trajectory is not None and "manual" in args.trajectory
+    loop_rate = 100.0 if manual else 20.0
+    extpos_rate = args.extpos_rate
+    if extpos_rate is None:
+        extpos_rate = loop_rate if args.optitrack == "state" else 0.0
+    setpoint_rate = args.setpoint_rate
+    if setpoint_rate is None:
+        setpoint_rate = loop_rate if args.trajectory is not None else 0.0
+
+    options = dict(
+        extpos_rate=extpos_rate,
+        setpoint_rate=setpoint_rate,
+        setpoint_size=(
+            SETPOINT_PACKET_SIZE if manual else POSITION_SETPOINT_PACKET_SIZE
+        ),
+        capacity=args.capacity,
+        per_config=args.streams,
+    )
+    try:
+        plan = plan_link(cfg_defs, toc, **options)
+    except KeyError as e:
+        raise SystemExit("{} not found in TOC".format(e))
+    print(plan)
+
+    if plan.utilisation > args.target:
+        print("\nAbove the target of {:.0%}.".format(args.target))
+        periods, adjusted = suggest_periods(cfg_defs, toc, args.target, **options)
+        if periods:
+            print("Suggested periods:")
+            for name, period in periods.items():
+                print(
+                    "  {}: {} ms -> {} ms".format(
+                        name, cfg_defs[name]["period"], period
+                    )
+                )
+            print("Link utilisation: {:.0%}".format(adjusted.utilisation))
+        if adjusted.utilisation > args.target:
+            print("The host's packets exceed it, lower the extpos or setpoint rate")
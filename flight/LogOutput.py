@@ -0,0 +1,246 @@
+"""
+Contains the RotatingFile class, a log output that compresses as it writes and
+starts a new file (segment) when the current one gets too large or too old, and
+functions to join the segments back into one plain log.
+
+Segments are named after the log with a sequence number, e.g. flight.000.csv.gz,
+flight.001.csv.gz, ... for flight.csv, and each one starts with the log's header,
+so every segment can be read on its own. A log that is compressed but not rotated
+is a single file named after the log, e.g. flight.csv.gz. A manifest next to them
+(flight.csv.manifest.json) lists the segments, their time span and sizes. With a
+limit on the number of segments, the oldest ones are deleted, so logging can go on
+indefinitely in bounded disk space.
+
+Compression is gzip, or zstd or lz4 if the zstandard or lz4 packages are installed.
+Segments are joined into the original log from the command line:
+
+    python flight/LogOutput.py flight.csv
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+
+
+def available_compression():
+    """Return the compressions that can be used here, fastest first"""
+    compressions = []
+    if zstandard is not None:
+        compressions.append("zstd")
+    if lz4 is not None:
+        compressions.append("lz4")
+    compressions.append("gzip")
+    return compressions
+
+
+def _open_compressed(fileName, mode, compression):
+    """Open a file for binary reading ("rb") or writing ("wb") with compression"""
+    if compression is None:
+        return open(fileName, mode)
+    if compression == "gzip":
+        # fast over small: logs are compressed while flying
+        return gzip.open(fileName, mode, compresslevel=1)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        if mode == "wb":
+            return zstandard.ZstdCompressor(level=3).stream_writer(open(fileName, mode))
+        return zstandard.ZstdDecompressor().stream_reader(open(fileName, mode))
+    if compression == "lz4":
+        if lz4 is None:
+            raise ValueError("lz4 compression needs the lz4 package")
+        return lz4.frame.open(fileName, mode)
+    raise ValueError('Unknown compression "{}"'.format(compression))
+
+
+def manifest_name(fileName):
+    return fileName + ".manifest.json"
+
+
+class RotatingFile:
+    """
+    Write-only file that compresses its data and rotates to a new segment once
+    max_bytes (uncompressed) have been written to the current one, or it has been
+    open for max_seconds. Rotation only happens between writes, so rows written
+    in one call stay in one segment. At most max_segments are kept.
+
+    Data is compressed as it is written, so memory use doesn't grow with the
+    log. flush() hands data to the OS at most every flush_interval seconds, as
+    flushing a compressor more often costs compression.
+    """
+
+    def __init__(
+        self,
+        fileName,
+        compression=None,
+        max_bytes=None,
+        max_seconds=None,
+        max_segments=None,
+        flush_interval=1.0,
+    ):
+        if compression == "auto":
+            compression = available_compression()[0]
+        self.fileName = fileName
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.closed = False
+
+        self._header = b""
+        self._segments = []
+        self._file = None
+        self._bytes = 0
+        self._opened = 0.0
+        self._flushed = 0.0
+        self._open_segment()
+
+    def set_header(self, header):
+        """Write the header, and repeat it at the start of every later segment"""
+        if isinstance(header, str):
+            header = header.encode("utf-8")
+        self._header = header
+        self._write(header)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._write(data)
+        if (self.max_bytes is not None and self._bytes >= self.max_bytes) or (
+            self.max_seconds is not None
+            and time.monotonic() - self._opened >= self.max_seconds
+        ):
+            self._rotate()
+
+    def flush(self):
+        now = time.monotonic()
+        if now - self._flushed >= self.flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._close_segment()
+        self._write_manifest()
+
+    def _write(self, data):
+        self._file.write(data)
+        self._bytes += len(data)
+
+    def _segment_name(self, index):
+        if self.max_bytes is None and self.max_seconds is None:
+            # never rotates, the only segment needs no number
+            return self.fileName + EXTENSIONS[self.compression]
+        stem, ext = os.path.splitext(self.fileName)
+        return "{}.{:03d}{}{}".format(stem, index, ext, EXTENSIONS[self.compression])
+
+    def _open_segment(self):
+        name = self._segment_name(len(self._segments))
+        self._file = _open_compressed(name, "wb", self.compression)
+        self._opened = self._flushed = time.monotonic()
+        self._bytes = 0
+        self._segments.append(
+            {"file": os.path.basename(name), "opened": time.time(), "closed": None}
+        )
+        self._write_manifest()
+
+    def _close_segment(self):
+        self._file.close()
+        segment = self._segments[-1]
+        segment["closed"] = time.time()
+        segment["bytes"] = self._bytes
+        segment["size"] = os.path.getsize(
+            os.path.join(os.path.dirname(self.fileName), segment["file"])
+        )
+
+    def _rotate(self):
+        self._close_segment()
+        self._open_segment()
+        if self._header:
+            self._write(self._header)
+        if self.max_segments is not None:
+            # delete the oldest segments that are still there
+            kept = [s for s in self._segments if not s.get("deleted")]
+            for segment in kept[: max(len(kept) - self.max_segments, 0)]:
+                try:
+                    os.remove(
+                        os.path.join(os.path.dirname(self.fileName), segment["file"])
+                    )
+                except OSError:
+                    pass
+                segment["deleted"] = True
+            self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            "log": os.path.basename(self.fileName),
+            "compression": self.compression,
+            "header_size": len(self._header),
+            "segments": self._segments,
+        }
+        # replace the manifest in one go, so it is never seen half written
+        name = manifest_name(self.fileName)
+        with open(name + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(name + ".tmp", name)
+
+
+def read_manifest(fileName):
+    """Return the manifest of a rotated log"""
+    with open(manifest_name(fileName)) as f:
+        return json.load(f)
+
+
+def join(fileName, outName=None, chunkSize=1 << 20):
+    """Decompress the remaining segments of a rotated log and join them into one
+    plain log, with the header once. Returns the name of the joined log."""
+    manifest = read_manifest(fileName)
+    directory = os.path.dirname(fileName)
+    if outName is None:
+        outName = fileName
+    headerSize = manifest["header_size"]
+    first = True
+    with open(outName, "wb") as out:
+        for segment in manifest["segments"]:
+            if segment.get("deleted"):
+                continue
+            path = os.path.join(directory, segment["file"])
+            with _open_compressed(path, "rb", manifest["compression"]) as f:
+                header = f.read(headerSize)
+                if first:
+                    out.write(header)
+                    first = False
+                while True:
+                    chunk = f.read(chunkSize)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+    return outName
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+", type=str, help="logs or their manifests")
+    args = parser.parse_args()
+
+    for log in args.logs:
+        if log.endswith(".manifest.json"):
+            log = log[: -len(".manifest.json")]
+        print("Joined {}".format(join(log)))
@@ -0,0 +1,171 @@
+"""
+Contains the packing of logcfg variables into Crazyflie log blocks, and the
+RowAssembler class that tells when all blocks of a row have arrived.
+
+A log block is sent as one radio packet per period, with room for MAX_BLOCK_SIZE
+bytes of data. Variables are fetched as the type in the Crazyflie's TOC, unless the
+logcfg declares a compact type for them in "fetch_as", e.g.
+
+    "variables": ["stateEstimate.x", "stateEstimate.y", "motor.m1"],
+    "fetch_as": ["FP16", "FP16", null],
+
+and the variables of all configs with the same period are packed into as few blocks
+as possible. The variables of one config stay together in one block if they fit, so
+they are sampled at the same time.
+"""
+
+import collections
+
+import numpy as np
+
+# Data bytes in one log packet, LogConfig.MAX_LEN in cflib
+MAX_BLOCK_SIZE = 26
+
+# Size in bytes of the types cflib can fetch log variables as
+TYPE_SIZES = {
+    "uint8_t": 1,
+    "int8_t": 1,
+    "uint16_t": 2,
+    "int16_t": 2,
+    "FP16": 2,
+    "uint32_t": 4,
+    "int32_t": 4,
+    "float": 4,
+}
+
+LogBlock = collections.namedtuple(
+    "LogBlock", ["name", "period", "variables", "fetch_as", "slots", "configs"]
+)
+
+
+def fetch_types(config, toc):
+    """Return the type to fetch each variable of a config as: the type declared
+    in the config's "fetch_as", or else the type in the TOC. Raises KeyError for
+    variables that are not in the TOC."""
+    declared = config.get("fetch_as") or [None] * len(config["variables"])
+    types = []
+    for var, fetch_as in zip(config["variables"], declared):
+        if fetch_as is None:
+            element = toc.get_element_by_complete_name(var)
+            if element is None:
+                raise KeyError(var)
+            fetch_as = element.ctype
+        if fetch_as not in TYPE_SIZES:
+            raise ValueError(
+                'Cannot fetch "{}" as "{}", use one of {}'.format(
+                    var, fetch_as, ", ".join(TYPE_SIZES)
+                )
+            )
+        types.append(fetch_as)
+    return types
+
+
+def pack(sizes, capacity=MAX_BLOCK_SIZE):
+    """Bin-pack items of the given sizes into as few blocks of the given capacity
+    as possible (first fit decreasing). Returns lists of item indices, in their
+    original order within each block."""
+    blocks = []
+    space = []
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        size = sizes[index]
+        if size > capacity:
+            raise ValueError("Item of {} bytes does not fit a block".format(size))
+        for block, free in enumerate(space):
+            if size <= free:
+                blocks[block].append(index)
+                space[block] -= size
+                break
+        else:
+            blocks.append([index])
+            space.append(capacity - size)
+    return [sorted(block) for block in blocks]
+
+
+def plan_blocks(cfg_defs, cfg_names, toc, config_slots, per_config=False):
+    """Return the log blocks for the CF configs cfg_names.
+
+    Variables of configs with the same period share blocks, or with per_config
+    only variables of the same config do. config_slots gives the slot in the
+    row of every variable of every config, which each block lists for its
+    variables so their values can be put in place on arrival.
+    """
+    groups = collections.OrderedDict()
+    for cfg_name in cfg_names:
+        config = cfg_defs[cfg_name]
+        key = cfg_name if per_config else config["period"]
+        group = groups.setdefault(key, [])
+        slots = config_slots[cfg_name]
+        for var, fetch_as in zip(config["variables"], fetch_types(config, toc)):
+            group.append((cfg_name, var, fetch_as, slots[var]))
+
+    blocks = []
+    for key, group in groups.items():
+        period = cfg_defs[group[0][0]]["period"]
+        # the variables of a config are one unit if they fit a block, else they
+        # are split over blocks of their own
+        units = []
+        configs = collections.OrderedDict.fromkeys(cfg for cfg, _, _, _ in group)
+        for cfg_name in configs:
+            members = [member for member in group if member[0] == cfg_name]
+            sizes = [TYPE_SIZES[fetch_as] for _, _, fetch_as, _ in members]
+            if sum(sizes) <= MAX_BLOCK_SIZE:
+                units.append(members)
+            else:
+                for indices in pack(sizes):
+                    units.append([members[index] for index in indices])
+        packed = pack([sum(TYPE_SIZES[m[2]] for m in unit) for unit in units])
+        for i, indices in enumerate(packed):
+            members = [member for index in indices for member in units[index]]
+            blocks.append(
+                LogBlock(
+                    name="{}{}_{}".format(key, "" if per_config else "ms", i),
+                    period=period,
+                    variables=[var for _, var, _, _ in members],
+                    fetch_as=[fetch_as for _, _, fetch_as, _ in members],
+                    slots=np.array([slot for _, _, _, slot in members], dtype=int),
+                    configs=sorted(set(cfg for cfg, _, _, _ in members)),
+                )
+            )
+    return blocks
+
+
+class RowAssembler:
+    """
+    Tells when all log blocks of one sampling cycle have arrived.
+
+    Blocks with the same period run on separate timers in the Crazyflie, so their
+    time ticks differ by up to a period. A row is made of the blocks that arrive
+    within tolerance ticks (ms) of its first block, each block once: a block that
+    arrives again, or later than tolerance, starts the next row.
+
+    Call block_started(timestamp, name) when a block arrives, before storing its
+    values, and block_done() after. on_row(timestamp) is called with the time tick
+    of the first block of a row when its last block is done. If a packet was lost,
+    the row is completed with the values held from before when the next row
+    starts; these rows are counted in incomplete.
+    """
+
+    def __init__(self, block_names, on_row, tolerance):
+        self.block_names = frozenset(block_names)
+        self.on_row = on_row
+        self.tolerance = tolerance
+        self.incomplete = 0
+        self._timestamp = None
+        self._received = set()
+
+    def block_started(self, timestamp, name):
+        if self._received:
+            # ticks apart, either way, with the 32 bit tick counter wrapping
+            apart = (timestamp - self._timestamp + 2 ** 31) % 2 ** 32 - 2 ** 31
+            if name in self._received or abs(apart) >= self.tolerance:
+                self.incomplete += 1
+                self.on_row(self._timestamp)
+                self._received.clear()
+        if not self._received:
+            self._timestamp = timestamp
+        self._received.add(name)
+
+    def block_done(self):
+        if len(self._received) == len(self.block_names):
+            self._received.clear()
+            self.on_row(self._timestamp)
@@ -0,0 +1,109 @@
+"""
+Contains the LowPassFilter class, which filters a few signals (e.g. the x, y and z of
+an OptiTrack position) one sample at a time, and functions to design its sections.
+
+The filter is a cascade of biquads (second-order sections, as designed by
+scipy.signal), run in transposed direct form II on plain Python floats. For one
+sample of a few signals, this is a few dozen multiply-adds and no allocations,
+where scipy.signal.sosfilt spends most of its time converting arguments and
+creating arrays.
+"""
+
+import scipy.signal
+
+DESIGNS = ("butter", "bessel", "none")
+
+
+def design(kind="butter", order=4, cutoff=0.1):
+    """Return the second-order sections of a low-pass filter of the given kind and
+    order, with a cutoff frequency as a fraction of the Nyquist frequency. "none"
+    designs a filter that passes samples through unchanged."""
+    if kind == "butter":
+        return scipy.signal.butter(
+            N=order, Wn=cutoff, btype="low", analog=False, output="sos"
+        )
+    if kind == "bessel":
+        return scipy.signal.bessel(
+            N=order, Wn=cutoff, btype="low", analog=False, output="sos", norm="delay"
+        )
+    if kind == "none":
+        return []
+    raise ValueError('Unknown filter design "{}"'.format(kind))
+
+
+class LowPassFilter:
+    """
+    Filters axes signals together, one sample of each at a time.
+
+    The state starts at the steady state of the first sample, so the output
+    starts at the first sample instead of rising from zero. update() returns the
+    filtered sample in out, a list that is overwritten by the next update.
+    """
+
+    def __init__(self, sos, axes=3):
+        # b0, b1, b2, a1, a2 of every section, normalised to a0 = 1
+        self.sections = [
+            (b0 / a0, b1 / a0, b2 / a0, a1 / a0, a2 / a0)
+            for b0, b1, b2, a0, a1, a2 in (map(float, section) for section in sos)
+        ]
+        self.axes = axes
+        self.out = [0.0] * axes
+        # two delays per section and axis
+        self._state = [[0.0, 0.0] * len(self.sections) for _ in range(axes)]
+        self._started = False
+
+    @property
+    def groupDelay(self):
+        """Delay of slow signals through the filter, in samples"""
+        delay = 0.0
+        for b0, b1, b2, a1, a2 in self.sections:
+            # group delay at DC of numerator and denominator polynomials in z^-1
+            delay += (b1 + 2.0 * b2) / (b0 + b1 + b2) - (a1 + 2.0 * a2) / (
+                1.0 + a1 + a2
+            )
+        return delay
+
+    @classmethod
+    def from_config(cls, config, axes=3):
+        """Create a filter from a dict with "design", "order" and "cutoff", e.g.
+        read from YAML"""
+        return cls(
+            design(
+                config.get("design", "butter"),
+                config.get("order", 4),
+                config.get("cutoff", 0.1),
+            ),
+            axes=axes,
+        )
+
+    def reset(self, sample):
+        """Set the state as if sample had been the input forever"""
+        for axis in range(self.axes):
+            state = self._state[axis]
+            x = float(sample[axis])
+            for i, (b0, b1, b2, a1, a2) in enumerate(self.sections):
+                # steady state of a section with constant input x, whose output
+                # is x times the section's gain at DC
+                y = x * (b0 + b1 + b2) / (1.0 + a1 + a2)
+                state[2 * i] = y - b0 * x
+                state[2 * i + 1] = b2 * x - a2 * y
+                x = y
+        self._started = True
+
+    def update(self, sample):
+        """Filter one sample of every axis, return out"""
+        if not self._started:
+            self.reset(sample)
+        out = self.out
+        for axis in range(self.axes):
+            state = self._state[axis]
+            x = float(sample[axis])
+            i = 0
+            for b0, b1, b2, a1, a2 in self.sections:
+                y = b0 * x + state[i]
+                state[i] = b1 * x - a1 * y + state[i + 1]
+                state[i + 1] = b2 * x - a2 * y
+                x = y
+                i += 2
+            out[axis] = x
+        return out
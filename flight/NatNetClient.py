@@ -1,7 +1,20 @@
-﻿import socket
+﻿import os
+import socket
 import struct
+import time
 from threading import Thread
 
+import numpy as np
+
+from flight.Histogram import Histogram
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Not available on Windows, backlog detection is skipped there
+    fcntl = None
+
 
 def trace(*args):
     pass  # print( "".join(map(str,args)) )
@@ -12,6 +25,285 @@ Vector3 = struct.Struct("<fff")
 Quaternion = struct.Struct("<ffff")
 FloatValue = struct.Struct("<f")
 DoubleValue = struct.Struct("<d")
+IntValue = struct.Struct("<I")
+ShortValue = struct.Struct("<h")
+CountPair = struct.Struct("<II")
+# ID and parent ID of a rigid body description, -1 for no parent as in the NatNet SDK
+IdAndParent = struct.Struct("<Ii")
+MessageHead = struct.Struct("<HH")
+# ID, position, orientation and marker count at the start of every rigid body
+RigidBodyHead = struct.Struct("<I7fI")
+# Only the ID and marker count of the head, to skip a rigid body
+RigidBodyIdAndCount = struct.Struct("<I28xI")
+# Marker error and tracking valid flags at the end of a rigid body
+ErrorAndParams = struct.Struct("<fh")
+# Latency, timecode, timecode subframe, timestamp and parameters at the end of
+# every frame. The timestamp is a double in version 2.7 and later.
+FrameTailDouble = struct.Struct("<fIIdh")
+FrameTailFloat = struct.Struct("<fIIfh")
+
+# NumPy types for viewing fixed-size records in place with np.frombuffer
+MarkerArray = np.dtype(("<f4", 3))
+LabeledMarker = np.dtype([("id", "<u4"), ("pos", "<f4", 3), ("size", "<f4")])
+LabeledMarkerWithParams = np.dtype(
+    [("id", "<u4"), ("pos", "<f4", 3), ("size", "<f4"), ("params", "<i2")]
+)
+
+# One rigid body in the batch handed to rigidBodyFrameListener
+RigidBodyData = np.dtype(
+    [
+        ("id", "<i4"),
+        ("pos", "<f8", 3),
+        ("rot", "<f8", 4),
+        ("markerError", "<f8"),
+        ("trackingValid", "?"),
+    ]
+)
+
+
+# Offset of the NUL that ends the string at offset. Memoryviews can't be searched,
+# so for the views of received packets the buffer they view from its start is.
+def stringEnd(data, offset):
+    if isinstance(data, memoryview):
+        return data.obj.index(b"\0", offset, len(data))
+    return data.index(b"\0", offset)
+
+
+# Readers for the tail of a rigid body, one per layout. Each returns the marker
+# error and whether the body was tracked.
+def unpackErrorAndParams(data, offset):
+    markerError, param = ErrorAndParams.unpack_from(data, offset)
+    return markerError, (param & 0x01) != 0
+
+
+def unpackErrorOnly(data, offset):
+    return FloatValue.unpack_from(data, offset)[0], True
+
+
+def unpackParamsOnly(data, offset):
+    return 0.0, (ShortValue.unpack_from(data, offset)[0] & 0x01) != 0
+
+
+def unpackNoTail(data, offset):
+    return 0.0, True
+
+
+class DecodePlan:
+    """How to decode frames of one NatNet version with one subscription.
+
+    The section attributes hold the handler for each section of a frame: one that
+    decodes it, one that skips it, or one that reads nothing for sections the
+    version doesn't have. Built by the client whenever the version or the
+    subscription changes, so that decoding a frame involves no version checks.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.hasDescriptionNames = True
+        self.markerStride = 20
+        self.rigidBodyTail = unpackErrorAndParams
+        self.rigidBodyTailSize = ErrorAndParams.size
+        self.rigidBodySize = RigidBodyHead.size + ErrorAndParams.size
+        self.labeledMarker = LabeledMarkerWithParams
+        self.frameTail = FrameTailDouble
+        self.markerSets = None
+        self.unlabeledMarkers = None
+        self.rigidBodies = None
+        self.skeletons = None
+        self.labeledMarkers = None
+        self.forcePlates = None
+
+
+class RigidBodyFrame:
+    """All subscribed rigid bodies of one frame of mocap data.
+
+    The client hands the same instance, backed by the same preallocated array, to
+    its rigidBodyFrameListener for every frame. Listeners have to copy whatever
+    they want to keep after returning.
+    """
+
+    def __init__(self, capacity=8):
+        self.frameNumber = 0
+        # time.perf_counter() when the packet of this frame arrived
+        self.arrivalTime = 0.0
+        self.latency = 0.0
+        self.timestamp = 0.0
+        self.timecode = 0
+        self.timecodeSub = 0
+        self.count = 0
+        self.__buffer = np.zeros(capacity, dtype=RigidBodyData)
+
+    @property
+    def bodies(self):
+        """Structured array (RigidBodyData) of the rigid bodies in this frame"""
+        return self.__buffer[: self.count]
+
+    def reserve(self, count):
+        """Make room for count rigid bodies and return the backing array"""
+        if count > len(self.__buffer):
+            self.__buffer = np.zeros(
+                max(count, 2 * len(self.__buffer)), dtype=RigidBodyData
+            )
+        return self.__buffer
+
+    def copy(self):
+        """Return a snapshot of this frame that is safe to keep"""
+        snapshot = RigidBodyFrame(capacity=max(self.count, 1))
+        snapshot.frameNumber = self.frameNumber
+        snapshot.arrivalTime = self.arrivalTime
+        snapshot.latency = self.latency
+        snapshot.timestamp = self.timestamp
+        snapshot.timecode = self.timecode
+        snapshot.timecodeSub = self.timecodeSub
+        snapshot.count = self.count
+        snapshot.reserve(self.count)[: self.count] = self.bodies
+        return snapshot
+
+
+class ReceiveStats:
+    """Counters for the NatNet data stream, to tell where frames get lost.
+
+    missedFrames counts frame numbers that never arrived, wherever they were lost.
+    kernelDrops counts datagrams the kernel dropped because the socket buffer was
+    full (Linux only, None elsewhere). backlogged counts packets that were already
+    waiting when the previous one had been processed, i.e. Python falling behind.
+    Missed frames that the kernel didn't drop were lost on the network.
+    malformed counts packets that could not be decoded and were discarded.
+    Frame numbers that go back by more than resetGap are Motive restarting its
+    count, e.g. when recording starts, and are counted in resets instead of as
+    reordered.
+
+    The histograms time the receive pipeline per frame: decodeTime is the time
+    spent decoding (including any rigidBodyListener), listenerTime the time spent
+    in the frame listeners, interArrival the time between the starts of
+    consecutive frames, whose spread is the jitter, and motiveLatency the latency
+    Motive reports in the frame. All of them can be polled while receiving.
+    """
+
+    # Largest step back in frame numbers that is still a late frame
+    resetGap = 300
+
+    def __init__(self):
+        self.packets = 0
+        self.firstPacketTime = None
+        self.lastPacketTime = None
+        self.frames = 0
+        self.lastFrameNumber = None
+        self.missedFrames = 0
+        self.reorderedFrames = 0
+        self.resets = 0
+        self.backlogged = 0
+        self.malformed = 0
+        self.kernelDrops = None
+        self.socketBufferSize = None
+
+        self.decodeTime = Histogram(1, 1e5, unit=" us")
+        self.listenerTime = Histogram(1, 1e5, unit=" us")
+        self.interArrival = Histogram(0.01, 1000, unit=" ms")
+        self.motiveLatency = Histogram(0.01, 1000, unit=" ms")
+        self.__lastFrameStart = None
+
+    def packet(self, arrival=None):
+        """Account for a received packet, arrived at time.perf_counter() arrival"""
+        if arrival is None:
+            arrival = time.perf_counter()
+        if self.firstPacketTime is None:
+            self.firstPacketTime = arrival
+        self.lastPacketTime = arrival
+        self.packets += 1
+
+    @property
+    def packetRate(self):
+        """Average packets per second since the first packet"""
+        if self.packets < 2:
+            return 0.0
+        return (self.packets - 1) / (self.lastPacketTime - self.firstPacketTime)
+
+    def timing(self, start, decoded, done, latency):
+        """Account for the time.perf_counter() at the start of a frame, after
+        decoding it and after its listeners returned, and Motive's latency in s"""
+        self.decodeTime.record((decoded - start) * 1e6)
+        self.listenerTime.record((done - decoded) * 1e6)
+        if self.__lastFrameStart is not None:
+            self.interArrival.record((start - self.__lastFrameStart) * 1e3)
+        self.__lastFrameStart = start
+        self.motiveLatency.record(latency * 1e3)
+
+    def summary(self):
+        """Return the counters and timing histograms as a multi-line string"""
+        return (
+            "{}\n"
+            "  packet rate:    {:.1f} packets/s\n"
+            "  decode time:    {}\n"
+            "  listener time:  {}\n"
+            "  inter-arrival:  {}\n"
+            "  Motive latency: {}".format(
+                self,
+                self.packetRate,
+                self.decodeTime,
+                self.listenerTime,
+                self.interArrival,
+                self.motiveLatency,
+            )
+        )
+
+    def frame(self, frameNumber):
+        """Account for a received frame number"""
+        self.frames += 1
+        if self.lastFrameNumber is not None:
+            gap = frameNumber - self.lastFrameNumber
+            if gap < -self.resetGap:
+                # Counting restarted, start over from this frame
+                self.resets += 1
+                self.lastFrameNumber = frameNumber
+                return
+            if gap <= 0:
+                # Late or duplicate, keep waiting for frames after the newest one
+                self.reorderedFrames += 1
+                return
+            self.missedFrames += gap - 1
+        self.lastFrameNumber = frameNumber
+
+    def __str__(self):
+        return (
+            "{} packets, {} frames, {} missed, {} reordered, {} resets, "
+            "{} backlogged, {} malformed, {} dropped by kernel, "
+            "socket buffer {} bytes".format(
+                self.packets,
+                self.frames,
+                self.missedFrames,
+                self.reorderedFrames,
+                self.resets,
+                self.backlogged,
+                self.malformed,
+                self.kernelDrops,
+                self.socketBufferSize,
+            )
+        )
+
+
+def kernelDrops(sock):
+    """Return the number of datagrams the kernel dropped for a UDP socket, read
+    from /proc/net/udp. Returns None where this isn't available."""
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open("/proc/net/udp") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields[9] == inode:
+                    return int(fields[-1])
+    except (OSError, IndexError, ValueError, StopIteration):
+        pass
+    return None
+
+
+def pendingBytes(sock):
+    """Return the size of the next datagram waiting on a socket, or 0"""
+    if fcntl is None:
+        return 0
+    size = struct.pack("I", 0)
+    return struct.unpack("I", fcntl.ioctl(sock.fileno(), termios.FIONREAD, size))[0]
 
 
 class NatNetClient:
@@ -30,12 +322,49 @@ class NatNetClient:
         # NatNet Data channel
         self.dataPort = 1511
 
+        # Size of the kernel receive buffer of the data socket in bytes, or None
+        # for the system default. A larger buffer rides out short stalls at
+        # high frame rates. Linux caps it at net.core.rmem_max.
+        self.receiveBufferSize = None
+
+        # Number of reusable packet buffers the data thread receives into.
+        # Arrays viewing a packet stay valid until this many more have arrived.
+        self.receiveBufferCount = 4
+
+        # Counters for received, missed and late frames, and for the replies
+        # on the command socket, which are kept apart so they don't count as
+        # mocap data
+        self.receiveStats = ReceiveStats()
+        self.commandStats = ReceiveStats()
+
+        # Set this to a callback method of your choice to receive every raw packet,
+        # as packetListener(data, size), e.g. NatNetRecorder.record. The data
+        # buffer is reused afterwards, so only its first size bytes are valid.
+        self.packetListener = None
+
+        # Set this to a callback method of your choice to receive per-frame data.
+        self.newFrameListener = None
+
         # Set this to a callback method of your choice to receive per-rigid-body data at each frame.
         self.rigidBodyListener = None
 
+        # Set this to a callback method of your choice to receive all rigid bodies
+        # of a frame at once, as a RigidBodyFrame.
+        self.rigidBodyFrameListener = None
+        self.__rigidBodyFrame = RigidBodyFrame()
+
         # NatNet stream version. This will be updated to the actual version the server is using during initialization.
         self.__natNetStreamVersion = (3, 0, 0, 0)
 
+        # Data kinds and rigid body IDs to decode, see subscribe(). By default
+        # everything is decoded and every rigid body is reported.
+        self.__subscribedKinds = self.DATA_ALL
+        self.__subscribedRigidBodyIds = None
+        self.__buildDecodePlan()
+
+        # Set while the receive threads started by run() are alive
+        self.__running = False
+
     # Client/server message ids
     NAT_PING = 0
     NAT_PINGRESPONSE = 1
@@ -49,12 +378,51 @@ class NatNetClient:
     NAT_DISCONNECT = 9
     NAT_UNRECOGNIZED_REQUEST = 100
 
+    # Seconds between checks whether the receive threads should stop
+    POLL_INTERVAL = 0.1
+
+    # Data kinds in a frame of mocap data that can be subscribed to
+    DATA_MARKER_SETS = 0x01
+    DATA_UNLABELED_MARKERS = 0x02
+    DATA_RIGID_BODIES = 0x04
+    DATA_SKELETONS = 0x08
+    DATA_LABELED_MARKERS = 0x10
+    DATA_FORCE_PLATES = 0x20
+    DATA_ALL = 0x3F
+
+    @property
+    def natNetStreamVersion(self):
+        """NatNet version of the stream, as reported by the last ping response"""
+        return self.__natNetStreamVersion
+
+    def subscribe(self, rigidBodyIds=None, kinds=DATA_ALL):
+        """Only decode the parts of each frame that are needed.
+
+        rigidBodyIds: IDs of the rigid bodies to report to the listeners, or None
+        for all of them. kinds: the DATA_* kinds to decode, or-ed together.
+        Sections that are not subscribed to are skipped by computing their
+        length from the counts in the packet, without decoding their contents.
+        """
+        self.__subscribedKinds = kinds
+        if rigidBodyIds is None:
+            self.__subscribedRigidBodyIds = None
+        else:
+            self.__subscribedRigidBodyIds = frozenset(rigidBodyIds)
+        self.__buildDecodePlan()
+
     # Create a data socket to attach to the NatNet stream
-    def __createDataSocket(self, port):
+    def createDataSocket(self, port):
         result = socket.socket(
             socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP  # Internet
         )  # UDP
         result.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.receiveBufferSize is not None:
+            result.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, self.receiveBufferSize
+            )
+        self.receiveStats.socketBufferSize = result.getsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF
+        )
         result.bind(("", port))
 
         mreq = struct.pack(
@@ -64,7 +432,7 @@ class NatNetClient:
         return result
 
     # Create a command socket to attach to the NatNet stream
-    def __createCommandSocket(self):
+    def createCommandSocket(self):
         result = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         result.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         result.bind(("", 0))
@@ -72,249 +440,363 @@ class NatNetClient:
 
         return result
 
-    # Unpack a rigid body object from a data packet
-    def __unpackRigidBody(self, data):
-        offset = 0
+    # Read a NUL-terminated string in place. Returns the string and the offset
+    # just past its terminator, without copying the remainder of the packet.
+    def __unpackString(self, data, offset):
+        end = stringEnd(data, offset)
+        if isinstance(data, memoryview):
+            return bytes(data[offset:end]), end + 1
+        return data[offset:end], end + 1
+
+    # Resolve everything that depends on the NatNet version and the subscription
+    # into a decode plan, so decoding a frame needs no version logic. Called
+    # again whenever either of them changes.
+    def __buildDecodePlan(self):
+        major, minor = self.__natNetStreamVersion[0:2]
+        hasMarkerInfo = major >= 2
+        hasParams = (major == 2 and minor >= 6) or major > 2 or major == 0
+        hasSkeletons = (major == 2 and minor > 0) or major > 2
+        hasLabeledMarkers = (major == 2 and minor > 3) or major > 2
+        hasForcePlates = (major == 2 and minor >= 9) or major > 2
+        hasDoubleTimestamp = (major == 2 and minor >= 7) or major > 2
+
+        kinds = self.__subscribedKinds
+
+        plan = DecodePlan(self.__natNetStreamVersion)
+        plan.hasDescriptionNames = major >= 2
+
+        # Marker positions, and marker ID's and sizes in version 2.0 and later
+        plan.markerStride = 20 if hasMarkerInfo else 12
+        # Marker error (2.0 and later) and tracking valid (2.6 and later)
+        if hasMarkerInfo and hasParams:
+            plan.rigidBodyTail = unpackErrorAndParams
+            plan.rigidBodyTailSize = ErrorAndParams.size
+        elif hasMarkerInfo:
+            plan.rigidBodyTail = unpackErrorOnly
+            plan.rigidBodyTailSize = FloatValue.size
+        elif hasParams:
+            plan.rigidBodyTail = unpackParamsOnly
+            plan.rigidBodyTailSize = ShortValue.size
+        else:
+            plan.rigidBodyTail = unpackNoTail
+            plan.rigidBodyTailSize = 0
+        # Size of a rigid body without its markers
+        plan.rigidBodySize = RigidBodyHead.size + plan.rigidBodyTailSize
+        # Labeled marker records, with occlusion flags in 2.6 and later
+        plan.labeledMarker = LabeledMarkerWithParams if hasParams else LabeledMarker
+        # Latency, timecode, timecode subframe, timestamp (double precision in 2.7
+        # and later) and frame parameters
+        plan.frameTail = FrameTailDouble if hasDoubleTimestamp else FrameTailFloat
+
+        # Section handlers: decode, skip or, for sections the version doesn't
+        # have, nothing
+        def pick(kind, present, unpack, skip):
+            if not present:
+                return self.__absentSection
+            return unpack if kinds & kind else skip
+
+        plan.markerSets = pick(
+            self.DATA_MARKER_SETS,
+            True,
+            self.__unpackMarkerSets,
+            self.__skipMarkerSets,
+        )
+        plan.unlabeledMarkers = pick(
+            self.DATA_UNLABELED_MARKERS,
+            True,
+            self.__unpackUnlabeledMarkers,
+            self.__skipUnlabeledMarkers,
+        )
+        plan.rigidBodies = pick(
+            self.DATA_RIGID_BODIES,
+            True,
+            self.__unpackRigidBodies,
+            self.__skipRigidBodies,
+        )
+        plan.skeletons = pick(
+            self.DATA_SKELETONS,
+            hasSkeletons,
+            self.__unpackSkeletons,
+            self.__skipSkeletons,
+        )
+        plan.labeledMarkers = pick(
+            self.DATA_LABELED_MARKERS,
+            hasLabeledMarkers,
+            self.__unpackLabeledMarkers,
+            self.__skipLabeledMarkers,
+        )
+        plan.forcePlates = pick(
+            self.DATA_FORCE_PLATES,
+            hasForcePlates,
+            self.__unpackForcePlates,
+            self.__skipForcePlates,
+        )
 
-        # ID (4 bytes)
-        id = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
-        trace("ID:", id)
+        self.__plan = plan
 
-        # Position and orientation
-        pos = Vector3.unpack(data[offset : offset + 12])
-        offset += 12
-        trace("\tPosition:", pos[0], ",", pos[1], ",", pos[2])
-        rot = Quaternion.unpack(data[offset : offset + 16])
-        offset += 16
-        trace("\tOrientation:", rot[0], ",", rot[1], ",", rot[2], ",", rot[3])
+    # Unpack a rigid body object starting at an absolute offset in the packet.
+    # If a batch array is given, the body is also stored in the given row.
+    def __unpackRigidBody(self, data, offset, batch=None, row=0):
+        plan = self.__plan
 
-        # Marker count (4 bytes)
-        markerCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
-        markerCountRange = range(0, markerCount)
-        trace("\tMarker Count:", markerCount)
+        # ID, position, orientation and marker count in one go
+        (id, x, y, z, qx, qy, qz, qw, markerCount) = RigidBodyHead.unpack_from(
+            data, offset
+        )
+        pos = (x, y, z)
+        rot = (qx, qy, qz, qw)
 
-        # Send information to any listener.
+        # Marker positions, ID's and sizes are not reported, so they are skipped
+        offset += RigidBodyHead.size + plan.markerStride * markerCount
+
+        markerError, trackingValid = plan.rigidBodyTail(data, offset)
+        offset += plan.rigidBodyTailSize
+        trace("ID:", id, "\tPosition:", pos, "\tOrientation:", rot)
+        trace("\tMarker Count:", markerCount, "\tMarker Error:", markerError)
+        trace("\tTracking Valid:", trackingValid)
+
+        if batch is not None:
+            batch[row] = (id, pos, rot, markerError, trackingValid)
+
+        # Send information to any listener, now that the body is fully parsed.
         if self.rigidBodyListener is not None:
             self.rigidBodyListener(id, pos, rot)
 
-        # Marker positions
-        for i in markerCountRange:
-            pos = Vector3.unpack(data[offset : offset + 12])
-            offset += 12
-            trace("\tMarker", i, ":", pos[0], ",", pos[1], ",", pos[2])
+        return offset
 
-        if self.__natNetStreamVersion[0] >= 2:
-            # Marker ID's
-            for i in markerCountRange:
-                id = int.from_bytes(data[offset : offset + 4], byteorder="little")
-                offset += 4
-                trace("\tMarker ID", i, ":", id)
+    # Skip a rigid body without decoding it. Its length follows from the marker
+    # count, the size of the per-marker data and the fixed-size tail.
+    def __skipRigidBody(self, data, offset):
+        plan = self.__plan
+        (markerCount,) = IntValue.unpack_from(data, offset + RigidBodyHead.size - 4)
+        return offset + plan.rigidBodySize + plan.markerStride * markerCount
 
-            # Marker sizes
-            for i in markerCountRange:
-                size = FloatValue.unpack(data[offset : offset + 4])
-                offset += 4
-                trace("\tMarker Size", i, ":", size[0])
+    # The section handlers below each take the absolute offset of their section
+    # and return the number of items in it and the offset of the next section.
 
-            (markerError,) = FloatValue.unpack(data[offset : offset + 4])
+    def __unpackMarkerSets(self, data, offset):
+        (markerSetCount,) = IntValue.unpack_from(data, offset)
+        offset += 4
+        trace("Marker Set Count:", markerSetCount)
+
+        for i in range(markerSetCount):
+            # Model name
+            modelName, offset = self.__unpackString(data, offset)
+            trace("Model Name:", modelName)
+
+            # Marker count (4 bytes)
+            (markerCount,) = IntValue.unpack_from(data, offset)
             offset += 4
-            trace("\tMarker Error:", markerError)
+            trace("Marker Count:", markerCount)
 
-        # Version 2.6 and later
-        if (
-            (
-                (self.__natNetStreamVersion[0] == 2)
-                and (self.__natNetStreamVersion[1] >= 6)
+            markers = np.frombuffer(
+                data, dtype=MarkerArray, count=markerCount, offset=offset
             )
-            or self.__natNetStreamVersion[0] > 2
-            or self.__natNetStreamVersion[0] == 0
-        ):
-            (param,) = struct.unpack("h", data[offset : offset + 2])
-            trackingValid = (param & 0x01) != 0
-            offset += 2
-            trace("\tTracking Valid:", "True" if trackingValid else "False")
-
-        return offset
+            offset += 12 * markerCount
+            trace("\tMarkers:", markers)
 
-    # Unpack a skeleton object from a data packet
-    def __unpackSkeleton(self, data):
-        offset = 0
+        return markerSetCount, offset
 
-        id = int.from_bytes(data[offset : offset + 4], byteorder="little")
+    def __skipMarkerSets(self, data, offset):
+        (markerSetCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-        trace("ID:", id)
-
-        rigidBodyCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        # the search for the end of every name is all that's left to do, so it
+        # goes straight to the buffer's index()
+        if isinstance(data, memoryview):
+            find, end = data.obj.index, len(data)
+        else:
+            find, end = data.index, len(data)
+        for i in range(markerSetCount):
+            offset = find(b"\0", offset, end) + 1
+            (markerCount,) = IntValue.unpack_from(data, offset)
+            offset += 4 + 12 * markerCount
+        return markerSetCount, offset
+
+    def __unpackUnlabeledMarkers(self, data, offset):
+        (unlabeledMarkersCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-        trace("Rigid Body Count:", rigidBodyCount)
-        for j in range(0, rigidBodyCount):
-            offset += self.__unpackRigidBody(data[offset:])
+        trace("Unlabeled Markers Count:", unlabeledMarkersCount)
 
-        return offset
+        unlabeledMarkers = np.frombuffer(
+            data, dtype=MarkerArray, count=unlabeledMarkersCount, offset=offset
+        )
+        offset += 12 * unlabeledMarkersCount
+        trace("\tMarkers:", unlabeledMarkers)
 
-    # Unpack data from a motion capture frame message
-    def __unpackMocapData(self, data):
-        trace("Begin MoCap Frame\n-----------------\n")
+        return unlabeledMarkersCount, offset
 
-        data = memoryview(data)
-        offset = 0
+    def __skipUnlabeledMarkers(self, data, offset):
+        (unlabeledMarkersCount,) = IntValue.unpack_from(data, offset)
+        return unlabeledMarkersCount, offset + 4 + 12 * unlabeledMarkersCount
 
-        # Frame number (4 bytes)
-        frameNumber = int.from_bytes(data[offset : offset + 4], byteorder="little")
+    def __unpackRigidBodies(self, data, offset):
+        (rigidBodyCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-        trace("Frame #:", frameNumber)
+        trace("Rigid Body Count:", rigidBodyCount)
 
-        # Marker set count (4 bytes)
-        markerSetCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        frame = self.__rigidBodyFrame
+        batch = None
+        if self.rigidBodyFrameListener is not None:
+            batch = frame.reserve(rigidBodyCount)
+
+        rigidBodyIds = self.__subscribedRigidBodyIds
+        row = 0
+        if rigidBodyIds is None:
+            for i in range(rigidBodyCount):
+                offset = self.__unpackRigidBody(data, offset, batch, row)
+                row += 1
+        else:
+            # bodies with other IDs are skipped inline, from their ID and
+            # marker count read in one go
+            plan = self.__plan
+            markerStride = plan.markerStride
+            rigidBodySize = plan.rigidBodySize
+            for i in range(rigidBodyCount):
+                id, markerCount = RigidBodyIdAndCount.unpack_from(data, offset)
+                if id in rigidBodyIds:
+                    offset = self.__unpackRigidBody(data, offset, batch, row)
+                    row += 1
+                else:
+                    offset += rigidBodySize + markerStride * markerCount
+        frame.count = row
+
+        return rigidBodyCount, offset
+
+    def __skipRigidBodies(self, data, offset):
+        (rigidBodyCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-        trace("Marker Set Count:", markerSetCount)
+        for i in range(rigidBodyCount):
+            offset = self.__skipRigidBody(data, offset)
+        self.__rigidBodyFrame.count = 0
+        return rigidBodyCount, offset
 
-        for i in range(0, markerSetCount):
-            # Model name
-            modelName, separator, remainder = bytes(data[offset:]).partition(b"\0")
-            offset += len(modelName) + 1
-            trace("Model Name:", modelName.decode("utf-8"))
+    def __unpackSkeletons(self, data, offset):
+        (skeletonCount,) = IntValue.unpack_from(data, offset)
+        offset += 4
+        trace("Skeleton Count:", skeletonCount)
 
-            # Marker count (4 bytes)
-            markerCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
-            offset += 4
-            trace("Marker Count:", markerCount)
+        for i in range(skeletonCount):
+            id, rigidBodyCount = CountPair.unpack_from(data, offset)
+            offset += 8
+            trace("ID:", id)
+            trace("Rigid Body Count:", rigidBodyCount)
+            for j in range(rigidBodyCount):
+                offset = self.__unpackRigidBody(data, offset)
 
-            for j in range(0, markerCount):
-                pos = Vector3.unpack(data[offset : offset + 12])
-                offset += 12
-                # trace( "\tMarker", j, ":", pos[0],",", pos[1],",", pos[2] )
+        return skeletonCount, offset
 
-        # Unlabeled markers count (4 bytes)
-        unlabeledMarkersCount = int.from_bytes(
-            data[offset : offset + 4], byteorder="little"
-        )
+    def __skipSkeletons(self, data, offset):
+        (skeletonCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-        trace("Unlabeled Markers Count:", unlabeledMarkersCount)
-
-        for i in range(0, unlabeledMarkersCount):
-            pos = Vector3.unpack(data[offset : offset + 12])
-            offset += 12
-            trace("\tMarker", i, ":", pos[0], ",", pos[1], ",", pos[2])
+        for i in range(skeletonCount):
+            (rigidBodyCount,) = IntValue.unpack_from(data, offset + 4)
+            offset += 8
+            for j in range(rigidBodyCount):
+                offset = self.__skipRigidBody(data, offset)
+        return skeletonCount, offset
 
-        # Rigid body count (4 bytes)
-        rigidBodyCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+    def __unpackLabeledMarkers(self, data, offset):
+        (labeledMarkerCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-        trace("Rigid Body Count:", rigidBodyCount)
+        trace("Labeled Marker Count:", labeledMarkerCount)
+
+        # Fixed-size records, viewed as one structured array. The params field
+        # holds the occluded, point cloud solved and model solved flags in its
+        # lowest three bits.
+        labeledMarkerType = self.__plan.labeledMarker
+        labeledMarkers = np.frombuffer(
+            data, dtype=labeledMarkerType, count=labeledMarkerCount, offset=offset
+        )
+        offset += labeledMarkerType.itemsize * labeledMarkerCount
+        trace("\tLabeled Markers:", labeledMarkers)
 
-        for i in range(0, rigidBodyCount):
-            offset += self.__unpackRigidBody(data[offset:])
+        return labeledMarkerCount, offset
 
-        # Version 2.1 and later
-        skeletonCount = 0
-        if (
-            self.__natNetStreamVersion[0] == 2 and self.__natNetStreamVersion[1] > 0
-        ) or self.__natNetStreamVersion[0] > 2:
-            skeletonCount = int.from_bytes(
-                data[offset : offset + 4], byteorder="little"
-            )
-            offset += 4
-            trace("Skeleton Count:", skeletonCount)
-            for i in range(0, skeletonCount):
-                offset += self.__unpackSkeleton(data[offset:])
+    def __skipLabeledMarkers(self, data, offset):
+        (labeledMarkerCount,) = IntValue.unpack_from(data, offset)
+        itemSize = self.__plan.labeledMarker.itemsize
+        return labeledMarkerCount, offset + 4 + itemSize * labeledMarkerCount
 
-        # Labeled markers (Version 2.3 and later)
-        labeledMarkerCount = 0
-        if (
-            self.__natNetStreamVersion[0] == 2 and self.__natNetStreamVersion[1] > 3
-        ) or self.__natNetStreamVersion[0] > 2:
-            labeledMarkerCount = int.from_bytes(
-                data[offset : offset + 4], byteorder="little"
-            )
-            offset += 4
-            trace("Labeled Marker Count:", labeledMarkerCount)
-            for i in range(0, labeledMarkerCount):
-                id = int.from_bytes(data[offset : offset + 4], byteorder="little")
-                offset += 4
-                pos = Vector3.unpack(data[offset : offset + 12])
-                offset += 12
-                size = FloatValue.unpack(data[offset : offset + 4])
-                offset += 4
+    def __unpackForcePlates(self, data, offset):
+        (forcePlateCount,) = IntValue.unpack_from(data, offset)
+        offset += 4
+        trace("Force Plate Count:", forcePlateCount)
 
-                # Version 2.6 and later
-                if (
-                    (
-                        self.__natNetStreamVersion[0] == 2
-                        and self.__natNetStreamVersion[1] >= 6
-                    )
-                    or self.__natNetStreamVersion[0] > 2
-                    or major == 0
-                ):
-                    (param,) = struct.unpack("h", data[offset : offset + 2])
-                    offset += 2
-                    occluded = (param & 0x01) != 0
-                    pointCloudSolved = (param & 0x02) != 0
-                    modelSolved = (param & 0x04) != 0
-
-        # Force Plate data (version 2.9 and later)
-        if (
-            self.__natNetStreamVersion[0] == 2 and self.__natNetStreamVersion[1] >= 9
-        ) or self.__natNetStreamVersion[0] > 2:
-            forcePlateCount = int.from_bytes(
-                data[offset : offset + 4], byteorder="little"
-            )
-            offset += 4
-            trace("Force Plate Count:", forcePlateCount)
-            for i in range(0, forcePlateCount):
-                # ID
-                forcePlateID = int.from_bytes(
-                    data[offset : offset + 4], byteorder="little"
-                )
-                offset += 4
-                trace("Force Plate", i, ":", forcePlateID)
+        for i in range(forcePlateCount):
+            # ID and channel count
+            forcePlateID, forcePlateChannelCount = CountPair.unpack_from(data, offset)
+            offset += 8
+            trace("Force Plate", i, ":", forcePlateID)
 
-                # Channel Count
-                forcePlateChannelCount = int.from_bytes(
-                    data[offset : offset + 4], byteorder="little"
-                )
+            # Channel data
+            for j in range(forcePlateChannelCount):
+                (forcePlateChannelFrameCount,) = IntValue.unpack_from(data, offset)
                 offset += 4
+                forcePlateChannelVals = np.frombuffer(
+                    data, dtype="<f4", count=forcePlateChannelFrameCount, offset=offset
+                )
+                offset += 4 * forcePlateChannelFrameCount
+                trace("\tChannel", j, ":", forcePlateChannelVals)
 
-                # Channel Data
-                for j in range(0, forcePlateChannelCount):
-                    trace("\tChannel", j, ":", forcePlateID)
-                    forcePlateChannelFrameCount = int.from_bytes(
-                        data[offset : offset + 4], byteorder="little"
-                    )
-                    offset += 4
-                    for k in range(0, forcePlateChannelFrameCount):
-                        forcePlateChannelVal = int.from_bytes(
-                            data[offset : offset + 4], byteorder="little"
-                        )
-                        offset += 4
-                        trace("\t\t", forcePlateChannelVal)
-
-        # Latency
-        (latency,) = FloatValue.unpack(data[offset : offset + 4])
-        offset += 4
+        return forcePlateCount, offset
 
-        # Timecode
-        timecode = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
-        timecodeSub = int.from_bytes(data[offset : offset + 4], byteorder="little")
+    def __skipForcePlates(self, data, offset):
+        (forcePlateCount,) = IntValue.unpack_from(data, offset)
         offset += 4
-
-        # Timestamp (increased to double precision in 2.7 and later)
-        if (
-            self.__natNetStreamVersion[0] == 2 and self.__natNetStreamVersion[1] >= 7
-        ) or self.__natNetStreamVersion[0] > 2:
-            (timestamp,) = DoubleValue.unpack(data[offset : offset + 8])
+        for i in range(forcePlateCount):
+            (forcePlateChannelCount,) = IntValue.unpack_from(data, offset + 4)
             offset += 8
-        else:
-            (timestamp,) = FloatValue.unpack(data[offset : offset + 4])
-            offset += 4
+            for j in range(forcePlateChannelCount):
+                (forcePlateChannelFrameCount,) = IntValue.unpack_from(data, offset)
+                offset += 4 + 4 * forcePlateChannelFrameCount
+        return forcePlateCount, offset
+
+    # Sections the stream's NatNet version doesn't have
+    def __absentSection(self, data, offset):
+        return 0, offset
+
+    # Unpack data from a motion capture frame message. The whole packet is
+    # walked once at absolute offsets, starting at the frame payload, by the
+    # section handlers of the current decode plan.
+    def __unpackMocapData(self, data, offset, arrival):
+        trace("Begin MoCap Frame\n-----------------\n")
+        start = time.perf_counter()
+        if arrival is None:
+            arrival = start
+        plan = self.__plan
 
-        # Frame parameters
-        (param,) = struct.unpack("h", data[offset : offset + 2])
+        # Frame number (4 bytes)
+        (frameNumber,) = IntValue.unpack_from(data, offset)
+        offset += 4
+        trace("Frame #:", frameNumber)
+        self.receiveStats.frame(frameNumber)
+
+        markerSetCount, offset = plan.markerSets(data, offset)
+        unlabeledMarkersCount, offset = plan.unlabeledMarkers(data, offset)
+        rigidBodyCount, offset = plan.rigidBodies(data, offset)
+        skeletonCount, offset = plan.skeletons(data, offset)
+        labeledMarkerCount, offset = plan.labeledMarkers(data, offset)
+        forcePlateCount, offset = plan.forcePlates(data, offset)
+
+        # Latency, timecode, timecode subframe, timestamp and frame parameters
+        (latency, timecode, timecodeSub, timestamp, param) = plan.frameTail.unpack_from(
+            data, offset
+        )
+        offset += plan.frameTail.size
         isRecording = (param & 0x01) != 0
         trackedModelsChanged = (param & 0x02) != 0
-        offset += 2
+        decoded = time.perf_counter()
+
+        # Send the batch of rigid bodies to any listener.
+        if self.rigidBodyFrameListener is not None:
+            frame = self.__rigidBodyFrame
+            frame.frameNumber = frameNumber
+            frame.arrivalTime = arrival
+            frame.latency = latency
+            frame.timestamp = timestamp
+            frame.timecode = timecode
+            frame.timecodeSub = timecodeSub
+            self.rigidBodyFrameListener(frame)
 
         # Send information to any listener.
         if self.newFrameListener is not None:
@@ -333,130 +815,178 @@ class NatNetClient:
                 trackedModelsChanged,
             )
 
-    # Unpack a marker set description packet
-    def __unpackMarkerSetDescription(self, data):
-        offset = 0
+        self.receiveStats.timing(start, decoded, time.perf_counter(), latency)
+        return offset
 
-        name, separator, remainder = bytes(data[offset:]).partition(b"\0")
-        offset += len(name) + 1
+    # Unpack a marker set description starting at an absolute offset
+    def __unpackMarkerSetDescription(self, data, offset):
+        name, offset = self.__unpackString(data, offset)
         trace("Markerset Name:", name.decode("utf-8"))
 
-        markerCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        (markerCount,) = IntValue.unpack_from(data, offset)
         offset += 4
 
-        for i in range(0, markerCount):
-            name, separator, remainder = bytes(data[offset:]).partition(b"\0")
-            offset += len(name) + 1
-            trace("\tMarker Name:", name.decode("utf-8"))
-
-        return offset
-
-    # Unpack a rigid body description packet
-    def __unpackRigidBodyDescription(self, data):
-        offset = 0
-
+        markerNames = []
+        for i in range(markerCount):
+            markerName, offset = self.__unpackString(data, offset)
+            markerNames.append(markerName.decode("utf-8"))
+            trace("\tMarker Name:", markerNames[-1])
+
+        description = {
+            "type": "markerSet",
+            "name": name.decode("utf-8"),
+            "markerNames": markerNames,
+        }
+        return description, offset
+
+    # Unpack a rigid body description starting at an absolute offset
+    def __unpackRigidBodyDescription(self, data, offset):
+        name = b""
         # Version 2.0 or higher
-        if self.__natNetStreamVersion[0] >= 2:
-            name, separator, remainder = bytes(data[offset:]).partition(b"\0")
-            offset += len(name) + 1
+        if self.__plan.hasDescriptionNames:
+            name, offset = self.__unpackString(data, offset)
             trace("\tMarker Name:", name.decode("utf-8"))
 
-        id = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
-
-        parentID = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
+        id, parentID = IdAndParent.unpack_from(data, offset)
+        offset += 8
 
-        timestamp = Vector3.unpack(data[offset : offset + 12])
+        pivotOffset = Vector3.unpack_from(data, offset)
         offset += 12
 
-        return offset
-
-    # Unpack a skeleton description packet
-    def __unpackSkeletonDescription(self, data):
-        offset = 0
-
-        name, separator, remainder = bytes(data[offset:]).partition(b"\0")
-        offset += len(name) + 1
+        description = {
+            "type": "rigidBody",
+            "name": name.decode("utf-8"),
+            "id": id,
+            "parentID": parentID,
+            "offset": pivotOffset,
+        }
+        return description, offset
+
+    # Unpack a skeleton description starting at an absolute offset
+    def __unpackSkeletonDescription(self, data, offset):
+        name, offset = self.__unpackString(data, offset)
         trace("\tMarker Name:", name.decode("utf-8"))
 
-        id = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
-
-        rigidBodyCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        id, rigidBodyCount = CountPair.unpack_from(data, offset)
+        offset += 8
+
+        rigidBodies = []
+        for i in range(rigidBodyCount):
+            rigidBody, offset = self.__unpackRigidBodyDescription(data, offset)
+            rigidBodies.append(rigidBody)
+
+        description = {
+            "type": "skeleton",
+            "name": name.decode("utf-8"),
+            "id": id,
+            "rigidBodies": rigidBodies,
+        }
+        return description, offset
+
+    # Unpack a data description packet starting at an absolute offset.
+    # Returns the list of descriptions.
+    def __unpackDataDescriptions(self, data, offset):
+        (datasetCount,) = IntValue.unpack_from(data, offset)
         offset += 4
 
-        for i in range(0, rigidBodyCount):
-            offset += self.__unpackRigidBodyDescription(data[offset:])
-
-        return offset
-
-    # Unpack a data description packet
-    def __unpackDataDescriptions(self, data):
-        offset = 0
-        datasetCount = int.from_bytes(data[offset : offset + 4], byteorder="little")
-        offset += 4
-
-        for i in range(0, datasetCount):
-            type = int.from_bytes(data[offset : offset + 4], byteorder="little")
+        descriptions = []
+        for i in range(datasetCount):
+            (type,) = IntValue.unpack_from(data, offset)
             offset += 4
             if type == 0:
-                offset += self.__unpackMarkerSetDescription(data[offset:])
+                description, offset = self.__unpackMarkerSetDescription(data, offset)
             elif type == 1:
-                offset += self.__unpackRigidBodyDescription(data[offset:])
+                description, offset = self.__unpackRigidBodyDescription(data, offset)
             elif type == 2:
-                offset += self.__unpackSkeletonDescription(data[offset:])
-
-    def __dataThreadFunction(self, socket):
-        while True:
-            # Block for input
-            data, addr = socket.recvfrom(32768)  # 32k byte buffer size
-            if len(data) > 0:
-                self.__processMessage(data)
-
-    def __processMessage(self, data):
+                description, offset = self.__unpackSkeletonDescription(data, offset)
+            else:
+                # Unknown description types can't be skipped, stop here
+                break
+            descriptions.append(description)
+
+        return descriptions
+
+    def __dataThreadFunction(self, socket, bufferCount, stats):
+        # Receive into a ring of preallocated buffers instead of allocating a new
+        # bytes object for every packet
+        buffers = [bytearray(32768) for i in range(bufferCount)]  # 32k byte buffers
+        index = 0
+        while self.__running:
+            data = buffers[index]
+            # Block for input, waking up regularly to see if we were stopped
+            try:
+                size = socket.recv_into(data)
+            except OSError:  # Includes timeouts
+                continue
+            if size > 0:
+                arrival = time.perf_counter()
+                stats.packet(arrival)
+                index = (index + 1) % bufferCount
+                if self.packetListener is not None:
+                    self.packetListener(data, size)
+                try:
+                    # only the received bytes, not the rest of the buffer
+                    self.processMessage(memoryview(data)[:size], arrival)
+                except (struct.error, ValueError, IndexError):
+                    # Truncated, or decoded with the wrong version's layout
+                    # before the ping response arrived. Drop it and carry on.
+                    stats.malformed += 1
+                # Another packet already waiting means we are falling behind
+                if pendingBytes(socket) > 0:
+                    stats.backlogged += 1
+
+    def processMessage(self, data, arrival=None):
+        """Process one NatNet packet, received by whatever transport at
+        time.perf_counter() arrival (now if None).
+
+        Returns the message ID and the decoded reply for command responses: the
+        NatNet version for NAT_PINGRESPONSE, the list of descriptions for
+        NAT_MODELDEF, the response code or string for NAT_RESPONSE and None for
+        anything else. Frames of mocap data go to the listeners.
+        """
+        # All unpackers share the packet buffer and work at absolute offsets
+        # into it, so no part of the packet is copied.
         trace("Begin Packet\n------------\n")
 
-        messageID = int.from_bytes(data[0:2], byteorder="little")
+        messageID, packetSize = MessageHead.unpack_from(data, 0)
         trace("Message ID:", messageID)
-
-        packetSize = int.from_bytes(data[2:4], byteorder="little")
         trace("Packet Size:", packetSize)
 
         offset = 4
+        result = None
         if messageID == self.NAT_FRAMEOFDATA:
-            self.__unpackMocapData(data[offset:])
+            self.__unpackMocapData(data, offset, arrival)
         elif messageID == self.NAT_MODELDEF:
-            self.__unpackDataDescriptions(data[offset:])
+            result = self.__unpackDataDescriptions(data, offset)
         elif messageID == self.NAT_PINGRESPONSE:
             offset += 256  # Skip the sending app's Name field
             offset += 4  # Skip the sending app's Version info
-            self.__natNetStreamVersion = struct.unpack(
-                "BBBB", data[offset : offset + 4]
-            )
+            version = struct.unpack_from("BBBB", data, offset)
             offset += 4
+            if version != self.__natNetStreamVersion:
+                self.__natNetStreamVersion = version
+                self.__buildDecodePlan()
+            result = self.__natNetStreamVersion
         elif messageID == self.NAT_RESPONSE:
             if packetSize == 4:
-                commandResponse = int.from_bytes(
-                    data[offset : offset + 4], byteorder="little"
-                )
+                (result,) = IntValue.unpack_from(data, offset)
                 offset += 4
             else:
-                message, separator, remainder = bytes(data[offset:]).partition(b"\0")
-                offset += len(message) + 1
-                trace("Command response:", message.decode("utf-8"))
+                message, offset = self.__unpackString(data, offset)
+                result = message.decode("utf-8")
+                trace("Command response:", result)
         elif messageID == self.NAT_UNRECOGNIZED_REQUEST:
             trace("Received 'Unrecognized request' from server")
         elif messageID == self.NAT_MESSAGESTRING:
-            message, separator, remainder = bytes(data[offset:]).partition(b"\0")
-            offset += len(message) + 1
+            message, offset = self.__unpackString(data, offset)
             trace("Received message from server:", message.decode("utf-8"))
         else:
             trace("ERROR: Unrecognized packet type")
 
         trace("End Packet\n----------\n")
+        return messageID, result
 
-    def sendCommand(self, command, commandStr, socket, address):
+    def packCommand(self, command, commandStr=""):
         # Compose the message in our known message format
         if (
             command == self.NAT_REQUEST_MODELDEF
@@ -476,30 +1006,44 @@ class NatNetClient:
         data += commandStr.encode("utf-8")
         data += b"\0"
 
-        socket.sendto(data, address)
+        return data
+
+    def sendCommand(self, command, commandStr, socket, address):
+        socket.sendto(self.packCommand(command, commandStr), address)
 
     def run(self):
         # Create the data socket
-        self.dataSocket = self.__createDataSocket(self.dataPort)
+        self.dataSocket = self.createDataSocket(self.dataPort)
         if self.dataSocket is None:
             print("Could not open data channel")
             exit
 
         # Create the command socket
-        self.commandSocket = self.__createCommandSocket()
+        self.commandSocket = self.createCommandSocket()
         if self.commandSocket is None:
             print("Could not open command channel")
             exit
 
+        # Receive threads poll this flag, so they can be stopped
+        self.__running = True
+        self.dataSocket.settimeout(self.POLL_INTERVAL)
+        self.commandSocket.settimeout(self.POLL_INTERVAL)
+
         # Create a separate thread for receiving data packets
-        dataThread = Thread(target=self.__dataThreadFunction, args=(self.dataSocket,))
-        dataThread.start()
+        self.__dataThread = Thread(
+            target=self.__dataThreadFunction,
+            args=(self.dataSocket, self.receiveBufferCount, self.receiveStats),
+            daemon=True,
+        )
+        self.__dataThread.start()
 
         # Create a separate thread for receiving command packets
-        commandThread = Thread(
-            target=self.__dataThreadFunction, args=(self.commandSocket,)
+        self.__commandThread = Thread(
+            target=self.__dataThreadFunction,
+            args=(self.commandSocket, 1, self.commandStats),
+            daemon=True,
         )
-        commandThread.start()
+        self.__commandThread.start()
 
         self.sendCommand(
             self.NAT_REQUEST_MODELDEF,
@@ -507,3 +1051,14 @@ class NatNetClient:
             self.commandSocket,
             (self.serverIPAddress, self.commandPort),
         )
+
+    def stop(self):
+        """Stop the receive threads started by run() and close the sockets"""
+        if not self.__running:
+            return
+        self.__running = False
+        for thread in (self.__dataThread, self.__commandThread):
+            thread.join()
+        self.receiveStats.kernelDrops = kernelDrops(self.dataSocket)
+        self.dataSocket.close()
+        self.commandSocket.close()
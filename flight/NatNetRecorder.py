@@ -0,0 +1,126 @@
+"""
+Contains the NatNetRecorder and NatNetReplayer classes, which record raw NatNet
+packets with host timestamps and play them back into a NatNetClient or a socket.
+
+A recording starts with a header (magic and format version), followed by one
+record per packet: the host's time.monotonic_ns() at reception (int64), the
+packet size (uint32) and the packet itself.
+
+Recordings can be replayed to a UDP port from the command line:
+
+    python flight/NatNetRecorder.py flight.natnet --speed 2 --port 1511
+"""
+
+import argparse
+import socket
+import struct
+import time
+from threading import Lock
+
+MAGIC = b"NNRECORD"
+FORMAT_VERSION = 1
+
+Header = struct.Struct("<8sI")
+Record = struct.Struct("<qI")
+
+
+class NatNetRecorder:
+    """Writes every packet a NatNetClient receives to a file. Set it up with
+
+    client.packetListener = NatNetRecorder("flight.natnet").record
+    """
+
+    def __init__(self, fileName):
+        self._file = open(fileName, "wb")
+        self._file.write(Header.pack(MAGIC, FORMAT_VERSION))
+        # Data and command threads both record
+        self._lock = Lock()
+        self.packets = 0
+
+    def record(self, data, size=None, timestamp=None):
+        """Record one packet. Only the first size bytes of data are used, so
+        reused receive buffers can be passed as they are."""
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        if size is None:
+            size = len(data)
+        with self._lock:
+            self._file.write(Record.pack(timestamp, size))
+            self._file.write(memoryview(data)[:size])
+            self.packets += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class NatNetReplayer:
+    """Plays back a recording made by NatNetRecorder"""
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def packets(self):
+        """Iterate over (timestamp in ns, packet) of all recorded packets"""
+        with open(self.fileName, "rb") as f:
+            magic, version = Header.unpack(f.read(Header.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError("{} is not a NatNet recording".format(self.fileName))
+            while True:
+                head = f.read(Record.size)
+                if len(head) < Record.size:
+                    return
+                timestamp, size = Record.unpack(head)
+                yield timestamp, f.read(size)
+
+    def replay(self, processMessage, speed=1.0):
+        """Hand every packet to processMessage, e.g. NatNetClient.processMessage.
+
+        With speed 1 packets are replayed in real time, with speed N at N times
+        real time, and with speed None as fast as possible. Returns the number
+        of packets replayed.
+        """
+        count = 0
+        start = None
+        for timestamp, packet in self.packets():
+            if speed is not None:
+                if start is None:
+                    start = (time.monotonic_ns(), timestamp)
+                # Deadline relative to the first packet, so pacing errors don't add up
+                due = start[0] + (timestamp - start[1]) / speed
+                delay = due - time.monotonic_ns()
+                if delay > 0:
+                    time.sleep(delay * 1e-9)
+            processMessage(packet)
+            count += 1
+        return count
+
+    def replayToSocket(self, address=("127.0.0.1", 1511), speed=1.0):
+        """Send every packet to a UDP address, e.g. a NatNetClient listening on
+        the loopback interface. Returns the number of packets sent."""
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            return self.replay(lambda packet: sender.sendto(packet, address), speed)
+        finally:
+            sender.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", type=str)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1511)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed relative to real time, 0 for as fast as possible",
+    )
+    args = parser.parse_args()
+
+    replayer = NatNetReplayer(args.recording)
+    t = time.monotonic()
+    count = replayer.replayToSocket(
+        (args.host, args.port), speed=args.speed if args.speed > 0 else None
+    )
+    print("Replayed {} packets in {:.2f} s".format(count, time.monotonic() - t))
@@ -0,0 +1,335 @@
+"""
+Contains the NatNetServerSimulator class, a local stand-in for a Motive server. It
+answers pings with a configurable NatNet version, serves model definitions and
+multicasts synthetic frames of mocap data at a configurable rate.
+
+Run it next to log_flight.py or optitrack_test.py (with the client's
+serverIPAddress set to this host) to test without OptiTrack:
+
+    python flight/NatNetServerSimulator.py --rate 360 --bodies 4 --motion circle
+"""
+
+import argparse
+import math
+import socket
+import struct
+import time
+from threading import Thread
+
+import numpy as np
+
+MessageHead = struct.Struct("<HH")
+IntValue = struct.Struct("<I")
+CountPair = struct.Struct("<II")
+RigidBodyHead = struct.Struct("<I7fI")
+FrameTiming = struct.Struct("<fII")
+
+# Message ids, as in NatNetClient
+NAT_PING = 0
+NAT_PINGRESPONSE = 1
+NAT_REQUEST = 2
+NAT_RESPONSE = 3
+NAT_REQUEST_MODELDEF = 4
+NAT_MODELDEF = 5
+NAT_FRAMEOFDATA = 7
+NAT_UNRECOGNIZED_REQUEST = 100
+
+
+def static(t, index):
+    """Bodies standing still in a row, 1 m above the floor (OptiTrack frame, y up)"""
+    return (0.5 * index, 1.0, 0.0), (0.0, 0.0, 0.0, 1.0)
+
+
+def circle(t, index, radius=1.0, period=4.0):
+    """Bodies flying a horizontal circle at different heights, facing along it"""
+    angle = 2 * math.pi * t / period + index
+    position = (radius * math.cos(angle), 1.0 + 0.2 * index, radius * math.sin(angle))
+    # Rotation about the vertical (y) axis
+    rotation = (0.0, math.sin(-angle / 2), 0.0, math.cos(-angle / 2))
+    return position, rotation
+
+
+def hover(t, index):
+    """Bodies bobbing up and down by 10 cm around static()"""
+    position, rotation = static(t, index)
+    position = (position[0], position[1] + 0.1 * math.sin(2 * math.pi * t), position[2])
+    return position, rotation
+
+
+MOTIONS = {"static": static, "hover": hover, "circle": circle}
+
+
+class NatNetServerSimulator:
+    """
+    Synthetic NatNet server. Rigid bodies get IDs 1 to bodies, each with markers
+    around it. motion(t, index) returns the position and quaternion of rigid body
+    index at t seconds. Frames are multicast to multicastAddress, or sent to
+    dataAddress if given (e.g. ("127.0.0.1", 1511) where multicast isn't routed).
+    """
+
+    def __init__(
+        self,
+        rate=120.0,
+        bodies=1,
+        markers=4,
+        markerSets=0,
+        unlabeledMarkers=0,
+        labeledMarkers=0,
+        skeletons=0,
+        version=(3, 0, 0, 0),
+        motion=static,
+        multicastAddress="239.255.42.99",
+        dataPort=1511,
+        commandPort=1510,
+        dataAddress=None,
+    ):
+        self.rate = rate
+        self.bodies = bodies
+        self.markers = markers
+        self.markerSets = markerSets
+        self.unlabeledMarkers = unlabeledMarkers
+        self.labeledMarkers = labeledMarkers
+        self.skeletons = skeletons
+        self.version = tuple(version)
+        self.motion = motion
+        self.commandPort = commandPort
+        self.dataAddress = dataAddress or (multicastAddress, dataPort)
+
+        self.framesSent = 0
+        self.lateFrames = 0
+        self.__running = False
+
+        # Fixed marker layout around each body
+        self.__markerOffsets = np.array(
+            [
+                (0.05 * math.cos(a), 0.01 * (i % 2), 0.05 * math.sin(a))
+                for i, a in enumerate(np.linspace(0, 2 * math.pi, markers, False))
+            ],
+            dtype=np.float32,
+        ).reshape(-1, 3)
+
+        # Same version dependent layout as NatNetClient
+        major, minor = self.version[0:2]
+        self.__hasMarkerInfo = major >= 2
+        self.__hasParams = (major == 2 and minor >= 6) or major > 2 or major == 0
+        self.__hasSkeletons = (major == 2 and minor > 0) or major > 2
+        self.__hasLabeledMarkers = (major == 2 and minor > 3) or major > 2
+        self.__hasForcePlates = (major == 2 and minor >= 9) or major > 2
+        self.__hasDoubleTimestamp = (major == 2 and minor >= 7) or major > 2
+
+    def __packRigidBody(self, id, position, rotation):
+        markers = (self.__markerOffsets + np.asarray(position, np.float32)).astype("<f4")
+        data = RigidBodyHead.pack(id, *position, *rotation, len(markers))
+        data += markers.tobytes()
+        if self.__hasMarkerInfo:
+            data += np.arange(len(markers), dtype="<u4").tobytes()
+            data += np.full(len(markers), 0.014, dtype="<f4").tobytes()
+            data += struct.pack("<f", 0.0002)  # Marker error
+        if self.__hasParams:
+            data += struct.pack("<h", 0x01)  # Tracking valid
+        return data
+
+    def packFrame(self, frameNumber, t):
+        """Return the NAT_FRAMEOFDATA packet of a frame at t seconds"""
+        poses = [self.motion(t, index) for index in range(self.bodies)]
+
+        data = CountPair.pack(frameNumber, self.markerSets)
+        for i in range(self.markerSets):
+            # Marker sets mirror the markers of the first rigid bodies
+            position = poses[i % len(poses)][0] if poses else (0.0, 0.0, 0.0)
+            markers = self.__markerOffsets + np.asarray(position, np.float32)
+            data += "set{}".format(i).encode("utf-8") + b"\0"
+            data += IntValue.pack(len(markers)) + markers.astype("<f4").tobytes()
+
+        data += IntValue.pack(self.unlabeledMarkers)
+        data += np.zeros((self.unlabeledMarkers, 3), dtype="<f4").tobytes()
+
+        data += IntValue.pack(self.bodies)
+        for index, (position, rotation) in enumerate(poses):
+            data += self.__packRigidBody(index + 1, position, rotation)
+
+        if self.__hasSkeletons:
+            data += IntValue.pack(self.skeletons)
+            for i in range(self.skeletons):
+                # Three bones per skeleton, with IDs as Motive encodes them
+                data += CountPair.pack(100 + i, 3)
+                for bone in range(3):
+                    position = (0.3 * bone, 1.0, 2.0 + i)
+                    data += self.__packRigidBody(
+                        ((100 + i) << 16) | bone, position, (0.0, 0.0, 0.0, 1.0)
+                    )
+
+        if self.__hasLabeledMarkers:
+            data += IntValue.pack(self.labeledMarkers)
+            for i in range(self.labeledMarkers):
+                data += struct.pack("<I4f", i, 0.1 * i, 0.0, 0.0, 0.014)
+                if self.__hasParams:
+                    data += struct.pack("<h", 0)
+
+        if self.__hasForcePlates:
+            data += IntValue.pack(0)
+
+        data += FrameTiming.pack(0.004, 0, 0)  # Latency, timecode and subframe
+        if self.__hasDoubleTimestamp:
+            data += struct.pack("<d", t)
+        else:
+            data += struct.pack("<f", t)
+        data += struct.pack("<h", 0)  # Frame parameters
+
+        return MessageHead.pack(NAT_FRAMEOFDATA, len(data)) + data
+
+    def packPingResponse(self):
+        """Return the NAT_PINGRESPONSE packet: app name, app version, NatNet version"""
+        data = b"Motive".ljust(256, b"\0") + bytes((2, 2, 0, 0)) + bytes(self.version)
+        return MessageHead.pack(NAT_PINGRESPONSE, len(data)) + data
+
+    def packModelDef(self):
+        """Return the NAT_MODELDEF packet describing marker sets, bodies and skeletons"""
+
+        def rigidBody(name, id, parentID, offset):
+            data = b""
+            if self.version[0] >= 2:
+                data += name.encode("utf-8") + b"\0"
+            # parent ID -1 for none, signed as in the NatNet SDK and the client
+            return data + struct.pack("<Ii3f", id, parentID, *offset)
+
+        descriptions = []
+        for i in range(self.markerSets):
+            data = IntValue.pack(0) + "set{}".format(i).encode("utf-8") + b"\0"
+            data += IntValue.pack(self.markers)
+            data += b"".join(
+                "marker{}\0".format(j).encode("utf-8") for j in range(self.markers)
+            )
+            descriptions.append(data)
+        for i in range(self.bodies):
+            descriptions.append(
+                IntValue.pack(1) + rigidBody("body{}".format(i + 1), i + 1, -1, (0, 0, 0))
+            )
+        for i in range(self.skeletons):
+            data = IntValue.pack(2) + "skeleton{}".format(i).encode("utf-8") + b"\0"
+            data += CountPair.pack(100 + i, 3)
+            for bone in range(3):
+                data += rigidBody("bone{}".format(bone), bone, bone - 1, (0.3, 0, 0))
+            descriptions.append(data)
+
+        data = IntValue.pack(len(descriptions)) + b"".join(descriptions)
+        return MessageHead.pack(NAT_MODELDEF, len(data)) + data
+
+    def __commandThreadFunction(self):
+        while self.__running:
+            try:
+                packet, address = self.__commandSocket.recvfrom(1024)
+            except OSError:  # Includes timeouts
+                continue
+            (messageID,) = struct.unpack_from("<H", packet)
+            if messageID == NAT_PING:
+                reply = self.packPingResponse()
+            elif messageID == NAT_REQUEST_MODELDEF:
+                reply = self.packModelDef()
+            elif messageID == NAT_REQUEST:
+                reply = MessageHead.pack(NAT_RESPONSE, 4) + IntValue.pack(0)
+            else:
+                reply = MessageHead.pack(NAT_UNRECOGNIZED_REQUEST, 0)
+            self.__commandSocket.sendto(reply, address)
+
+    def __dataThreadFunction(self, duration):
+        period = 1.0 / self.rate
+        start = time.monotonic()
+        frameNumber = 0
+        while self.__running:
+            # Fixed deadlines, so the rate doesn't drift with the time spent packing
+            due = start + frameNumber * period
+            if duration is not None and due - start >= duration:
+                break
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                self.lateFrames += 1
+            self.__dataSocket.sendto(
+                self.packFrame(frameNumber, due - start), self.dataAddress
+            )
+            self.framesSent += 1
+            frameNumber += 1
+        self.__running = False
+
+    def start(self, duration=None):
+        """Start serving commands and sending frames, for duration seconds or
+        until stop() is called"""
+        self.__commandSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__commandSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__commandSocket.bind(("", self.commandPort))
+        self.__commandSocket.settimeout(0.1)
+
+        self.__dataSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__dataSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.__dataSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+        self.__running = True
+        self.__commandThread = Thread(target=self.__commandThreadFunction, daemon=True)
+        self.__commandThread.start()
+        self.__dataThread = Thread(
+            target=self.__dataThreadFunction, args=(duration,), daemon=True
+        )
+        self.__dataThread.start()
+
+    def wait(self):
+        """Block until the simulator stops by itself or is interrupted"""
+        try:
+            while self.__dataThread.is_alive():
+                self.__dataThread.join(0.5)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self):
+        self.__running = False
+        self.__dataThread.join()
+        self.__commandThread.join()
+        self.__dataSocket.close()
+        self.__commandSocket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=120.0)
+    parser.add_argument("--bodies", type=int, default=1)
+    parser.add_argument("--markers", type=int, default=4)
+    parser.add_argument("--marker_sets", type=int, default=0)
+    parser.add_argument("--unlabeled", type=int, default=0)
+    parser.add_argument("--labeled", type=int, default=0)
+    parser.add_argument("--skeletons", type=int, default=0)
+    parser.add_argument("--version", type=str, default="3.0.0.0")
+    parser.add_argument("--motion", choices=sorted(MOTIONS), default="static")
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument(
+        "--unicast",
+        type=str,
+        default=None,
+        help="send frames to this host instead of multicasting them",
+    )
+    parser.add_argument("--port", type=int, default=1511)
+    args = parser.parse_args()
+
+    version = tuple(int(v) for v in args.version.split("."))
+    simulator = NatNetServerSimulator(
+        rate=args.rate,
+        bodies=args.bodies,
+        markers=args.markers,
+        markerSets=args.marker_sets,
+        unlabeledMarkers=args.unlabeled,
+        labeledMarkers=args.labeled,
+        skeletons=args.skeletons,
+        version=(version + (0, 0, 0, 0))[:4],
+        motion=MOTIONS[args.motion],
+        dataPort=args.port,
+        dataAddress=(args.unicast, args.port) if args.unicast else None,
+    )
+    simulator.start(duration=args.duration)
+    print("Simulating NatNet server at {} Hz, Ctrl+C to stop".format(args.rate))
+    simulator.wait()
+    print(
+        "Sent {} frames, {} more than one period late".format(
+            simulator.framesSent, simulator.lateFrames
+        )
+    )
@@ -0,0 +1,152 @@
+"""
+Contains the ParquetLogWriter class, which writes the rows of FileLogger to a Parquet
+file with one typed column per variable, and functions to read such logs back.
+
+Rows are collected in a preallocated record buffer and written as a row group once
+the buffer is full, so the log grows during the flight and memory use doesn't grow
+with it. The columns are those of the binary log (see flight.BinaryLog), and the
+options of the run (estimator, uwb, optitrack mode, trajectory, logcfg, ...) are
+stored in the schema metadata.
+
+Reading a few columns only reads those columns, e.g.
+
+    load("flight.parquet", columns=["stateX", "otX0"])
+
+needs no parse of the rest of the file. Parquet needs the pyarrow package. Binary
+logs can be converted to Parquet from the command line:
+
+    python flight/ParquetLog.py flight.bin
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from flight.BinaryLog import load as load_binary, read_header, record_dtype
+
+# Key of the column description and run options in the schema metadata
+METADATA_KEY = b"crazyflie"
+
+# FileLogger's compressions, as Parquet codecs
+CODECS = {None: "snappy", "auto": "zstd", "gzip": "gzip", "zstd": "zstd", "lz4": "lz4"}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ValueError("Parquet logs need the pyarrow package")
+
+
+class ParquetLogWriter:
+    """
+    Writes rows (time tick followed by the values) to a Parquet file, a row group
+    of rowGroupSize rows at a time. Rows are only readable once their row group is
+    written, and the file only once it is closed.
+    """
+
+    def __init__(
+        self, fileName, columns, metadata=None, rowGroupSize=65536, compression=None
+    ):
+        _require_pyarrow()
+        self.columns = columns
+        self.dtype = record_dtype(columns)
+        self.metadata = metadata or {}
+        self.closed = False
+
+        description = json.dumps({"columns": columns, "metadata": self.metadata})
+        self.schema = pa.schema(
+            [
+                pa.field(name, pa.from_numpy_dtype(self.dtype[name]))
+                for name in self.dtype.names
+            ],
+            metadata={METADATA_KEY: description.encode("utf-8")},
+        )
+        self._writer = pq.ParquetWriter(
+            fileName, self.schema, compression=CODECS.get(compression, compression)
+        )
+        self._buffer = np.zeros(rowGroupSize, dtype=self.dtype)
+        self._count = 0
+
+    def write(self, rows):
+        buffer = self._buffer
+        for row in rows:
+            buffer[self._count] = tuple(row)
+            self._count += 1
+            if self._count == len(buffer):
+                self._write_row_group()
+
+    def flush(self):
+        # rows are written a row group at a time, small row groups make slow reads
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._write_row_group()
+        self._writer.close()
+
+    def _write_row_group(self):
+        if self._count == 0:
+            return
+        records = self._buffer[: self._count]
+        table = pa.Table.from_arrays(
+            [pa.array(records[name]) for name in self.dtype.names], schema=self.schema
+        )
+        self._writer.write_table(table, row_group_size=self._count)
+        self._count = 0
+
+
+def read_description(fileName):
+    """Return the column description and run options of a Parquet log, without
+    reading any data"""
+    _require_pyarrow()
+    metadata = pq.read_schema(fileName).metadata or {}
+    if METADATA_KEY not in metadata:
+        raise ValueError("{} is not a Parquet log".format(fileName))
+    return json.loads(metadata[METADATA_KEY].decode("utf-8"))
+
+
+def load(fileName, columns=None):
+    """Read a Parquet log, or only the given columns of it, as a pandas DataFrame"""
+    _require_pyarrow()
+    return pq.read_table(fileName, columns=columns).to_pandas()
+
+
+def from_binary(fileName, parquetName, metadata=None, rowGroupSize=65536):
+    """Write the records of a binary log to a Parquet log"""
+    description, _ = read_header(fileName)
+    records = load_binary(fileName)
+    writer = ParquetLogWriter(
+        parquetName,
+        description["columns"],
+        metadata=dict(description["metadata"], **(metadata or {})),
+        rowGroupSize=rowGroupSize,
+    )
+    for start in range(0, len(records), rowGroupSize):
+        writer.write(records[start : start + rowGroupSize].tolist())
+    writer.close()
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", type=str)
+    parser.add_argument(
+        "parquet", type=str, nargs="?", default=None, help="defaults to the log's name"
+    )
+    args = parser.parse_args()
+
+    parquetName = args.parquet
+    if parquetName is None:
+        parquetName = (
+            args.log[:-4] if args.log.endswith(".bin") else args.log
+        ) + ".parquet"
+    count = from_binary(args.log, parquetName)
+    print("Wrote {} rows to {}".format(count, parquetName))
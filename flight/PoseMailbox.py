@@ -0,0 +1,111 @@
+"""
+Contains the PoseMailbox class, which hands the latest OptiTrack pose of a rigid body
+from the NatNet thread to the control loop.
+"""
+
+import collections
+import time
+
+import numpy as np
+
+Pose = collections.namedtuple(
+    "Pose",
+    [
+        "position",
+        "attitude",
+        "quaternion",
+        "filtered_position",
+        "velocity",
+        "frame_number",
+        "receive_time",
+        "age",
+    ],
+)
+
+# Slices of the state vector
+_POSITION = slice(0, 3)
+_ATTITUDE = slice(3, 6)
+_QUATERNION = slice(6, 10)
+_FILTERED = slice(10, 13)
+_VELOCITY = slice(13, 16)
+_FRAME_NUMBER = 16
+_RECEIVE_TIME = 17
+
+
+class PoseMailbox:
+    """
+    Latest pose of one rigid body, written by a single thread and read by any other.
+
+    This is a sequence lock: the writer makes the sequence number odd while it
+    updates the state and even again when done. Readers copy the state and retry if
+    the sequence number was odd or changed in the meantime. Readers therefore never
+    mix components of two frames, and neither side ever waits on a lock.
+    """
+
+    def __init__(self):
+        self._sequence = 0
+        self._state = np.zeros(18)
+        self._state[_FRAME_NUMBER] = -1
+
+    def write(
+        self,
+        position,
+        attitude,
+        quaternion,
+        filtered_position=None,
+        frame_number=0,
+        receive_time=None,
+        velocity=None,
+    ):
+        """Publish the pose of a new frame. Only one thread may write."""
+        if filtered_position is None:
+            filtered_position = position
+        if receive_time is None:
+            receive_time = time.monotonic()
+
+        self._sequence += 1
+        state = self._state
+        state[_POSITION] = position
+        state[_ATTITUDE] = attitude
+        state[_QUATERNION] = quaternion
+        state[_FILTERED] = filtered_position
+        state[_VELOCITY] = 0.0 if velocity is None else velocity
+        state[_FRAME_NUMBER] = frame_number
+        state[_RECEIVE_TIME] = receive_time
+        self._sequence += 1
+
+    def read(self):
+        """Return a consistent Pose of the latest frame, or None before the first.
+        receive_time is the host's time.monotonic() when the frame was received and
+        age the seconds since then. velocity is zero unless the writer gave one."""
+        while True:
+            sequence = self._sequence
+            if sequence & 1:
+                # Write in progress, let the writer finish
+                time.sleep(0)
+                continue
+            state = self._state.copy()
+            if self._sequence == sequence:
+                break
+
+        if sequence == 0:
+            return None
+
+        receive_time = state[_RECEIVE_TIME]
+        return Pose(
+            position=state[_POSITION],
+            attitude=state[_ATTITUDE],
+            quaternion=state[_QUATERNION],
+            filtered_position=state[_FILTERED],
+            velocity=state[_VELOCITY],
+            frame_number=int(state[_FRAME_NUMBER]),
+            receive_time=receive_time,
+            age=time.monotonic() - receive_time,
+        )
+
+    def read_fresh(self, max_age):
+        """Return the latest Pose if it is at most max_age seconds old, else None"""
+        pose = self.read()
+        if pose is None or pose.age > max_age:
+            return None
+        return pose
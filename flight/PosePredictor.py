@@ -0,0 +1,131 @@
+"""
+Contains predictors that estimate the position and velocity of a rigid body from its
+OptiTrack positions, and extrapolate the position to a later time. They are used to
+send the Crazyflie the position it will have when the extpos packet arrives, rather
+than the position it had when the cameras took their pictures.
+
+All predictors work on plain Python floats, one position of a few axes at a time,
+and take the time of every position from the mocap frame (Motive's timestamp), so
+jitter on the host doesn't show up as velocity.
+"""
+
+PREDICTORS = ("cv", "alpha-beta", "kalman")
+
+
+class _Predictor:
+    """Common part of the predictors: the time of the latest position, an
+    average frame period, and the extrapolation"""
+
+    def __init__(self, axes):
+        self.axes = axes
+        self.position = [0.0] * axes
+        self.velocity = [0.0] * axes
+        self.period = 0.0
+        self.time = None
+
+    def update(self, position, time):
+        """Account for the position at time (seconds). Positions that are not
+        newer than the latest one are ignored."""
+        if self.time is None:
+            for axis in range(self.axes):
+                self.position[axis] = float(position[axis])
+            self.time = time
+            return
+        dt = time - self.time
+        if dt <= 0.0:
+            return
+        self.time = time
+        # average frame period, e.g. to turn a delay in samples into seconds
+        if self.period == 0.0:
+            self.period = dt
+        else:
+            self.period += 0.05 * (dt - self.period)
+        self._update(position, dt)
+
+    def predict(self, horizon):
+        """Return the position horizon seconds after the latest one"""
+        return [p + v * horizon for p, v in zip(self.position, self.velocity)]
+
+
+class ConstantVelocityPredictor(_Predictor):
+    """Velocity is the difference of the latest two positions. Reacts at once,
+    but passes on all noise of the positions."""
+
+    def __init__(self, axes=3):
+        super().__init__(axes)
+
+    def _update(self, position, dt):
+        for axis in range(self.axes):
+            x = float(position[axis])
+            self.velocity[axis] = (x - self.position[axis]) / dt
+            self.position[axis] = x
+
+
+class AlphaBetaPredictor(_Predictor):
+    """Alpha-beta filter: the predicted position is corrected by alpha times the
+    residual, the velocity by beta times the residual per period. Smaller gains
+    smooth more and react slower."""
+
+    def __init__(self, axes=3, alpha=0.5, beta=0.1):
+        super().__init__(axes)
+        self.alpha = alpha
+        self.beta = beta
+
+    def _update(self, position, dt):
+        alpha, beta = self.alpha, self.beta
+        for axis in range(self.axes):
+            v = self.velocity[axis]
+            predicted = self.position[axis] + v * dt
+            residual = float(position[axis]) - predicted
+            self.position[axis] = predicted + alpha * residual
+            self.velocity[axis] = v + beta / dt * residual
+
+
+class KalmanPredictor(_Predictor):
+    """Kalman filter of position and velocity per axis, with white-noise
+    acceleration of spectral density accelerationNoise ((m/s^2)^2 s) and
+    position noise of variance positionNoise (m^2). The gains follow the frame
+    period, dropped frames included."""
+
+    def __init__(self, axes=3, accelerationNoise=1.0, positionNoise=1e-6):
+        super().__init__(axes)
+        self.q = accelerationNoise
+        self.r = positionNoise
+        # covariance of position and velocity per axis: pp, pv, vv
+        self._covariance = [[positionNoise, 0.0, 1.0] for _ in range(axes)]
+
+    def _update(self, position, dt):
+        q, r = self.q, self.r
+        qpp = q * dt * dt * dt / 3.0
+        qpv = q * dt * dt / 2.0
+        qvv = q * dt
+        for axis in range(self.axes):
+            pp, pv, vv = self._covariance[axis]
+            # predict
+            x = self.position[axis] + self.velocity[axis] * dt
+            pp = pp + dt * (2.0 * pv + dt * vv) + qpp
+            pv = pv + dt * vv + qpv
+            vv = vv + qvv
+            # correct
+            s = pp + r
+            kp = pp / s
+            kv = pv / s
+            residual = float(position[axis]) - x
+            self.position[axis] = x + kp * residual
+            self.velocity[axis] += kv * residual
+            self._covariance[axis] = [
+                (1.0 - kp) * pp,
+                (1.0 - kp) * pv,
+                vv - kv * pv,
+            ]
+
+
+def make_predictor(kind, axes=3, **params):
+    """Return a predictor of the given kind ("cv", "alpha-beta" or "kalman")"""
+    if kind == "cv":
+        return ConstantVelocityPredictor(axes, **params)
+    if kind == "alpha-beta":
+        return AlphaBetaPredictor(axes, **params)
+    if kind == "kalman":
+        return KalmanPredictor(axes, **params)
+    raise ValueError('Unknown predictor "{}"'.format(kind))
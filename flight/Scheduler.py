@@ -0,0 +1,129 @@
+"""
+Contains the Scheduler class, which runs periodic tasks of a flight loop (setpoints,
+extpos, ...) at fixed rates on the monotonic clock.
+
+Every task has an absolute deadline, which advances by exactly one period each time
+the task runs. Time spent processing and oversleeping is therefore made up in the
+next wait instead of adding up, so a loop at 20 Hz sends 20 setpoints per second
+however long each iteration takes. A task that falls behind by more than a period
+skips the deadlines it missed rather than running several times in a burst, and
+counts them.
+"""
+
+import time
+
+from flight.Histogram import Histogram
+
+
+class _Task:
+    def __init__(self, name, period):
+        self.name = name
+        self.period = period
+        self.deadline = None
+        self.runs = 0
+        self.missed = 0
+        self.lateness = Histogram(0.01, 1000, unit=" ms")
+
+
+class Scheduler:
+    """
+    Sleeps until the next deadline of its tasks and tells which tasks are due.
+
+        scheduler = Scheduler()
+        scheduler.add("extpos", 100)
+        scheduler.add("setpoint", 20)
+        scheduler.start()
+        while flying:
+            due = scheduler.wait()
+            if "extpos" in due:
+                ...
+
+    lateness() holds, per task, how late it was woken up, and missed() the number
+    of deadlines it skipped. late is how late the last wait() woke up, in seconds,
+    and missedTotal the deadlines skipped by all tasks. Tasks due at the same
+    deadline are all returned at once.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._tasks = []
+        self.startTime = None
+        self.late = 0.0
+        self.missedTotal = 0
+
+    def add(self, name, rate):
+        """Run the task called name rate times per second"""
+        self._tasks.append(_Task(name, 1.0 / rate))
+
+    def start(self, delay=0.0):
+        """Start all tasks, first due after delay seconds"""
+        self.startTime = now = self._clock()
+        for task in self._tasks:
+            task.deadline = now + delay
+
+    def now(self):
+        """Seconds since start()"""
+        return self._clock() - self.startTime
+
+    def nextDeadline(self):
+        """Seconds since start() of the next deadline of any task"""
+        return min(task.deadline for task in self._tasks) - self.startTime
+
+    def resync(self):
+        """Let all tasks start over from now, after the loop was paused. Deadlines
+        passed in the meantime don't count as missed. Returns the seconds the
+        tasks had fallen behind."""
+        now = self._clock()
+        behind = max(0.0, now - min(task.deadline for task in self._tasks))
+        for task in self._tasks:
+            task.deadline = max(task.deadline, now)
+        return behind
+
+    def wait(self):
+        """Sleep until the next deadline, and return the names of the tasks due"""
+        deadline = min(task.deadline for task in self._tasks)
+        delay = deadline - self._clock()
+        if delay > 0:
+            self._sleep(delay)
+        now = self._clock()
+        self.late = now - deadline
+
+        due = []
+        for task in self._tasks:
+            if task.deadline > now:
+                continue
+            late = now - task.deadline
+            task.lateness.record(late * 1e3)
+            task.runs += 1
+            task.deadline += task.period
+            if task.deadline <= now:
+                # more than a period behind, skip to the next deadline to come
+                skipped = int(late // task.period)
+                task.missed += skipped
+                self.missedTotal += skipped
+                task.deadline += skipped * task.period
+            due.append(task.name)
+        return due
+
+    def lateness(self, name):
+        """Histogram of how late the task was woken up, in milliseconds"""
+        return self._task(name).lateness
+
+    def missed(self, name):
+        """Number of deadlines the task skipped"""
+        return self._task(name).missed
+
+    def _task(self, name):
+        for task in self._tasks:
+            if task.name == name:
+                return task
+        raise KeyError(name)
+
+    def summary(self):
+        return "; ".join(
+            "{} at {:.3g} Hz: {} runs, {} missed, late {}".format(
+                task.name, 1.0 / task.period, task.runs, task.missed, task.lateness
+            )
+            for task in self._tasks
+        )
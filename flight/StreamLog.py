@@ -0,0 +1,151 @@
+"""
+Contains the per-stream logs written by FileLogger with streams=True, and functions
+to merge them into the wide table FileLogger writes otherwise.
+
+Every enabled config is logged to a binary log of its own (see flight.BinaryLog),
+named after the log and the config, e.g. flight.attitude.bin and flight.ot0.bin for
+flight.csv. Each sample is stored when it arrives, with the host's time.monotonic()
+in hostTime and, for CF configs, the Crazyflie's time tick in timeTick.
+
+Merging takes, for every row of a chosen clock, the latest sample of every stream
+at or before it (an as-of join). The clock is either the samples of one stream or a
+fixed rate. Merged logs can be written to CSV from the command line:
+
+    python flight/StreamLog.py flight.csv --clock attitude
+    python flight/StreamLog.py flight.csv --rate 100 --output flight_100hz.csv
+"""
+
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from flight.BinaryLog import (
+    TIME_TICK_TYPE,
+    columns_from_configs,
+    load,
+    read_header,
+    write_csv,
+)
+
+HOST_TIME_TYPE = "<f8"
+
+
+def stream_file_name(fileName, stream):
+    """Return the name of the logfile of one stream of a log"""
+    return "{}.{}.bin".format(os.path.splitext(fileName)[0], stream)
+
+
+def stream_columns(cfg_defs, cfg_name, types=None):
+    """Return the description of the columns of the stream of one config: host
+    time, the time tick for CF configs, and the config's variables, typed as in
+    columns_from_configs"""
+    columns = columns_from_configs(cfg_defs, [cfg_name], types)
+    if cfg_defs[cfg_name]["type"] != "CF":
+        # external data has no time tick of its own
+        columns = columns[1:]
+    hostTime = {
+        "name": "hostTime",
+        "config": None,
+        "variable": None,
+        "type": HOST_TIME_TYPE,
+    }
+    return [hostTime] + columns
+
+
+def load_streams(fileName):
+    """Memory-map all streams of a log. Returns a dict of the records by stream
+    name, in the order the configs were enabled."""
+    streams = []
+    pattern = glob.escape(os.path.splitext(fileName)[0]) + ".*.bin"
+    for streamName in glob.glob(pattern):
+        try:
+            description, offset = read_header(streamName)
+        except ValueError:
+            continue
+        metadata = description["metadata"]
+        # rotated segments of a stream (see flight.LogOutput) are joined first
+        if "stream" in metadata and streamName == stream_file_name(
+            fileName, metadata["stream"]
+        ):
+            streams.append((metadata["index"], metadata["stream"], load(streamName)))
+    return {name: records for index, name, records in sorted(streams)}
+
+
+def asof(records, times):
+    """Return the index of the latest record at or before each time, -1 if none.
+    records must be sorted by hostTime, as they are when logged."""
+    return np.searchsorted(records["hostTime"], times, side="right") - 1
+
+
+def merge(streams, clock=None, rate=None, fill=0.0):
+    """Merge streams into one table in FileLogger's layout: the time tick and
+    every variable under its header, plus the host time of each row.
+
+    Rows are the samples of the stream named clock, by default the first stream
+    with a time tick, which reproduces the rows FileLogger writes without
+    streams. With a rate in Hz, rows are evenly spaced from the first to the last
+    sample of any stream instead. Values from before a stream's first sample are
+    fill; the time tick is the latest one of the first stream that has them.
+    """
+    if not streams:
+        raise ValueError("No streams to merge")
+    ticked = [
+        name for name, records in streams.items() if "timeTick" in records.dtype.names
+    ]
+
+    if rate is not None:
+        sampled = [records["hostTime"] for records in streams.values() if len(records)]
+        start = min(hostTime[0] for hostTime in sampled)
+        stop = max(hostTime[-1] for hostTime in sampled)
+        times = np.arange(start, stop, 1.0 / rate)
+    else:
+        if clock is None:
+            if not ticked:
+                raise ValueError("No stream with a time tick, give a clock or rate")
+            clock = ticked[0]
+        times = np.asarray(streams[clock]["hostTime"])
+
+    fields = [("timeTick", TIME_TICK_TYPE)]
+    for records in streams.values():
+        fields += [
+            (name, records.dtype[name])
+            for name in records.dtype.names
+            if name not in ("hostTime", "timeTick")
+        ]
+    fields.append(("hostTime", HOST_TIME_TYPE))
+
+    table = np.zeros(len(times), dtype=fields)
+    table["hostTime"] = times
+    tickFrom = clock if clock in ticked else (ticked[0] if ticked else None)
+    for name, records in streams.items():
+        index = asof(records, times)
+        valid = index >= 0
+        rows = records[index[valid]]
+        for field in records.dtype.names:
+            if field == "hostTime" or (field == "timeTick" and name != tickFrom):
+                continue
+            if field != "timeTick":
+                table[field][~valid] = fill
+            table[field][valid] = rows[field]
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", type=str, help="log the streams belong to")
+    parser.add_argument("--clock", type=str, default=None, help="stream to merge on")
+    parser.add_argument("--rate", type=float, default=None, help="rate to merge on")
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    streams = load_streams(args.log)
+    for name, records in streams.items():
+        print("{}: {} samples".format(name, len(records)))
+    table = merge(streams, clock=args.clock, rate=args.rate)
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.log)[0] + ".merged.csv"
+    write_csv(table, output)
+    print("Wrote {} rows to {}".format(len(table), output))
@@ -0,0 +1,219 @@
+"""
+Contains the TelemetryTap class, which publishes the rows of FileLogger to a ring
+buffer in shared memory, and the TelemetryTapReader class, which reads the latest
+rows from another process, e.g. for live plots, monitoring or a safety checker.
+
+The shared memory block starts with a header (magic, format version, length of the
+JSON column description, capacity, record size and the number of rows written so
+far), followed by the description padded to 8 bytes and a ring of capacity records
+laid out like the records of a binary log (see flight.BinaryLog). Row n is at slot
+n % capacity.
+
+There is one writer, which never waits for readers: it writes a record and then
+advances the row count. Readers take the rows below the count they read, and check
+afterwards that the writer didn't go round the ring and overwrite them meanwhile.
+Readers that fall behind by more than the capacity simply miss rows.
+
+The latest rows of a running flight can be printed from the command line:
+
+    python flight/TelemetryTap.py cflog --columns stateX stateY otX0
+"""
+
+import argparse
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from flight.BinaryLog import record_dtype
+
+MAGIC = b"CFLOGTAP"
+FORMAT_VERSION = 1
+
+# Magic, format version, length of the JSON description, capacity, record size
+Header = struct.Struct("<8sIIQQ")
+# Offset of the row count, an uint64 after the header
+_COUNT_OFFSET = Header.size
+
+
+def _data_offset(descriptionLength):
+    return _COUNT_OFFSET + 8 + descriptionLength
+
+
+class TelemetryTap:
+    """
+    Writes rows (time tick followed by the values) to a ring buffer of capacity
+    records in the shared memory block called name. Call close() to remove it.
+    """
+
+    def __init__(self, name, columns, capacity=4096, metadata=None):
+        self.columns = columns
+        self.dtype = record_dtype(columns)
+        self.capacity = capacity
+
+        description = json.dumps(
+            {"columns": columns, "metadata": metadata or {}}
+        ).encode("utf-8")
+        description += b" " * (-len(description) % 8)
+        offset = _data_offset(len(description))
+        self._shm = shared_memory.SharedMemory(
+            name=name, create=True, size=offset + capacity * self.dtype.itemsize
+        )
+        buf = self._shm.buf
+        Header.pack_into(
+            buf,
+            0,
+            MAGIC,
+            FORMAT_VERSION,
+            len(description),
+            capacity,
+            self.dtype.itemsize,
+        )
+        buf[_COUNT_OFFSET + 8 : offset] = description
+        self._count = np.ndarray((1,), dtype="<u8", buffer=buf, offset=_COUNT_OFFSET)
+        self._count[0] = 0
+        self._ring = np.ndarray(
+            (capacity,), dtype=self.dtype, buffer=buf, offset=offset
+        )
+        self.rows = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def publish(self, row):
+        """Write one row and make it visible to readers. Only one thread may write."""
+        self._ring[self.rows % self.capacity] = tuple(row)
+        self.rows += 1
+        self._count[0] = self.rows
+
+    def close(self):
+        """Remove the shared memory block. Attached readers keep their mapping."""
+        if self._shm is None:
+            return
+        # numpy views keep the buffer exported, release them before closing
+        del self._ring, self._count
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13, the resource tracker would remove the block when
+        # this process exits, under the writer's feet
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def tap_exists(name):
+    """Return whether a shared memory block called name exists"""
+    try:
+        _attach(name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def remove_tap(name):
+    """Remove the shared memory block called name, e.g. one left behind by a run
+    that crashed. Returns whether there was one."""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    shm.unlink()
+    return True
+
+
+class TelemetryTapReader:
+    """Reads the rows a TelemetryTap in another process publishes"""
+
+    def __init__(self, name):
+        self._shm = _attach(name)
+        buf = self._shm.buf
+        magic, version, length, capacity, recordSize = Header.unpack_from(buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._shm.close()
+            raise ValueError("{} is not a telemetry tap".format(name))
+        description = json.loads(
+            bytes(buf[_COUNT_OFFSET + 8 : _COUNT_OFFSET + 8 + length]).decode("utf-8")
+        )
+        self.columns = description["columns"]
+        self.metadata = description["metadata"]
+        self.dtype = record_dtype(self.columns)
+        if self.dtype.itemsize != recordSize:
+            self._shm.close()
+            raise ValueError("{} has records of an unknown layout".format(name))
+        self.capacity = capacity
+        self._count = np.ndarray((1,), dtype="<u8", buffer=buf, offset=_COUNT_OFFSET)
+        self._ring = np.ndarray(
+            (capacity,), dtype=self.dtype, buffer=buf, offset=_data_offset(length)
+        )
+
+    @property
+    def rows(self):
+        """Number of rows published so far"""
+        return int(self._count[0])
+
+    @property
+    def ring(self):
+        """The ring buffer itself, without copying. Slots may be overwritten while
+        they are read; latest() returns consistent rows."""
+        return self._ring
+
+    def latest(self, n=1):
+        """Return a copy of the latest (at most) n rows, oldest first"""
+        end = self.rows
+        return self._copy(max(end - n, 0), end)
+
+    def since(self, rows):
+        """Return a copy of the rows published after the first rows, and the row
+        count to pass next time. Rows that were overwritten already are missed."""
+        end = self.rows
+        return self._copy(rows, end), end
+
+    def _copy(self, start, end):
+        start = max(start, end - self.capacity)
+        rows = self._ring[np.arange(start, end) % self.capacity]
+        # rows the writer went round the ring to overwrite meanwhile are dropped,
+        # including the one it may be writing right now
+        firstValid = self.rows - self.capacity + 1
+        if firstValid > start:
+            rows = rows[firstValid - start :]
+        return rows
+
+    def close(self):
+        del self._ring, self._count
+        self._shm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", type=str, help="name of the tap, see --log_tap")
+    parser.add_argument("--columns", nargs="+", type=str, default=None)
+    parser.add_argument("--rate", type=float, default=10.0, help="prints per second")
+    args = parser.parse_args()
+
+    reader = TelemetryTapReader(args.name)
+    columns = args.columns or list(reader.dtype.names)
+    print(", ".join(columns))
+    try:
+        seen = 0
+        while True:
+            rows, count = reader.since(seen)
+            if count > seen and len(rows):
+                print(", ".join(str(rows[-1][column]) for column in columns))
+            seen = count
+            time.sleep(1 / args.rate)
+    except KeyboardInterrupt:
+        pass
+    reader.close()
@@ -3,6 +3,7 @@ Execute a Crazyflie flight and log it.
 """
 
 import argparse
+import collections
 import time
 from datetime import datetime
 from pathlib import Path
@@ -13,17 +14,24 @@ import pandas as pd
 import os
 import sys
 import enum
-import scipy.signal
 
 import cflib.crtp
 from cflib.crazyflie import Crazyflie
 from cflib.crazyflie import Console
+from cflib.crazyflie.log import LogConfig
 from cfclient.utils.input import JoystickReader
 from cfclient.utils.config import Config
 
 import flight.utils as util
+from flight.ExtposForwarder import ExtposForwarder
 from flight.FileLogger import FileLogger
+from flight.FlightState import FlightEvent, FlightPhase, FlightState
+from flight.LowPassFilter import LowPassFilter
 from flight.NatNetClient import NatNetClient
+from flight.NatNetRecorder import NatNetRecorder
+from flight.PoseMailbox import PoseMailbox
+from flight.PosePredictor import PREDICTORS, make_predictor
+from flight.Scheduler import Scheduler
 
 # TODO: merge these? (prepared trajectories and trajectories)
 from flight.trajectories import takeoff, landing
@@ -39,7 +47,10 @@ class LogFlight():
     def __init__(self, args):
         self.args = args
         self.optitrack_enabled = False
+        self.extpos_forwarder = None
         self.console_dump_enabled = False
+        # Events from the Crazyflie and OptiTrack callbacks the flight waits for
+        self.flight_state = FlightState()
 
         cflib.crtp.init_drivers(enable_debug_driver=False)
         self._cf = Crazyflie(rw_cache="./cache")
@@ -132,6 +143,10 @@ class LogFlight():
     def setup_logger(self):
         # Create filename from options and date
         self.log_file = self.get_filename()
+        if self.args["log_format"] == "binary":
+            self.log_file = self.log_file[:-4] + ".bin"
+        elif self.args["log_format"] == "parquet":
+            self.log_file = self.log_file[:-4] + ".parquet"
         # Create directory if not there
         Path(self.args["fileroot"]).mkdir(exist_ok=True)
 
@@ -139,93 +154,281 @@ class LogFlight():
 
         # Logger setup
         logconfig = self.args["logconfig"]
-        self.flogger = FileLogger(self._cf, logconfig, self.log_file)
+        self.flogger = FileLogger(
+            self._cf,
+            logconfig,
+            self.log_file,
+            background=self.args["log_background"],
+            binary=self.args["log_format"] == "binary",
+            streams=self.args["log_streams"],
+            compression=(
+                None
+                if self.args["log_compression"] == "none"
+                else self.args["log_compression"]
+            ),
+            rotateBytes=(
+                None
+                if self.args["log_rotate_mb"] is None
+                else int(self.args["log_rotate_mb"] * 1e6)
+            ),
+            rotateSeconds=(
+                None
+                if self.args["log_rotate_min"] is None
+                else self.args["log_rotate_min"] * 60
+            ),
+            maxSegments=self.args["log_keep"],
+            parquet=self.args["log_format"] == "parquet",
+            metadata={
+                "estimator": self.args["estimator"],
+                "uwb": self.args["uwb"],
+                "flow": self.args["flow"],
+                "optitrack": self.args["optitrack"],
+                "optitrack_id": self.args["optitrack_id"],
+                "trajectory": self.args["trajectory"],
+                "logconfig": logconfig,
+                "keywords": self.args["keywords"],
+            },
+            syncClock=self.args["log_sync_clock"],
+            tap=self.args["log_tap"],
+            tapRows=self.args["log_tap_rows"],
+            tapReplace=self.args["log_tap_replace"],
+        )
         self.flogger.enableAllConfigs()
+        if self.args["log_loop"]:
+            # How late the flight loops wake up, and how many deadlines they missed
+            self.flogger.addConfig(
+                {
+                    "name": "loop",
+                    "type": "EXT",
+                    "period": 10,
+                    "variables": ["loopLate", "loopMissed"],
+                    "headers": ["loopLate", "loopMissed"],
+                }
+            )
+        if self.args["optitrack"] == "state" and self.args["extpos_on_frame"]:
+            # Time from OptiTrack packet to radio of every position sent
+            self.flogger.addConfig(
+                {
+                    "name": "extpos",
+                    "type": "EXT",
+                    "period": 10,
+                    "variables": ["extposLatency"],
+                    "headers": ["extposLatency"],
+                }
+            )
+        if self.args["optitrack_predict"] != "none":
+            # Predicted position and how far ahead it was predicted (ms)
+            self.flogger.addConfig(
+                {
+                    "name": "predict",
+                    "type": "EXT",
+                    "period": 10,
+                    "variables": ["predX0", "predY0", "predZ0", "predHorizon"],
+                    "headers": ["predX0", "predY0", "predZ0", "predHorizon"],
+                }
+            )
 
     def setup_optitrack(self):
         self.ot_id = self.args["optitrack_id"]
-        self.ot_position = np.zeros(3)
-        self.ot_attitude = np.zeros(3)
-        self.ot_quaternion = np.zeros(4)
-        self.filtered_pos = np.zeros(3)
-        self.ot_filter_sos = scipy.signal.butter(N=4, Wn=0.1, btype='low',
-                                            analog=False, output='sos')
-        self.pos_filter_zi = [scipy.signal.sosfilt_zi(self.ot_filter_sos),
-                              scipy.signal.sosfilt_zi(self.ot_filter_sos),
-                              scipy.signal.sosfilt_zi(self.ot_filter_sos)]
+        # Latest pose per rigid body, handed from the NatNet thread to the control loop
+        self.ot_poses = {ot_id: PoseMailbox() for ot_id in self.ot_id}
+        self.ot_pose = self.ot_poses[self.ot_id[0]]
+        self.ot_stale_count = 0
+        # Low-pass filter of the position, from the command line or a YAML file
+        filter_config = {
+            "design": self.args["optitrack_filter"],
+            "order": self.args["optitrack_filter_order"],
+            "cutoff": self.args["optitrack_filter_cutoff"],
+        }
+        if self.args["optitrack_filter_config"] is not None:
+            with open(self.args["optitrack_filter_config"], "r") as f:
+                filter_config.update(yaml.safe_load(f))
+        self.ot_filter = LowPassFilter.from_config(filter_config)
+        self.filtered_pos = self.ot_filter.out
+        # Extrapolate the filtered position to when it reaches the Crazyflie
+        self.ot_predictor = None
+        if self.args["optitrack_predict"] != "none":
+            self.ot_predictor = make_predictor(self.args["optitrack_predict"])
         # Streaming client in separate thread
-        streaming_client = NatNetClient()
-        streaming_client.newFrameListener = self.ot_receive_new_frame
-        streaming_client.rigidBodyListener = self.ot_receive_rigidbody_frame
-        streaming_client.run()
+        self.streaming_client = NatNetClient()
+        self.streaming_client.receiveBufferSize = self.args["optitrack_rcvbuf"]
+        # Only decode the rigid bodies we track, skip all marker data
+        self.streaming_client.subscribe(
+            rigidBodyIds=self.ot_id, kinds=NatNetClient.DATA_RIGID_BODIES
+        )
+        # Keep the raw packets next to the log, to replay the flight's mocap data
+        if self.args["optitrack_record"]:
+            self.ot_recorder = NatNetRecorder(self.log_file[:-4] + ".natnet")
+            self.streaming_client.packetListener = self.ot_recorder.record
+        # Send positions to the Crazyflie as soon as their frame is decoded
+        if self.args["optitrack"] == "state" and self.args["extpos_on_frame"]:
+            self.extpos_forwarder = ExtposForwarder(
+                self._cf.extpos.send_extpos,
+                decimation=self.args["extpos_decimation"],
+                maxRate=self.args["extpos_rate"] or 100.0,
+            )
+            # nothing to send to before the Crazyflie is connected
+            self.extpos_forwarder.enabled = False
+        self.streaming_client.newFrameListener = self.ot_receive_new_frame
+        self.streaming_client.rigidBodyFrameListener = self.ot_receive_rigidbody_frame
+        self.streaming_client.run()
         self.optitrack_enabled = True
         print("OptiTrack streaming client started")
 
-        # TODO: do we need to return StreamingClient?
-
 
     def reset_estimator(self):
+        self.flight_state.clear(FlightEvent.ESTIMATOR_CONVERGED)
         # Kalman
         if self.args["estimator"] == "kalman":
             self._cf.param.set_value("kalman.resetEstimation", "1")
-            time.sleep(1)
+            time.sleep(0.1)
             self._cf.param.set_value("kalman.resetEstimation", "0")
         # Complementary (needs changes to firmware)
         if self.args["estimator"] == "complementary":
             try:
                 self._cf.param.set_value("complementaryFilter.reset", "1")
-                time.sleep(1)
+                time.sleep(0.1)
                 self._cf.param.set_value("complementaryFilter.reset", "0")
             except:
                 pass
+        self.watch_estimator()
+
+    def watch_estimator(self):
+        """Signal ESTIMATOR_CONVERGED once the position variance of the Kalman
+        filter has settled. Other estimators have nothing to wait for."""
+        if self.args["estimator"] != "kalman":
+            self.flight_state.set(FlightEvent.ESTIMATOR_CONVERGED)
+            return
+        # Latest variances of x, y and z
+        self.estimator_history = [collections.deque(maxlen=10) for _ in range(3)]
+        self.estimator_log = LogConfig(name="convergence", period_in_ms=50)
+        for var in ["kalman.varPX", "kalman.varPY", "kalman.varPZ"]:
+            self.estimator_log.add_variable(var, "float")
+        self._cf.log.add_config(self.estimator_log)
+        self.estimator_log.data_received_cb.add_callback(self._estimator_cb)
+        self.estimator_log.start()
+
+    def _estimator_cb(self, timestamp, data, logconf):
+        for history, variance in zip(self.estimator_history, data.values()):
+            history.append(variance)
+        if all(
+            len(history) == history.maxlen and max(history) - min(history) < 0.001
+            for history in self.estimator_history
+        ):
+            self.flight_state.set(FlightEvent.ESTIMATOR_CONVERGED)
+
+    def stop_watching_estimator(self):
+        if self.args["estimator"] == "kalman":
+            self.estimator_log.stop()
+            self.estimator_log.delete()
+
     def ot_receive_new_frame(self, *args, **kwargs):
         pass
 
-    def ot_receive_rigidbody_frame(self, id, position, rotation):
-        # Check ID
-        if id in self.ot_id:
-            # get optitrack data in crazyflie global frame
-            pos_in_cf_frame = util.ot2control(position)
-            att_in_cf_frame = util.quat2euler(rotation)
-            quat_in_cf_frame = util.ot2control_quat(rotation)
-            
-            idx = self.ot_id.index(id)
-
-            if idx==0:
+    def ot_receive_rigidbody_frame(self, frame):
+        # All tracked rigid bodies of one frame at once
+        receive_time = time.monotonic()
+        bodies = frame.bodies
+        ids = bodies["id"]
+        # get optitrack data in crazyflie global frame
+        pos_in_cf_frame = util.ot2control(bodies["pos"])
+
+        for idx, ot_id in enumerate(self.ot_id[:2]):
+            rows = np.flatnonzero(ids == ot_id)
+            if rows.size == 0:
+                continue
+            row = rows[0]
+            att_in_cf_frame = util.quat2euler(bodies["rot"][row])
+
+            if idx == 0:
                 # main drone
                 ot_dict = {
-                    "otX0": pos_in_cf_frame[0],
-                    "otY0": pos_in_cf_frame[1],
-                    "otZ0": pos_in_cf_frame[2],
+                    "otX0": pos_in_cf_frame[row, 0],
+                    "otY0": pos_in_cf_frame[row, 1],
+                    "otZ0": pos_in_cf_frame[row, 2],
                     "otRoll0": att_in_cf_frame[0],
                     "otPitch0": att_in_cf_frame[1],
                     "otYaw0": att_in_cf_frame[2]
                 }
-                self.ot_position = pos_in_cf_frame
-                self.ot_attitude = att_in_cf_frame
-                self.ot_quaternion = quat_in_cf_frame
-                self.flogger.registerData("ot0", ot_dict)
-                (self.filtered_pos[0], self.pos_filter_zi[0]) = scipy.signal.sosfilt(
-                    self.ot_filter_sos, [self.ot_position[0]], zi=self.pos_filter_zi[0]
-                )
-                (self.filtered_pos[1], self.pos_filter_zi[1]) = scipy.signal.sosfilt(
-                    self.ot_filter_sos, [self.ot_position[1]], zi=self.pos_filter_zi[1]
-                )
-                (self.filtered_pos[2], self.pos_filter_zi[2]) = scipy.signal.sosfilt(
-                    self.ot_filter_sos, [self.ot_position[2]], zi=self.pos_filter_zi[2]
+                position = pos_in_cf_frame[row]
+                self.flogger.registerData("ot0", ot_dict, hostTime=receive_time)
+                if not self.flight_state.is_set(FlightEvent.MOCAP_FIX) and (
+                    position != 0
+                ).all():
+                    self.flight_state.set(FlightEvent.MOCAP_FIX)
+                self.filtered_pos = self.ot_filter.update(position)
+                velocity = None
+                if self.ot_predictor is not None:
+                    self.filtered_pos, velocity = self.predict_position(
+                        frame, receive_time
+                    )
+                self.ot_pose.write(
+                    position,
+                    att_in_cf_frame,
+                    util.ot2control_quat(bodies["rot"][row]),
+                    filtered_position=self.filtered_pos,
+                    frame_number=frame.frameNumber,
+                    receive_time=receive_time,
+                    velocity=velocity,
                 )
-            elif idx==1:
+                if self.extpos_forwarder is not None:
+                    # the filtered position in autonomous flight, like the loops
+                    if self.extpos_forwarder.forward(
+                        position if self.is_in_manual_control else self.filtered_pos,
+                        frame.arrivalTime,
+                    ):
+                        self.flogger.registerData(
+                            "extpos",
+                            {"extposLatency": self.extpos_forwarder.lastLatency},
+                            hostTime=receive_time,
+                        )
+            else:
                 ot_dict = {
-                    "otX1": pos_in_cf_frame[0],
-                    "otY1": pos_in_cf_frame[1],
-                    "otZ1": pos_in_cf_frame[2],
+                    "otX1": pos_in_cf_frame[row, 0],
+                    "otY1": pos_in_cf_frame[row, 1],
+                    "otZ1": pos_in_cf_frame[row, 2],
                     "otRoll1": att_in_cf_frame[0],
                     "otPitch1": att_in_cf_frame[1],
                     "otYaw1": att_in_cf_frame[2]
                 }
-                self.flogger.registerData("ot1", ot_dict)
+                self.flogger.registerData("ot1", ot_dict, hostTime=receive_time)
+                self.ot_poses[ot_id].write(
+                    pos_in_cf_frame[row],
+                    att_in_cf_frame,
+                    util.ot2control_quat(bodies["rot"][row]),
+                    frame_number=frame.frameNumber,
+                    receive_time=receive_time,
+                )
+
 
 
+    def predict_position(self, frame, receive_time):
+        """Return the filtered position extrapolated to when it will reach the
+        Crazyflie, and the velocity it was extrapolated with. receive_time is the
+        host time the frame is logged with."""
+        predictor = self.ot_predictor
+        predictor.update(self.filtered_pos, frame.timestamp)
+        # Motive's latency from exposure to sending the frame, the time on the
+        # host since the packet arrived, the radio, and the delay of the filter
+        horizon = (
+            max(frame.latency, 0.0)
+            + time.perf_counter()
+            - frame.arrivalTime
+            + self.args["predict_link_ms"] * 1e-3
+            + self.ot_filter.groupDelay * predictor.period
+        )
+        predicted = predictor.predict(horizon)
+        self.flogger.registerData(
+            "predict",
+            {
+                "predX0": predicted[0],
+                "predY0": predicted[1],
+                "predZ0": predicted[2],
+                "predHorizon": horizon * 1e3,
+            },
+            hostTime=receive_time,
+        )
+        return predicted, predictor.velocity
 
     def do_taskdump(self):
         self._cf.param.set_value("system.taskDump", "1")
@@ -303,6 +506,7 @@ class LogFlight():
     def connect_crazyflie(self, uri):   
         """Connect to a Crazyflie on the given link uri"""
         # Connect some callbacks from the Crazyflie API
+        self._cf.link_established.add_callback(self._link_established)
         self._cf.connected.add_callback(self._connected)
         self._cf.disconnected.add_callback(self._disconnected)
         self._cf.connection_failed.add_callback(self._connection_failed)
@@ -326,55 +530,92 @@ class LogFlight():
                 self._jr.alt1_updated.add_callback(self.mode_switch_cb)
 
 
+    def _link_established(self, link):
+        """This callback is called form the Crazyflie API when the radio link is
+        up, before the TOCs are downloaded."""
+        self.flight_state.set(FlightEvent.CONNECTED)
+
     def _connected(self, link):
         """This callback is called form the Crazyflie API when a Crazyflie
         has been connected and the TOCs have been downloaded."""
         print("Connected to %s" % link)
+        # in case link_established was not signalled, the link is up by now
+        self.flight_state.set(FlightEvent.CONNECTED)
         # set estimator
         if args["estimator"]=="kalman":
             self._cf.param.set_value("stabilizer.estimator", "2")
-        self.flogger.start()
+        try:
+            self.flogger.start()
+        except OSError as e:
+            # e.g. the tap's shared memory was taken since the logger was set up;
+            # cflib would swallow the error, so end the flight here
+            print("Could not start logging: {}".format(e))
+            self.flogger.is_connected = False
+            self.flight_state.set(FlightEvent.LANDING)
+            return
         print("logging started")
+        if self.extpos_forwarder is not None:
+            self.extpos_forwarder.enabled = True
+        self.flight_state.set(FlightEvent.TOC_READY)
 
     def _connection_failed(self, link_uri, msg):
         print("Connection to %s failed: %s" % (link_uri, msg))
-        self.flogger.is_connected = False
+        self.link_down()
 
     def _connection_lost(self, link_uri, msg):
         print("Connection to %s lost: %s" % (link_uri, msg))
-        self.flogger.is_connected = False
+        self.link_down()
 
     def _disconnected(self, link_uri):
         print("Disconnected from %s" % link_uri)
+        self.link_down()
+
+    def link_down(self):
         self.flogger.is_connected = False
+        if self.extpos_forwarder is not None:
+            self.extpos_forwarder.enabled = False
+        self.flight_state.clear(FlightEvent.CONNECTED)
+        self.flight_state.set(FlightEvent.LANDING)
+
+    def ready_to_fly(self, timeout=20.0):
+        """Wait for the connection, an OptiTrack fix and the estimator, at most
+        timeout seconds in all. Returns whether we are ready."""
+        state = self.flight_state
+        deadline = time.monotonic() + timeout
+
+        def wait_for(event):
+            # a lost link ends the wait right away
+            remaining = max(deadline - time.monotonic(), 0.0)
+            return state.wait(event, FlightEvent.LANDING, timeout=remaining) is event
+
+        # Wait for connection and logging
+        state.transition(FlightPhase.CONNECTING)
+        print("Waiting for Crazyflie connection...")
+        if not wait_for(FlightEvent.CONNECTED):
+            return False
+        print("Link up, waiting for TOCs and logging...")
+        if not wait_for(FlightEvent.TOC_READY):
+            return False
 
-    def ready_to_fly(self):
-        # Wait for connection
-        timeout = 10
-        while not self._cf.is_connected():
-            print("Waiting for Crazyflie connection...")
-            time.sleep(2)
-            timeout -= 1
-            if timeout<=0:
-                return False
-        
         # Wait for optitrack
         if self.optitrack_enabled:
-            while (self.ot_position == 0).any():
-                print("Waiting for OptiTrack fix...")
-                time.sleep(2)
-                timeout -= 1
-                if timeout <= 0:
-                    return False
-
+            state.transition(FlightPhase.WAITING_FOR_FIX)
+            print("Waiting for OptiTrack fix...")
+            if not wait_for(FlightEvent.MOCAP_FIX):
+                return False
             print("OptiTrack fix acquired")
 
+        state.transition(FlightPhase.RESETTING_ESTIMATOR)
         print("Reset Estimator...")
         self.reset_estimator()
-        time.sleep(2)   # wait for kalman to stabilize
+        converged = wait_for(FlightEvent.ESTIMATOR_CONVERGED)
+        self.stop_watching_estimator()
+        if not converged:
+            return False
 
+        state.transition(FlightPhase.READY)
         return True
-        
+
     def start_flight(self):
         if self.ready_to_fly():
             if self.mode == Mode.MANUAL:
@@ -382,9 +623,10 @@ class LogFlight():
                 self.manual_flight()
             elif self.mode == Mode.DONT_FLY:
                 print("Ready to not fly")
+                self.flight_state.transition(FlightPhase.IDLE)
                 try:
-                    while True:
-                        pass
+                    # Sleep until stopped or the link is lost
+                    self.flight_state.wait(FlightEvent.LANDING)
                 except KeyboardInterrupt:
                     print("Flight stopped")
             else:
@@ -413,25 +655,64 @@ class LogFlight():
         if auto_mode:
             print("Switching autonomous flight")
             self.is_in_manual_control = False
+            self.flight_state.set(FlightEvent.AUTO_MODE)
         else:
             print("Switching to manual control")
             self.is_in_manual_control = True
+            self.flight_state.clear(FlightEvent.AUTO_MODE)
+
+    def extpos_rate(self, manual):
+        """Rate at which to send OptiTrack positions, by default that of the loop:
+        100 Hz in manual flight, the setpoint rate otherwise"""
+        if self.args["extpos_rate"] is not None:
+            return self.args["extpos_rate"]
+        return 100.0 if manual else self.args["setpoint_rate"]
+
+    def send_extpos(self, filtered):
+        # Only send poses we got recently, never one from a stalled stream
+        pose = self.ot_pose.read_fresh(self.args["optitrack_max_age"])
+        if pose is None:
+            self.ot_stale_count += 1
+        elif filtered:
+            # with a predictor, the position is extrapolated for the time the pose
+            # waited for the loop as well
+            self._cf.extpos.send_extpos(
+                *(pose.filtered_position + pose.velocity * pose.age)
+            )
+        else:
+            self._cf.extpos.send_extpos(*pose.position)
+            # self._cf.extpos.send_extpose(*pose.position, *pose.quaternion)
+
+    def log_loop(self, scheduler):
+        if not self.args["log_loop"]:
+            return
+        self.flogger.registerData(
+            "loop",
+            {"loopLate": scheduler.late * 1e3, "loopMissed": scheduler.missedTotal},
+        )
 
     def manual_flight(self):
+        """Fly by controller until the safety pilot switches to autonomous flight,
+        or the link is lost"""
         self.is_in_manual_control = True
-        while(self.is_in_manual_control):
-            if self.args["optitrack"]=="state":
-                # self._cf.extpos.send_extpos(
-                #     self.filtered_pos[0], self.filtered_pos[1], self.filtered_pos[2]
-                #     )
-                self._cf.extpos.send_extpos(
-                    self.ot_position[0], self.ot_position[1], self.ot_position[2]
-                    )
-                # self._cf.extpos.send_extpose(
-                #     self.ot_position[0], self.ot_position[1], self.ot_position[2],
-                #     self.ot_quaternion[0], self.ot_quaternion[1], self.ot_quaternion[2], self.ot_quaternion[3]
-                #     )
-            time.sleep(0.01)
+        self.flight_state.clear(FlightEvent.AUTO_MODE)
+        self.flight_state.transition(FlightPhase.MANUAL)
+        if self.args["optitrack"] == "state" and self.extpos_forwarder is None:
+            # Send positions at a fixed rate in the meantime
+            scheduler = Scheduler()
+            scheduler.add("extpos", self.extpos_rate(manual=True))
+            scheduler.start()
+            while not (
+                self.flight_state.is_set(FlightEvent.AUTO_MODE)
+                or self.flight_state.is_set(FlightEvent.LANDING)
+            ):
+                scheduler.wait()
+                self.log_loop(scheduler)
+                self.send_extpos(filtered=False)
+            print("Manual flight loop: {}".format(scheduler.summary()))
+        else:
+            # Controller input is forwarded by its callback, nothing to do here
+            self.flight_state.wait(FlightEvent.AUTO_MODE, FlightEvent.LANDING)
 
     def build_trajectory(self, trajectories, space):
         # Load yaml file with space specification
@@ -483,27 +764,36 @@ class LogFlight():
 
 
     def follow_setpoints(self, cf, setpoints, optitrack):
-        # Counter for task dump logging
-        time_since_dump = 0.0
-
         # Start
         try:
             print("Flight started")
             # Do nothing, just sit on the ground
             if setpoints is None:
-                while True:
-                    time.sleep(0.05)
-                    time_since_dump += 0.05
-
-                    # Task dump
-                    if time_since_dump > 2:
-                        print("Do task dump")
-                        self.do_taskdump()
-                        time_since_dump = 0.0
+                # Task dump every 2 s
+                scheduler = Scheduler()
+                scheduler.add("taskdump", 0.5)
+                scheduler.start(delay=2.0)
+                self.flight_state.transition(FlightPhase.IDLE)
+                while not self.flight_state.is_set(FlightEvent.LANDING):
+                    scheduler.wait()
+                    print("Do task dump")
+                    self.do_taskdump()
 
             # Do actual flight
             else:
+                # Send setpoints and positions on fixed deadlines, so segments
+                # last as long as planned however long an iteration takes
+                scheduler = Scheduler()
+                scheduler.add("setpoint", self.args["setpoint_rate"])
+                if optitrack == "state" and self.extpos_forwarder is None:
+                    scheduler.add("extpos", self.extpos_rate(manual=False))
+                scheduler.start()
+                self.flight_state.transition(FlightPhase.AUTO)
+                segment_end = 0.0
                 for i, point in enumerate(setpoints):
+                    if self.flight_state.is_set(FlightEvent.LANDING):
+                        print("Link lost, flight aborted")
+                        break
                     print("Next setpoint: {}".format(point))
 
                     # Compute time based on distance
@@ -522,29 +812,27 @@ class LogFlight():
                     else:
                         wait = distance * 2
 
-                    # Send position and wait
-                    time_passed = 0.0
-                    while time_passed < wait:
+                    # Send position and setpoint until the segment is over
+                    segment_end += wait
+                    while scheduler.nextDeadline() < segment_end:
+                        if self.flight_state.is_set(FlightEvent.LANDING):
+                            break
                         if self.is_in_manual_control:
                             self.manual_flight()
+                            self.flight_state.transition(FlightPhase.AUTO)
+                            # the segment was on hold during manual flight
+                            segment_end += scheduler.resync()
+                        due = scheduler.wait()
+                        self.log_loop(scheduler)
                         # If we use OptiTrack for control, send position to Crazyflie
-                        if optitrack == "state":
-                            cf.extpos.send_extpos(
-                                self.filtered_pos[0], self.filtered_pos[1], self.filtered_pos[2]
-                            )
-                        cf.commander.send_position_setpoint(*point)
-                        time.sleep(0.05)
-                        time_passed += 0.05
-                        time_since_dump += 0.05
-
-                    # Task dump
-                    # if time_since_dump > 2:
-                    #     print("Do task dump")
-                    #     self.do_taskdump()
-                    #     time_since_dump = 0.0
+                        if "extpos" in due:
+                            self.send_extpos(filtered=True)
+                        if "setpoint" in due:
+                            cf.commander.send_position_setpoint(*point)
 
                 # Finished
                 cf.commander.send_stop_setpoint()
+                print("Flight loop: {}".format(scheduler.summary()))
 
         # Prematurely break off flight / quit doing nothing
         except KeyboardInterrupt:
@@ -552,6 +840,7 @@ class LogFlight():
                 print("Quit doing nothing!")
             else:
                 print("Emergency landing!")
+                self.flight_state.transition(FlightPhase.LANDING)
                 wait = setpoints[i][2] * 2
                 cf.commander.send_position_setpoint(setpoints[i][0], setpoints[i][1], 0.0, 0.0)
                 time.sleep(wait)
@@ -570,7 +859,43 @@ class LogFlight():
         self.console_log.append(text)
 
     def end(self):
+        self.flight_state.transition(FlightPhase.DONE)
         self._cf.close_link()
+        # Write out everything still queued and close the log
+        try:
+            self.flogger.end()
+        except Exception as e:
+            print(
+                "Log: writing failed, {} rows dropped: {}".format(
+                    self.flogger.dropped_rows, e
+                )
+            )
+        if (
+            self.args["log_background"]
+            or self.args["log_format"] == "parquet"
+            or self.args["log_compression"] != "none"
+            or self.args["log_rotate_mb"]
+            or self.args["log_rotate_min"]
+        ):
+            # the background writer is also used for compressed or rotated logs
+            print(
+                "Log: {} rows written, queue depth at most {}, waited for the writer "
+                "{} times".format(
+                    self.flogger.rows_written,
+                    self.flogger.max_queue_depth,
+                    self.flogger.backpressure_count,
+                )
+            )
+        print("Clock: {}".format(self.flogger.clock.summary()))
+        # Stop receiving OptiTrack data, so the process can exit
+        if self.optitrack_enabled:
+            self.streaming_client.stop()
+            print("OptiTrack: {}".format(self.streaming_client.receiveStats.summary()))
+            print("OptiTrack: {} stale poses not sent".format(self.ot_stale_count))
+            if self.extpos_forwarder is not None:
+                print("Extpos: {}".format(self.extpos_forwarder.summary()))
+            if self.args["optitrack_record"]:
+                self.ot_recorder.close()
         # Process task dumps
         # TODO: add timestamps / ticks (like logging) to this
         if self.console_dump_enabled:
@@ -603,6 +928,51 @@ if __name__ == "__main__":
         default="none",
     )
     parser.add_argument("--optitrack_id", nargs="+", type=int, default=None)
+    parser.add_argument("--optitrack_rcvbuf", type=int, default=None)
+    parser.add_argument("--optitrack_max_age", type=float, default=0.1)
+    parser.add_argument("--optitrack_record", action="store_true")
+    parser.add_argument(
+        "--optitrack_filter",
+        choices=["butter", "bessel", "none"],
+        type=str.lower,
+        default="butter",
+    )
+    parser.add_argument("--optitrack_filter_order", type=int, default=4)
+    parser.add_argument("--optitrack_filter_cutoff", type=float, default=0.1)
+    parser.add_argument("--optitrack_filter_config", type=str, default=None)
+    parser.add_argument(
+        "--optitrack_predict",
+        choices=["none"] + list(PREDICTORS),
+        type=str.lower,
+        default="none",
+    )
+    parser.add_argument("--predict_link_ms", type=float, default=5.0)
+    parser.add_argument("--setpoint_rate", type=float, default=20.0)
+    parser.add_argument("--extpos_rate", type=float, default=None)
+    parser.add_argument("--extpos_on_frame", action="store_true")
+    parser.add_argument("--extpos_decimation", type=int, default=1)
+    parser.add_argument("--log_background", action="store_true")
+    parser.add_argument("--log_streams", action="store_true")
+    parser.add_argument("--log_sync_clock", action="store_true")
+    parser.add_argument("--log_loop", action="store_true")
+    parser.add_argument("--log_tap", type=str, default=None)
+    parser.add_argument("--log_tap_rows", type=int, default=4096)
+    parser.add_argument("--log_tap_replace", action="store_true")
+    parser.add_argument(
+        "--log_format",
+        choices=["csv", "binary", "parquet"],
+        type=str.lower,
+        default="csv",
+    )
+    parser.add_argument(
+        "--log_compression",
+        choices=["none", "auto", "gzip", "zstd", "lz4"],
+        type=str.lower,
+        default="none",
+    )
+    parser.add_argument("--log_rotate_mb", type=float, default=None)
+    parser.add_argument("--log_rotate_min", type=float, default=None)
+    parser.add_argument("--log_keep", type=int, default=None)
     parser.add_argument("--filename", type=str, default=None)
     parser.add_argument("--uri", type=str, default="radio://0/80/2M/E7E7E7E7E7")
     args = vars(parser.parse_args())
@@ -18,6 +18,8 @@
 # Uses the Python NatNetClient.py library to establish a connection (by creating a NatNetClient),
 # and receive data via a NatNet connection and decode it using the NatNetClient library.
 
+import time
+
 from flight.NatNetClient import NatNetClient
 
 # This is a callback function that gets connected to the NatNet client and called once per mocap frame.
@@ -56,6 +58,12 @@ streamingClient.newFrameListener = receiveNewFrame
 streamingClient.rigidBodyListener = receiveRigidBodyFrame
 
 # Start up the streaming client now that the callbacks are set up.
-# This will run perpetually, and operate on a separate thread.
+# It receives on separate threads, which don't keep the process alive, so wait here
+# until Ctrl+C.
 streamingClient.run()
 print("streaming client started")
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    streamingClient.stop()
@@ -45,19 +45,13 @@ def ot2ned(vector_3d_ot):
 
 
 def ot2control(vector_3d_ot):
-    # Convert vector from OptiTrack coordinates to Crazyflie control coordinates
-    vector_3d_ctrl = np.zeros(3)
-    vector_3d_ctrl[0] = vector_3d_ot[2]  # CONTROL.x = OT.z
-    vector_3d_ctrl[1] = vector_3d_ot[0]  # CONTROL.y = OT.x
-    vector_3d_ctrl[2] = vector_3d_ot[1]  # CONTROL.z = OT.y
+    # Convert vector(s) from OptiTrack coordinates to Crazyflie control coordinates
+    # CONTROL.x = OT.z, CONTROL.y = OT.x, CONTROL.z = OT.y
+    # Works on a single vector or on an array of vectors along the last axis
+    return np.asarray(vector_3d_ot, dtype=float)[..., [2, 0, 1]]
 
-    return vector_3d_ctrl
 
 def ot2control_quat(quaternion_4d_ot):
-    quaternion_4d_ctrl = np.zeros(4)
-    quaternion_4d_ctrl[0] = quaternion_4d_ot[2] # CONTROL.x = OT.z
-    quaternion_4d_ctrl[1] = quaternion_4d_ot[0] # CONTROL.y = OT.x
-    quaternion_4d_ctrl[2] = quaternion_4d_ot[1] # CONTROL.z = OT.y
-    quaternion_4d_ctrl[3] = quaternion_4d_ot[3]
-    
-    return quaternion_4d_ctrl
\ No newline at end of file
+    # CONTROL.x = OT.z, CONTROL.y = OT.x, CONTROL.z = OT.y, CONTROL.w = OT.w
+    # Works on a single quaternion or on an array of quaternions along the last axis
+    return np.asarray(quaternion_4d_ot, dtype=float)[..., [2, 0, 1, 3]]
@@ -0,0 +1,24 @@
+from flight.NatNetClient import ReceiveStats
+
+
+def feed(frameNumbers):
+    stats = ReceiveStats()
+    for frameNumber in frameNumbers:
+        stats.frame(frameNumber)
+    return stats
+
+
+def test_missed_and_reordered():
+    stats = feed([1, 2, 4, 3, 5])
+    assert stats.missedFrames == 1
+    assert stats.reorderedFrames == 1
+    assert stats.resets == 0
+
+
+def test_reset_is_not_reordered():
+    # Motive restarts counting, e.g. when a recording starts
+    stats = feed([5000, 5001, 5002, 1, 2, 3, 5])
+    assert stats.resets == 1
+    assert stats.reorderedFrames == 0
+    assert stats.missedFrames == 1
+    assert stats.lastFrameNumber == 5